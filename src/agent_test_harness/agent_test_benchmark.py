@@ -1,13 +1,25 @@
+import asyncio
 import logging
 import os
 import time
 
 from typing import Optional
 
+from .fan_out import merge_cobertura, merge_diffs
 from .llm_proxy import LLMProxy
-from .workspace_provider import CommandOutput, WorkspaceProvider
+from .workspace_provider import CommandOutput, SharedWorkspaceProvider, WorkspaceProvider, log_excerpt
 from .swe_bench_types import SWEBenchItem
-from .test_validation import parse_test_results
+from .snapshot_cache import WorkspaceSnapshot
+from .test_impact import TestImpact, impact_test_command, supports_test_impact
+from .test_selection import FULL, TARGETED, targeted_test_command, template_key
+from .test_validation import TestResults, missing_tests, parse_test_results
+
+# Commits the workspace as it was set up and prints the commit, which diffs are taken against
+INITIAL_GIT_REF_COMMAND = ("git config user.name 'agent-test-harness'; git config user.email 'agent-test-harness@example.com'; "
+                           "git commit -a -m \"benchmark-head\" 1>/dev/null; git rev-parse HEAD")
+
+# Environment variables that belong to a single run, they are not kept in workspace snapshots
+RUN_ENVIRONMENT_VARIABLES = ("OPENAI_API_KEY", "OTEL_SERVICE_NAME")
 
 class AgentTestBenchmark:
     run_name: str
@@ -23,9 +35,20 @@ class AgentTestBenchmark:
     repository_name: str
     swebench_item: Optional[SWEBenchItem]
     files: Optional[list]
+    snapshot: Optional[WorkspaceSnapshot]
+    # Local file the agent's output is streamed to, if None it is kept in memory
+    log_path: Optional[str]
+    # Run only the instance's tests for SWE-bench validation when the repository template can select them
+    targeted_tests: bool
+    # Rerun only the tests impacted by the agent's changes after each file in test writing mode
+    test_impact: bool
+    # Number of files the agent works on at once in separate workspaces in test writing mode, 1 runs them in sequence
+    fan_out: int
 
     def __init__(self, name: str, llm_proxy: LLMProxy, workspace_provider: WorkspaceProvider, 
-                agent: dict, repository: dict, swebench_item: Optional[SWEBenchItem] = None):
+                agent: dict, repository: dict, swebench_item: Optional[SWEBenchItem] = None,
+                snapshot: Optional[WorkspaceSnapshot] = None, log_path: Optional[str] = None,
+                targeted_tests: bool = False, test_impact: bool = False, fan_out: int = 1):
         self.llm_proxy = llm_proxy
         self.workspace_provider = workspace_provider
         self.agent = agent
@@ -38,6 +61,11 @@ class AgentTestBenchmark:
         self.repository_path = "/" + self.repository_name
         self.name = name
         self.swebench_item = swebench_item
+        self.snapshot = snapshot
+        self.log_path = log_path
+        self.targeted_tests = targeted_tests
+        self.test_impact = test_impact
+        self.fan_out = fan_out
         # Only set files if not in SWE-bench mode
         self.files = None if swebench_item else self.repository["files"]
 
@@ -64,11 +92,22 @@ class AgentTestBenchmark:
             
         return env
 
-    def run(self):
+    def provision(self):
+        """Create the LLM proxy project and the workspace, running its setup script."""
         logging.info("Provisioning LLM proxy...")
         self.provision_llm_proxy()
         logging.info("Provisioning workspace...")
         self.provision_workspace()
+
+    def run(self):
+        # Workspaces can be provisioned ahead of time by a WorkspacePool
+        if self.workspace is None:
+            self.provision()
+
+        if self.log_path:
+            # Start from an empty log if the run is repeated
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            open(self.log_path, "w").close()
         
         if self.swebench_item:
             logging.info(f"\nRunning SWE-bench item:")
@@ -98,18 +137,15 @@ class AgentTestBenchmark:
 
         """Run the benchmark in SWE-bench mode."""
         logging.info("Running SWE-bench validation...")
-        test_result = self.run_test_coverage()
-        
         # Parse test results regardless of whether the run failed
-        test_results = parse_test_results(test_result.output)
-        logging.info("\nTest Results:")
-        logging.info(f"Passed tests: {test_results.passed}")
-        logging.info(f"Failed tests: {test_results.failed}")
+        test_result, test_results = self.run_swebench_tests()
+        logging.info(f"\nTest Results: {len(test_results.passed)} passed, {len(test_results.failed)} failed")
+        logging.debug(f"Passed tests: {test_results.passed}")
+        logging.debug(f"Failed tests: {test_results.failed}")
             
         # Only validate that expected passing tests are passing in pre-agent state
-        validation_passed = all(test in test_results.passed for test in self.swebench_item.PASS_TO_PASS)
-        if not validation_passed:
-            missing_passing = [test for test in self.swebench_item.PASS_TO_PASS if test not in test_results.passed]
+        missing_passing = missing_tests(self.swebench_item.PASS_TO_PASS, test_results.passed)
+        if missing_passing:
             logging.error(f"SWE-bench validation failed - these tests should be passing but aren't: {missing_passing}")
             self.results["error"] = f"SWE-bench pre-run validation failed - these tests should be passing but aren't: {missing_passing}"
             self.results["validation_failed"] = True
@@ -152,32 +188,31 @@ class AgentTestBenchmark:
         if easy_pass:
             result = CommandOutput(exit_code=0, output="Did not actually run agent, because instance is easy_pass.")
         else:
-            result = self.run_command_in_workdir(self.agent["command"], this_env)
+            result = self.run_agent(this_env)
 
         end_time = time.time()
 
         self.results["agent_output"] = result.output
+        if result.log_path:
+            self.results["agent_output_path"] = result.log_path
 
         # Check if the fix worked
-        test_result = self.run_test_coverage()
+        test_result, test_results = self.run_swebench_tests()
         if not test_result.failed():
-            test_results = parse_test_results(test_result.output)
-            logging.info("\nPost-agent test results:")
-            logging.info(f"Passed tests: {test_results.passed}")
-            logging.info(f"Failed tests: {test_results.failed}")
+            logging.info(f"\nPost-agent test results: {len(test_results.passed)} passed, {len(test_results.failed)} failed")
+            logging.debug(f"Passed tests: {test_results.passed}")
+            logging.debug(f"Failed tests: {test_results.failed}")
             
             # Check that all PASS_TO_PASS tests are still passing
-            pass_to_pass_ok = all(test in test_results.passed for test in self.swebench_item.PASS_TO_PASS)
-            if not pass_to_pass_ok:
-                missing_passing = [test for test in self.swebench_item.PASS_TO_PASS if test not in test_results.passed]
+            missing_passing = missing_tests(self.swebench_item.PASS_TO_PASS, test_results.passed)
+            if missing_passing:
                 logging.error(f"Regression: these tests should be passing but aren't: {missing_passing}")
                 self.results["error"] = f"Regression: these tests should be passing but aren't: {missing_passing}"
                 return self.results
             
             # Check that none of the FAIL_TO_PASS tests are failing
-            fail_to_pass_ok = not any(test in test_results.failed for test in self.swebench_item.FAIL_TO_PASS)
-            if not fail_to_pass_ok:
-                still_failing = [test for test in self.swebench_item.FAIL_TO_PASS if test in test_results.failed]
+            still_failing = [test for test in self.swebench_item.FAIL_TO_PASS if test in test_results.failed]
+            if still_failing:
                 logging.error(f"Fix incomplete: these tests are still failing: {still_failing}")
                 self.results["error"] = f"Fix incomplete: these tests are still failing: {still_failing}"
                 return self.results
@@ -204,44 +239,160 @@ class AgentTestBenchmark:
         logging.info("Establishing initial git ref...")
         self.establish_initial_git_ref()
 
-        logging.info("Running coverage tool...")
-        self.results["initial_coverage_tool_output"] = self.get_test_coverage()
+        fan_out = self.fan_out > 1 and len(self.files) > 1
+        impact = None
+        if self.test_impact and not fan_out and supports_test_impact(self.repository):
+            logging.info("Running coverage tool with test contexts...")
+            self.results["initial_coverage_tool_output"], impact = self.get_test_coverage_with_contexts()
+        else:
+            logging.info("Running coverage tool...")
+            self.results["initial_coverage_tool_output"] = self.get_test_coverage()
 
         logging.info("Running agent...")
         start_time = time.time()
         env = self.environment_variables()
-        log = ""
-
-        for file, test_file in self.files:
-            log += f"Running agent on file {file}\n"
-            this_env = {
-                **env,
-                "PROMPT": f"Write unit tests for {file} until it has 100% coverage, make sure to add the files to {test_file}. Do not modify the original code, only add tests. Do not modify other files than {test_file} or test helper files. If you believe that a piece of code can not be tested without modifying it (for example to inject a dependency), skip it. If you added a test that you can't get to pass, remove it before stopping. This is not an interactive chat, so don't ask for extra information or any action from a user. Either use the tools or clean up failing tests and stop."
-            }
-            result = self.run_command_in_workdir(self.agent["command"], this_env)
-            log += result.output
-
-            logging.info("Running tests again...")
-            test_result = self.run_test_coverage()
-            coverage_result = self.read_test_coverage()
-            
-            if coverage_result.succeeded():
-                self.results["final_coverage_tool_output"] = coverage_result.output
-
-            if test_result.failed():
-                logging.info("Test command failed. Stopping benchmark...")
-                break
+        log = []
+        impact_stats = {"iterations": 0, "selected_tests": 0, "skipped_runs": 0}
+        git_diff = None
 
-        self.results["agent_output"] = log
+        if fan_out:
+            git_diff = self.run_fan_out(env, log)
+        else:
+            for file, test_file in self.files:
+                self.append_log(log, f"Running agent on file {file}\n")
+                this_env = {
+                    **env,
+                    "PROMPT": self.file_prompt(file, test_file)
+                }
+                result = self.run_agent(this_env)
+                if not self.log_path:
+                    log.append(result.output)
+
+                if impact:
+                    tests = impact.tests_for(self.changed_files(), file)
+                    impact_stats["iterations"] += 1
+                    impact_stats["selected_tests"] += len(tests)
+                    if not tests:
+                        logging.info(f"No tests impacted by the changes for {file}")
+                        impact_stats["skipped_runs"] += 1
+                        continue
+                    logging.info(f"Running {len(tests)} impacted test file(s)...")
+                    test_result = self.run_command_in_workdir(impact_test_command(self.repository, tests))
+                else:
+                    logging.info("Running tests again...")
+                    test_result = self.run_test_coverage()
+                    coverage_result = self.read_test_coverage()
+
+                    if coverage_result.succeeded():
+                        self.results["final_coverage_tool_output"] = coverage_result.output
+
+                if test_result.failed():
+                    logging.info("Test command failed. Stopping benchmark...")
+                    break
+
+            if impact:
+                # The impacted runs only cover part of the suite, the final coverage comes from one full run
+                logging.info("Running tests for the final coverage...")
+                self.run_test_coverage()
+                coverage_result = self.read_test_coverage()
+                if coverage_result.succeeded():
+                    self.results["final_coverage_tool_output"] = coverage_result.output
+                self.results["test_impact"] = impact_stats
+
+        if self.log_path:
+            self.results["agent_output"] = log_excerpt(self.log_path)
+            self.results["agent_output_path"] = self.log_path
+        else:
+            self.results["agent_output"] = "".join(log)
         end_time = time.time()
         self.results["agent_execution_time"] = end_time - start_time
-        logging.info("Running git diff...")
-        self.results["git_diff"] = self.run_git_diff()
+        if fan_out:
+            self.results["git_diff"] = git_diff
+        else:
+            logging.info("Running git diff...")
+            self.results["git_diff"] = self.run_git_diff()
         logging.info("Getting LLM metrics...")
         self.results["llm_metrics"] = self.get_llm_metrics()
 
         return self.results
 
+    def file_prompt(self, file: str, test_file: str) -> str:
+        return f"Write unit tests for {file} until it has 100% coverage, make sure to add the files to {test_file}. Do not modify the original code, only add tests. Do not modify other files than {test_file} or test helper files. If you believe that a piece of code can not be tested without modifying it (for example to inject a dependency), skip it. If you added a test that you can't get to pass, remove it before stopping. This is not an interactive chat, so don't ask for extra information or any action from a user. Either use the tools or clean up failing tests and stop."
+
+    def run_fan_out(self, env: dict, log: list[str]) -> str:
+        """Run the agent on every file in a workspace of its own, at most fan_out at once, and merge the results.
+
+        The workspaces are driven from one event loop through the async workspace provider client. Returns the
+        merged diff. The final coverage is the merged coverage of the workspaces whose diff was merged.
+        """
+        logging.info(f"Running agent on {len(self.files)} files in up to {self.fan_out} parallel workspaces...")
+        outcomes = asyncio.run(self.run_files_in_workspaces(env))
+
+        for (file, _), outcome in zip(self.files, outcomes):
+            self.append_log(log, f"Running agent on file {file}\n")
+            self.append_log(log, outcome["agent_output"])
+
+        merged = merge_diffs([outcome["git_diff"] for outcome in outcomes])
+        for conflict in merged.conflicts:
+            logging.warning(f"Changes for {self.files[conflict['diff']][0]} conflict with those for "
+                            f"{self.files[conflict['conflicts_with']][0]} in {conflict['files']}, leaving them out")
+
+        reports = [merged.remap_coverage(index, outcomes[index]["coverage"])
+                   for index in merged.merged if outcomes[index]["coverage"]]
+        if reports:
+            self.results["final_coverage_tool_output"] = merge_cobertura(reports)
+        self.results["fan_out"] = {
+            "workspaces": len(outcomes),
+            "merged_files": [self.files[index][0] for index in merged.merged],
+            "conflicts": [{**conflict, "diff": self.files[conflict["diff"]][0],
+                           "conflicts_with": self.files[conflict["conflicts_with"]][0]} for conflict in merged.conflicts],
+            "failed_test_runs": [file for (file, _), outcome in zip(self.files, outcomes) if outcome["tests_failed"]],
+        }
+        return merged.diff
+
+    async def run_files_in_workspaces(self, env: dict) -> list[dict]:
+        # Only needed for fan-out, aiohttp is not imported by runs that don't use it
+        from .async_client import AsyncWorkspaceProviderClient
+
+        semaphore = asyncio.Semaphore(self.fan_out)
+        async with AsyncWorkspaceProviderClient.for_provider(self.workspace_provider, limit=self.fan_out) as client:
+            async def run(file: str, test_file: str) -> dict:
+                async with semaphore:
+                    return await self.run_file_in_workspace(client, file, test_file, env)
+
+            return await asyncio.gather(*(run(file, test_file) for file, test_file in self.files))
+
+    async def run_file_in_workspace(self, client, file: str, test_file: str, env: dict) -> dict:
+        """Run the agent on one file in a new workspace set up like this one, then its tests and git diff."""
+        base_env = self.environment_variables()
+        # A shared workspace provider creates workspaces with the run's repository and setup script
+        workspace_config = (self.workspace_provider.workspace_config
+                            if isinstance(self.workspace_provider, SharedWorkspaceProvider) else None)
+        workspace = await client.create_workspace(env=base_env, workspace_config=workspace_config)
+
+        async def run_command(command: str, command_env: Optional[dict] = None) -> CommandOutput:
+            return await client.run_command_with_output(workspace["id"], f"cd {self.repository_path} && {command}",
+                                                        {**base_env, **(command_env or {})})
+
+        try:
+            git_ref = await run_command(INITIAL_GIT_REF_COMMAND)
+            if git_ref.failed():
+                raise Exception(f"Failed to establish initial git ref: {git_ref.output}")
+            result = await run_command(self.agent["command"], {**env, "PROMPT": self.file_prompt(file, test_file)})
+            test_result = await run_command(self.repository["test_command"])
+            coverage_result = await run_command(f'cat {self.repository["coverage_report_path"]}')
+            git_diff = await run_command(f"git diff {git_ref.output.strip()}")
+            if git_diff.failed():
+                raise Exception(f"Git diff failed: {git_diff.output}")
+            return {
+                "agent_output": result.output,
+                "tests_failed": test_result.failed(),
+                "coverage": coverage_result.output if coverage_result.succeeded() else None,
+                "git_diff": git_diff.output,
+            }
+        finally:
+            await client.delete_workspace(workspace["id"])
+
     def run_command_in_workdir(self, command: str, env=None):
         if env is None:
             env = self.environment_variables()
@@ -250,6 +401,21 @@ class AgentTestBenchmark:
             env = {**self.environment_variables(), **env}
         return self.workspace_provider.run_command_with_output(self.workspace["id"], f"cd {self.repository_path} && {command}", env)
 
+    def run_agent(self, env: dict) -> CommandOutput:
+        """Run the agent command, streaming its output to the log file if there is one."""
+        if not self.log_path:
+            return self.run_command_in_workdir(self.agent["command"], env)
+        env = {**self.environment_variables(), **env}
+        return self.workspace_provider.run_command_streaming(
+            self.workspace["id"], f"cd {self.repository_path} && {self.agent['command']}", env, self.log_path)
+
+    def append_log(self, log: list[str], text: str):
+        if self.log_path:
+            with open(self.log_path, "a") as f:
+                f.write(text)
+        else:
+            log.append(text)
+
     def write_file(self, path: str, content: bytes):
         return self.workspace_provider.write_file(self.workspace["id"], path, content)
 
@@ -261,14 +427,75 @@ class AgentTestBenchmark:
 
     def provision_workspace(self):
         self.workspace = self.workspace_provider.create_workspace(env=self.environment_variables())
+        if self.snapshot:
+            self.results["snapshot_restored"] = self.snapshot.restored
+            if not self.snapshot.restored:
+                head = self.run_command_in_workdir("git rev-parse HEAD")
+                self.snapshot.save(self.workspace["id"], head=head.output.strip() if head.succeeded() else None,
+                                   reset_env=RUN_ENVIRONMENT_VARIABLES)
 
     def establish_initial_git_ref(self):
-        commit_context = "git config user.name 'agent-test-harness'; git config user.email 'agent-test-harness@example.com';"
-        output = self.run_command_in_workdir(f"{commit_context} git commit -a -m \"benchmark-head\" 1>/dev/null; git rev-parse HEAD")
+        output = self.run_command_in_workdir(INITIAL_GIT_REF_COMMAND)
         if output.failed():
             raise Exception(f"Failed to establish initial git ref: {output.output}")
         self.initial_git_ref = output.output.strip()
 
+    def run_swebench_tests(self) -> tuple[CommandOutput, TestResults]:
+        """Run the tests SWE-bench validates, only the instance's tests if the repository template can select them.
+
+        Falls back to the full test command when the targeted run reports no test results at all, e.g. because the
+        runner could not find the selected tests. The mode and time of the test runs are kept in the results.
+        """
+        selection = self.results.setdefault("test_selection", {
+            "template": template_key(self.swebench_item),
+            "mode": TARGETED,
+            "invocations": 0,
+            "test_time": 0.0,
+        })
+        command = targeted_test_command(self.repository, self.swebench_item) if self.targeted_tests else None
+
+        start_time = time.time()
+        if command:
+            test_result = self.run_command_in_workdir(command)
+            test_results = parse_test_results(test_result.output)
+            if test_results.passed or test_results.failed:
+                selection["invocations"] += 1
+                selection["test_time"] += time.time() - start_time
+                return test_result, test_results
+            logging.warning(f"Targeted tests of {self.swebench_item.instance_id} reported no results, running the full test suite")
+            start_time = time.time()
+
+        test_result = self.run_test_coverage()
+        test_results = parse_test_results(test_result.output)
+        # Runs that ran the full suite even once are not comparable to targeted runs
+        selection["mode"] = FULL
+        selection["invocations"] += 1
+        selection["test_time"] += time.time() - start_time
+        return test_result, test_results
+
+    def get_test_coverage_with_contexts(self) -> tuple[str, TestImpact]:
+        """Run the tests recording which tests execute each file, returning the coverage report and the test impact."""
+        test_run = self.run_command_in_workdir(self.repository["test_contexts_command"])
+        if test_run.failed():
+            raise Exception(f"Test command failed: {test_run.output}")
+
+        coverage_output = self.read_test_coverage()
+        if coverage_output.failed():
+            raise Exception(f"Failed to read coverage report: {coverage_output.output}")
+
+        contexts_output = self.run_command_in_workdir(f'cat {self.repository["coverage_contexts_path"]}')
+        if contexts_output.failed():
+            raise Exception(f"Failed to read coverage contexts: {contexts_output.output}")
+        return coverage_output.output, TestImpact.from_coverage_json(contexts_output.output)
+
+    def changed_files(self) -> list[str]:
+        """The files changed since the initial git ref, including new files that are not ignored."""
+        result = self.run_command_in_workdir(
+            f"git diff --name-only {self.initial_git_ref} && git ls-files --others --exclude-standard -- '*.py' ':!venv'")
+        if result.failed():
+            raise Exception(f"Listing changed files failed: {result.output}")
+        return [line for line in result.output.splitlines() if line]
+
     def run_test_coverage(self):
         return self.run_command_in_workdir(self.repository["test_command"])
 
@@ -1,54 +1,118 @@
 from .agent_test_benchmark import AgentTestBenchmark
-from .workspace_provider import WorkspaceProvider
+from .workspace_provider import WorkspaceProvider, start_shared_workspace_provider, start_workspace_provider
 from .llm_proxy import LLMProxy
 from .benchmark import Benchmark
+from .snapshot_cache import SnapshotCache, WorkspaceSnapshot
+from .workspace_pool import PreparedRun, WorkspacePool, provisioning_stats
 import logging
+import time
 import traceback
 
+from typing import Optional
+
 class AgentTestHarness:
     llm_proxy: LLMProxy
     config: dict
     runs: int
+    jobs: int
     benchmark: Benchmark
+    shared_workspace_provider: Optional[WorkspaceProvider]
+    snapshot_cache: Optional[SnapshotCache]
 
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, jobs: int = 1, shared_workspace_provider: bool = False,
+                 rebuild_snapshots: bool = False):
         self.config = config
         self.llm_proxy = LLMProxy(config)
         self.llm_proxy.run()
         self.runs = config["runs"]
-        self.benchmark = Benchmark(config, "test_writing", config["agents"], config["repositories"])
+        self.jobs = jobs
+        self.snapshot_cache = SnapshotCache.from_config(config, rebuild=rebuild_snapshots)
+        self.shared_workspace_provider = None
+        if shared_workspace_provider:
+            logging.info("Starting shared workspace provider...")
+            self.shared_workspace_provider = start_shared_workspace_provider(config=config)
+        self.benchmark = Benchmark("test_writing", config, config["agents"], config["repositories"])
 
     def benchmark_agents(self):
-        while next_run := self.benchmark.next_run():
-            repository = next_run["instance"]
-            try:
-                results = self.benchmark_agent(next_run["run_name"],next_run["agent"], repository)
-                self.benchmark.add_result(next_run["run_name"], results)
-            except Exception as e:
-                logging.error(f"Error benchmarking agent {next_run['agent']['name']} on repository {repository['name']}: {e}")
-                backtrace = traceback.format_exc()
-                agent = next_run["agent"]
-                error_result = {
-                    "agent_name": agent["name"],
-                    "agent_version": agent["version"],
-                    "repository_url": repository["url"],
-                    "result": {"error": str(e), "backtrace": backtrace},
-                    "run": next_run["run_name"]
-                }
-                self.benchmark.add_result(next_run["run_name"], error_result)
-
-        return list(self.benchmark.results.values())
-    
-
-    def benchmark_agent(self, run_name: str, agent: dict, repository: dict):
+        logging.info(f"Benchmarking agents with {self.jobs} parallel job(s)...")
+        pool = WorkspacePool.from_config(self.config, self.benchmark.next_run, self.prepare_run,
+                                         requeue=self.benchmark.requeue)
+        try:
+            self.benchmark.run(self.benchmark_run, self.jobs, next_run=pool.next_run if pool else None)
+        finally:
+            if pool:
+                pool.close()
+        logging.info(f"LLM proxy latency per endpoint: {self.llm_proxy.latency_stats()}")
+        # Results are loaded one at a time while they are reported, reusing cached stats
+        return self.benchmark.results
+
+    def benchmark_run(self, next_run: dict):
+        repository = next_run["instance"]
+        try:
+            results = self.benchmark_agent(next_run)
+            self.benchmark.add_result(next_run["run_name"], results)
+        except Exception as e:
+            logging.error(f"Error benchmarking agent {next_run['agent']['name']} on repository {repository['name']}: {e}")
+            backtrace = traceback.format_exc()
+            agent = next_run["agent"]
+            error_result = {
+                "agent_name": agent["name"],
+                "agent_version": agent["version"],
+                "repository_url": repository["url"],
+                "result": {"error": str(e), "backtrace": backtrace},
+                "run": next_run["run_name"]
+            }
+            self.benchmark.add_result(next_run["run_name"], error_result)
+
+    def prepare_run(self, next_run: dict) -> PreparedRun:
+        """Start the workspace provider and provision the workspace for a run."""
+        run_name = next_run["run_name"]
+        agent = next_run["agent"]
+        repository = next_run["instance"]
+
         repository_setup_script = repository["setup_script"]
         agent_setup_script = agent["setup_script"]
         setup_script = f"{repository_setup_script}\n\n# Agent setup script:\n\n{agent_setup_script}"
 
         logging.info(f"Initializing workspace provider for run {run_name}...")
 
-        workspace_provider = WorkspaceProvider(run_name, repository, setup_script)
-        workspace_provider.run()
+        snapshot = WorkspaceSnapshot.lookup(self.snapshot_cache, repository["url"], repository.get("commit"), setup_script)
+        if snapshot and snapshot.restored:
+            logging.info(f"Restoring workspace for run {run_name} from snapshot {snapshot.image}...")
+
+        workspace_provider = start_workspace_provider(run_name, repository, setup_script,
+                                                      daemon=self.shared_workspace_provider,
+                                                      parallel=self.jobs > 1 or self.config.get("workspace_pool") is not None,
+                                                      image=snapshot.image if snapshot else None,
+                                                      config=self.config)
+
+        logging.info(f"Initializing agent test benchmark for run {run_name}...")
+        agent_test_benchmark = AgentTestBenchmark(run_name, self.llm_proxy, workspace_provider, agent, repository,
+                                                  snapshot=snapshot, log_path=self.benchmark.log_path(run_name),
+                                                  test_impact=self.config.get("test_impact", False),
+                                                  fan_out=self.config.get("fan_out", 1))
+        try:
+            agent_test_benchmark.provision()
+        except Exception:
+            workspace_provider.stop()
+            raise
+
+        return PreparedRun(workspace_provider, agent_test_benchmark, snapshot)
+
+    def benchmark_agent(self, next_run: dict):
+        run_name = next_run["run_name"]
+        agent = next_run["agent"]
+        repository = next_run["instance"]
+
+        if "prepare_error" in next_run:
+            raise next_run["prepare_error"]
+
+        prepared = next_run.get("prepared")
+        if prepared is None:
+            start_time = time.time()
+            prepared = self.prepare_run(next_run)
+            provisioning_time = time.time() - start_time
+            next_run["provisioning"] = provisioning_stats(provisioning_time, provisioning_time)
 
         # TODO also add repository revision
         benchmark_result = {
@@ -59,12 +123,17 @@ class AgentTestHarness:
             "run": run_name
         }
 
-        logging.info(f"Initializing agent test benchmark for run {run_name}...")
-        agent_test_benchmark = AgentTestBenchmark(run_name, self.llm_proxy, workspace_provider, agent, repository)
-
-        logging.info(f"Running agent test benchmark for run {run_name}...")
-        benchmark_result["result"] = agent_test_benchmark.run()
-
-        workspace_provider.stop()
+        logging.info(f"Running agent test benchmark for run {run_name} "
+                     f"(provisioning time saved: {next_run['provisioning']['saved_time']:.1f}s)...")
+        prepared.agent_test_benchmark.results["provisioning"] = next_run["provisioning"]
+        try:
+            benchmark_result["result"] = prepared.agent_test_benchmark.run()
+            benchmark_result["result"]["http_latency"] = prepared.workspace_provider.latency_stats()
+            benchmark_result["result"]["startup_times"] = {
+                "llm_proxy": self.llm_proxy.startup_time,
+                "workspace_provider": prepared.workspace_provider.startup_time,
+            }
+        finally:
+            prepared.stop()
 
         return benchmark_result
@@ -0,0 +1,142 @@
+# Aggregation of per-run statistics into per-agent, per-model and per-repository rollups
+#
+# Every run and every LLM metric is visited once: runs are folded into running totals for their agent, and for the
+# agent's repositories and models, so reporting stays linear in the number of runs and metrics.
+
+from typing import Iterable, Optional
+
+class Average:
+    """A running mean of the values that are not None."""
+    total: float
+    count: int
+
+    def __init__(self):
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, value: Optional[float]):
+        if value is not None:
+            self.total += value
+            self.count += 1
+
+    def value(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+class TokenTotals:
+    completions_count: int
+    total_completion_tokens: int
+    total_prompt_tokens: int
+    total_token_count: int
+
+    def __init__(self):
+        self.completions_count = 0
+        self.total_completion_tokens = 0
+        self.total_prompt_tokens = 0
+        self.total_token_count = 0
+
+    def add_metric(self, llm_metric: dict):
+        self.completions_count += 1
+        self.total_completion_tokens += llm_metric["completion_token_count"]
+        self.total_prompt_tokens += llm_metric["prompt_token_count"]
+        self.total_token_count += llm_metric["total_token_count"]
+
+    def add_totals(self, totals: dict):
+        # Failed runs have no token counts
+        self.completions_count += totals.get("completions_count") or 0
+        self.total_completion_tokens += totals.get("total_completion_tokens") or 0
+        self.total_prompt_tokens += totals.get("total_prompt_tokens") or 0
+        self.total_token_count += totals.get("total_token_count") or 0
+
+    def to_dict(self) -> dict:
+        return {
+            "completions_count": self.completions_count,
+            "total_completion_tokens": self.total_completion_tokens,
+            "total_prompt_tokens": self.total_prompt_tokens,
+            "total_token_count": self.total_token_count,
+        }
+
+def model_stats(llm_metrics: list[dict]) -> tuple[TokenTotals, list[dict]]:
+    """The token totals of a run, overall and per model, in one pass over its LLM metrics."""
+    totals = TokenTotals()
+    models = {}
+    for llm_metric in llm_metrics:
+        totals.add_metric(llm_metric)
+        models.setdefault(llm_metric["model_name"], TokenTotals()).add_metric(llm_metric)
+    return totals, [{"name": name, **model.to_dict()} for name, model in models.items()]
+
+class Rollup:
+    """Totals and averages over a group of run stats."""
+
+    def __init__(self):
+        self.runs_count = 0
+        self.successful_runs_count = 0
+        self.tokens = TokenTotals()
+        self.coverage_diff = Average()
+        self.coverage_before = Average()
+        self.coverage_after = Average()
+        self.agent_execution_time = Average()
+        self.provisioning_saved_time = 0.0
+
+    def add(self, run_stats: dict):
+        self.runs_count += 1
+        self.successful_runs_count += bool(run_stats["successful"])
+        self.tokens.add_totals(run_stats)
+        # Coverage is averaged over successful runs only, a failed run may still have its initial coverage
+        if run_stats["successful"]:
+            for field, average in (("coverage_diff", self.coverage_diff), ("coverage_before", self.coverage_before),
+                                   ("coverage_after", self.coverage_after)):
+                average.add(run_stats[field]["line_rate"] if run_stats[field] else None)
+        self.agent_execution_time.add(run_stats["agent_execution_time"])
+        self.provisioning_saved_time += run_stats["provisioning_saved_time"] or 0
+
+    def to_dict(self) -> dict:
+        return {
+            "total_completion_tokens": self.tokens.total_completion_tokens,
+            "total_prompt_tokens": self.tokens.total_prompt_tokens,
+            "total_token_count": self.tokens.total_token_count,
+            "runs_count": self.runs_count,
+            "successful_runs_count": self.successful_runs_count,
+            "average_coverage_diff": self.coverage_diff.value(),
+            "total_provisioning_saved_time": self.provisioning_saved_time,
+            "average_agent_execution_time": self.agent_execution_time.value(),
+            "average_coverage_before": self.coverage_before.value(),
+            "average_coverage_after": self.coverage_after.value(),
+        }
+
+class AgentRollup(Rollup):
+    """A rollup of an agent's runs, with rollups per repository and token totals per model."""
+
+    def __init__(self, name: str):
+        super().__init__()
+        self.name = name
+        self.runs = []
+        self.repositories = {}
+        self.models = {}
+
+    def add(self, run_stats: dict):
+        super().add(run_stats)
+        self.runs.append(run_stats)
+        self.repositories.setdefault(run_stats["repository_url"], Rollup()).add(run_stats)
+        for model in run_stats["models"] or []:
+            self.models.setdefault(model["name"], TokenTotals()).add_totals(model)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "runs": self.runs,
+            **super().to_dict(),
+            "models": [{"name": name, **model.to_dict()} for name, model in self.models.items()],
+            "repositories": [
+                {"repository_url": repository_url, **repository.to_dict()}
+                for repository_url, repository in self.repositories.items()
+            ],
+        }
+
+def aggregate(run_stats: Iterable[tuple[str, dict]]) -> list[dict]:
+    """Roll (agent name, run stats) pairs up per agent, in the order the agents first appear."""
+    agents = {}
+    for agent_name, stats in run_stats:
+        if agent_name not in agents:
+            agents[agent_name] = AgentRollup(agent_name)
+        agents[agent_name].add(stats)
+    return [agent.to_dict() for agent in agents.values()]
@@ -0,0 +1,140 @@
+# Asyncio clients for the workspace provider (derrick) and the LLM proxy (amsterdam)
+#
+# These mirror the request methods of WorkspaceProvider and LLMProxy, but share one pooled aiohttp session per client so
+# a single event loop can keep hundreds of workspace commands in flight. Process management (starting and stopping the
+# services) stays with the sync classes; the async clients only talk to services that are already running. Fan-out runs
+# drive all their per-file workspaces through one AsyncWorkspaceProviderClient.
+
+import asyncio
+import base64
+import logging
+
+from typing import Any, Iterable, Optional
+
+import aiohttp
+
+from .workspace_provider import CommandOutput
+
+DEFAULT_CONNECTION_LIMIT = 100
+# Workspace commands (test suites, agents) can run for a long time, so only connecting is bounded
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=30)
+
+class AsyncHttpClient:
+    base_url: str
+    limit: int
+    session: Optional[aiohttp.ClientSession]
+
+    def __init__(self, base_url: str, limit: int = DEFAULT_CONNECTION_LIMIT, session: Optional[aiohttp.ClientSession] = None):
+        self.base_url = base_url
+        self.limit = limit
+        self.session = session
+        self.owns_session = session is None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _session(self) -> aiohttp.ClientSession:
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=DEFAULT_TIMEOUT)
+        return self.session
+
+    async def close(self):
+        if self.session is not None and self.owns_session:
+            await self.session.close()
+        self.session = None
+
+    def _error(self, status: int, text: str) -> Exception:
+        return Exception(f"Service returned status code {status}: {text}")
+
+    async def _request(self, method: str, path: str, **kwargs) -> Any:
+        async with self._session().request(method, f"{self.base_url}/{path}", **kwargs) as response:
+            text = await response.text()
+            if response.status >= 400:
+                raise self._error(response.status, text)
+            try:
+                return await response.json(content_type=None)
+            except ValueError:
+                raise self._error(response.status, text)
+
+class AsyncWorkspaceProviderClient(AsyncHttpClient):
+    @classmethod
+    def for_provider(cls, workspace_provider, **kwargs) -> "AsyncWorkspaceProviderClient":
+        """Create a client for a running WorkspaceProvider (or SharedWorkspaceProvider)."""
+        return cls(workspace_provider.base_url, **kwargs)
+
+    def _error(self, status: int, text: str) -> Exception:
+        return Exception(f"Workspace provider returned status code {status}: {text}")
+
+    async def health(self):
+        return await self._request("GET", "health")
+
+    async def create_workspace(self, env: dict, workspace_config: Optional[dict] = None):
+        logging.info("Creating workspace...")
+        body = {"env": env}
+        if workspace_config is not None:
+            body["workspace_config"] = workspace_config
+        return await self._request("POST", "workspaces", json=body)
+
+    async def delete_workspace(self, workspace_id: str):
+        await self._request("DELETE", f"workspaces/{workspace_id}")
+
+    async def list_workspaces(self):
+        return await self._request("GET", "workspaces")
+
+    async def run_command_with_output(self, workspace_id: str, command: str, env: dict = None) -> CommandOutput:
+        result = await self._request("POST", f"workspaces/{workspace_id}/cmd_with_output", json={
+            "cmd": command,
+            "env": env or {}
+        })
+        return CommandOutput(exit_code=result["exit_code"], output=result["output"])
+
+    async def run_commands(self, commands: Iterable[tuple[str, str, Optional[dict]]], concurrency: int = DEFAULT_CONNECTION_LIMIT) -> list[CommandOutput]:
+        """Run (workspace_id, command, env) tuples concurrently, returning outputs in the same order.
+
+        At most `concurrency` commands are in flight at once; the rest wait for a free slot instead of a connection.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(workspace_id: str, command: str, env: Optional[dict]):
+            async with semaphore:
+                return await self.run_command_with_output(workspace_id, command, env)
+
+        return await asyncio.gather(*(run(*command) for command in commands))
+
+    async def write_file(self, workspace_id: str, path: str, content: bytes):
+        content_base64 = base64.b64encode(content).decode("utf-8")
+        return await self._request("POST", f"workspaces/{workspace_id}/write_file", json={"path": path, "content": content_base64})
+
+    async def read_file(self, workspace_id: str, path: str):
+        return await self._request("POST", f"workspaces/{workspace_id}/read_file", json={"path": path})
+
+class AsyncLLMProxyClient(AsyncHttpClient):
+    admin_token: str
+
+    def __init__(self, base_url: str, admin_token: str, **kwargs):
+        super().__init__(base_url, **kwargs)
+        self.admin_token = admin_token
+
+    @classmethod
+    def for_proxy(cls, llm_proxy, **kwargs) -> "AsyncLLMProxyClient":
+        """Create a client for a running LLMProxy."""
+        return cls(llm_proxy.base_url, llm_proxy.admin_token, **kwargs)
+
+    def _error(self, status: int, text: str) -> Exception:
+        return Exception(f"LLM proxy returned status code {status}: {text}")
+
+    async def create_project(self, project_name: str):
+        logging.info(f"Creating project {project_name}...")
+        project = await self._request("POST", "admin/v1/projects", headers={"Authorization": f"Bearer {self.admin_token}"}, json={
+            "name": project_name,
+            "description": "Created by agent test harness"
+        })
+        logging.info(f"Project created: {project}")
+        return project
+
+    async def get_metrics(self, project_token: str):
+        return await self._request("GET", "v1/metrics", headers={"Authorization": f"Bearer {project_token}"})
@@ -1,49 +1,162 @@
 import os
-import json
+import logging
+import threading
+import traceback
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .result_fields import LargeFields
+from .results_store import JSON_STORE, ResultsStore, open_results_path, open_results_store
+from .scheduling import DEFAULT_ORDER, LONGEST_FIRST, DurationEstimator, estimate_makespan
 
 class Benchmark:
     name: str
     agents: list[dict]
     instances: list[dict]
-    results: dict[str, dict]
+    results: ResultsStore
     output_path: str
+    pending: deque[dict]
+    leased: dict[str, dict]
+    schedule: str
+    estimates: dict[str, float]
 
     def __init__(self, name: str, config: dict, agents: list[dict], instances: list[dict]):
         self.name = name
         self.config = config
         self.agents = agents
         self.instances = instances
-        self.results = {}
+        # Runs handed out by next_run that have not reported a result yet, by run name
+        self.leased = {}
+        self.lock = threading.Lock()
 
         self.output_path = os.path.join(config["results_path"], name)
         os.makedirs(self.output_path, exist_ok=True)
-        
+
         self.runs_path = os.path.join(self.output_path, "runs")
         os.makedirs(self.runs_path, exist_ok=True)
 
-        for file in os.listdir(self.runs_path):
-            with open(os.path.join(self.runs_path, file), "r") as f:
-                run_name = file.split(".json")[0]
-                self.results[run_name] = json.load(f)
+        # Full command output of the runs, results only keep an excerpt
+        self.logs_path = os.path.join(self.output_path, "logs")
+        os.makedirs(self.logs_path, exist_ok=True)
+
+        # Only the summaries of finished runs are read here, results are loaded when they are reported
+        self.results = open_results_store(self.output_path, config.get("results_store", JSON_STORE),
+                                          LargeFields.from_config(config.get("large_fields")))
+
+        self.schedule = config.get("schedule", DEFAULT_ORDER)
+        self.estimates = {}
+        # The runs without a stored result, computed once so next_run doesn't rescan all runs on every call
+        self.pending = deque(run for run in self.order_runs() if run["run_name"] not in self.results)
+
+    def instance_id(self, instance) -> str:
+        # SWE-bench instances are SWEBenchItems, test writing instances are repository dicts
+        if isinstance(instance, dict):
+            return instance["name"]
+        return instance.instance_id
 
     def run_name(self, agent: dict, instance, iteration: int):
-        return f"{agent['name']}-{agent['version']}-{instance.instance_id}-{iteration}"
+        return f"{agent['name']}-{agent['version']}-{self.instance_id(instance)}-{iteration}"
+
+    def log_path(self, run_name: str) -> str:
+        return os.path.join(self.logs_path, f"{run_name}.log")
 
     def add_result(self, run_name: str, result: dict):
-        self.results[run_name] = result
-        with open(os.path.join(self.runs_path, f"{run_name}.json"), "w") as f:
-            json.dump(result, f, indent=2)
+        with self.lock:
+            run = self.leased.get(run_name)
+        self.results.add(run_name, result, iteration=run["iteration"] if run else None)
+        with self.lock:
+            self.leased.pop(run_name, None)
+
+    def order_runs(self) -> list[dict]:
+        """All runs in the order they are handed out: agent, instance, iteration or, with the longest_first
+        schedule, by estimated duration with the longest runs first."""
+        runs = [{
+                    "agent": agent,
+                    "agent_version": agent["version"],
+                    "instance": instance,
+                    "iteration": iteration,
+                    "run_name": self.run_name(agent, instance, iteration)
+                }
+                for agent in self.agents
+                for instance in self.instances
+                for iteration in range(self.config["runs"])]
+        if self.schedule != LONGEST_FIRST:
+            return runs
+
+        history = self.results.entries()
+        for path in self.config.get("schedule_history", []):
+            if not os.path.exists(path):
+                logging.warning(f"Duration history path {path} does not exist")
+                continue
+            history += open_results_path(path, read_only=True).entries()
+        estimator = DurationEstimator(history)
+        for run in runs:
+            self.estimates[run["run_name"]] = estimator.estimate(run["agent"], run["instance"])
+
+        # sorted() is stable, so runs with equal estimates keep their default order
+        return sorted(runs, key=lambda run: -self.estimates[run["run_name"]])
 
     def next_run(self):
-        for agent in self.agents:
-            for instance in self.instances:
-                for iteration in range(self.config["runs"]):
-                    run_name = self.run_name(agent, instance, iteration)
-                    if run_name not in self.results:
-                        return {
-                            "agent": agent,
-                            "agent_version": agent["version"],
-                            "instance": instance,
-                            "run_name": run_name
-                        }
-        return None
\ No newline at end of file
+        """Lease the next pending run, or return None when all runs are done or leased."""
+        with self.lock:
+            if not self.pending:
+                return None
+            run = self.pending.popleft()
+            self.leased[run["run_name"]] = run
+        # Callers attach per-run state (e.g. the prepared workspace), so hand out a copy
+        return dict(run)
+
+    def release(self, run_name: str):
+        """Drop the lease of a run that did not finish, without handing it out again."""
+        with self.lock:
+            self.leased.pop(run_name, None)
+
+    def requeue(self, run_name: str):
+        """Return a leased run that did not finish to the front of the pending runs."""
+        with self.lock:
+            run = self.leased.pop(run_name, None)
+            if run is not None and run_name not in self.results:
+                self.pending.appendleft(run)
+
+    def log_schedule(self, jobs: int):
+        if not self.estimates:
+            return
+        # estimates is filled in default order
+        default_order = [run_name for run_name in self.estimates if run_name not in self.results]
+        scheduled_order = [run["run_name"] for run in self.pending]
+        scheduled = estimate_makespan((self.estimates[run_name] for run_name in scheduled_order), jobs)
+        unscheduled = estimate_makespan((self.estimates[run_name] for run_name in default_order), jobs)
+        logging.info(f"Scheduling {len(scheduled_order)} runs longest first on {jobs} workers: estimated makespan "
+                     f"{scheduled / 60:.1f}m (vs {unscheduled / 60:.1f}m in default order)")
+
+    def run(self, run_fn, jobs: int = 1, next_run=None):
+        """Call run_fn for every pending run, with up to `jobs` runs in flight at once.
+
+        next_run can replace self.next_run as the source of runs, e.g. with a WorkspacePool that prepares them.
+        """
+        next_run = next_run or self.next_run
+        self.log_schedule(jobs)
+
+        def worker():
+            while run := next_run():
+                try:
+                    run_fn(run)
+                except Exception as e:
+                    # A run that fails every time must not go back to the queue for every worker to fail on it again,
+                    # without a result it runs again when the benchmark is resumed
+                    logging.error(f"Run {run['run_name']} failed without a result: {e}\n{traceback.format_exc()}")
+                    self.release(run["run_name"])
+                except BaseException:
+                    # Cancelled (e.g. KeyboardInterrupt), a later call of run can pick it up again
+                    self.requeue(run["run_name"])
+                    raise
+
+        if jobs <= 1:
+            worker()
+            return
+
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="benchmark-run") as executor:
+            workers = [executor.submit(worker) for _ in range(jobs)]
+            for future in workers:
+                future.result()
@@ -1,13 +1,17 @@
-import os
-import yaml
 from typing import Dict, Any, Optional
 
+from .result_fields import COMPRESSIONS
+from .results_store import RESULTS_STORES
+from .scheduling import SCHEDULES
+from .templates import AGENTS, REPOSITORIES, TEMPLATES_DIR, TemplateRegistry
+
 class BenchmarkConfig:
     """Class for loading and validating benchmark configuration"""
 
     def __init__(self, config: Dict[str, Any]) -> None:
         """Initialize with config dict"""
-        self.templates_dir = os.path.join(os.path.dirname(__file__), "templates")
+        self.templates_dir = TEMPLATES_DIR
+        self.templates = TemplateRegistry.shared(self.templates_dir)
         self.config = config
         self.validate_config()
         self.config = self.preprocess_config(config)
@@ -35,6 +39,53 @@ class BenchmarkConfig:
         
         if not isinstance(self.config["results_path"], str):
             raise ValueError("'results_path' must be a string")
+
+        if "jobs" in self.config and (not isinstance(self.config["jobs"], int) or self.config["jobs"] < 1):
+            raise ValueError("'jobs' must be a positive integer")
+
+        if "snapshots" in self.config and not isinstance(self.config["snapshots"], dict):
+            raise ValueError("'snapshots' must be a mapping")
+
+        if "startup_deadline" in self.config and (not isinstance(self.config["startup_deadline"], (int, float)) or self.config["startup_deadline"] <= 0):
+            raise ValueError("'startup_deadline' must be a positive number")
+
+        if "http" in self.config and not isinstance(self.config["http"], dict):
+            raise ValueError("'http' must be a mapping")
+
+        if "results_store" in self.config and self.config["results_store"] not in RESULTS_STORES:
+            raise ValueError(f"'results_store' must be one of: {', '.join(RESULTS_STORES)}")
+
+        if "large_fields" in self.config:
+            large_fields = self.config["large_fields"]
+            if not isinstance(large_fields, dict):
+                raise ValueError("'large_fields' must be a mapping")
+            if "compression" in large_fields and large_fields["compression"] not in COMPRESSIONS:
+                raise ValueError(f"'large_fields.compression' must be one of: {', '.join(COMPRESSIONS)}")
+            if "threshold" in large_fields and (not isinstance(large_fields["threshold"], int) or large_fields["threshold"] < 0):
+                raise ValueError("'large_fields.threshold' must be a non-negative integer")
+            max_sizes = large_fields.get("max_sizes", {})
+            if not isinstance(max_sizes, dict) or not all(isinstance(size, int) and size > 0 for size in max_sizes.values()):
+                raise ValueError("'large_fields.max_sizes' must map field names to positive integers")
+
+        if "schedule" in self.config and self.config["schedule"] not in SCHEDULES:
+            raise ValueError(f"'schedule' must be one of: {', '.join(SCHEDULES)}")
+
+        if "schedule_history" in self.config and not isinstance(self.config["schedule_history"], list):
+            raise ValueError("'schedule_history' must be a list of runs directories")
+
+        if "test_impact" in self.config and not isinstance(self.config["test_impact"], bool):
+            raise ValueError("'test_impact' must be a boolean")
+
+        if "fan_out" in self.config and (not isinstance(self.config["fan_out"], int) or self.config["fan_out"] < 1):
+            raise ValueError("'fan_out' must be a positive integer")
+
+        if "workspace_pool" in self.config:
+            pool = self.config["workspace_pool"]
+            if not isinstance(pool, dict):
+                raise ValueError("'workspace_pool' must be a mapping")
+            for field in ("size", "lookahead"):
+                if field in pool and (not isinstance(pool[field], int) or pool[field] < 1):
+                    raise ValueError(f"'workspace_pool.{field}' must be a positive integer")
         
         # Validate non-empty lists
         if not self.config["agents"]:
@@ -45,56 +96,15 @@ class BenchmarkConfig:
 
     def _load_template(self, template_type: str, name: str) -> Optional[Dict[str, Any]]:
         """Load a template configuration file"""
-        # First try direct path
-        template_path = os.path.join(self.templates_dir, template_type, f"{name}.yaml")
-        if os.path.exists(template_path):
-            with open(template_path, "r") as f:
-                return yaml.safe_load(f)
-        
-        # Then try as a path with subdirectories
-        template_path = os.path.join(self.templates_dir, template_type, name + ".yaml")
-        if os.path.exists(template_path):
-            with open(template_path, "r") as f:
-                return yaml.safe_load(f)
-                
-        return None
+        return self.templates.load(template_type, name)
 
     def preprocess_config(self, config: Dict[str, Any]) -> Dict[str, Any]:
         """Get the processed configuration with templates loaded"""
         # Create copies of agents and repositories to avoid modifying them while iterating
-        agents = []
-        for agent_overrides in config["agents"]:
-            agent = {}
-            if "name" in agent_overrides:
-                template = self._load_template("agents", agent_overrides["name"])
-                if template:
-                    agent = template
-            agent.update(agent_overrides)
-            agents.append(agent)
-        
-        repositories = []
-        for repo_overrides in config["repositories"]:
-            repo = {}
-            
-            # Load repository template if name is specified
-            if "name" in repo_overrides:
-                repo_template = self._load_template("repositories", repo_overrides["name"])
-                if repo_template:
-                    repo = repo_template
-
-            repo.update(repo_overrides)
-
-            # Load platform template if specified
-            if "platform" in repo:
-                platform_template = self._load_template("platforms", repo["platform"])
-                if platform_template:
-                    platform_template = platform_template.copy()
-                    repo.update(platform_template)  # Platform template has lowest precedence
-
-            # override again because platform template might have overridden some fields
-            repo.update(repo_overrides)
-
-            repositories.append(repo)
+        agents = [self.templates.resolve(AGENTS, agent_overrides, self._load_template)
+                  for agent_overrides in config["agents"]]
+        repositories = [self.templates.resolve(REPOSITORIES, repo_overrides, self._load_template)
+                        for repo_overrides in config["repositories"]]
         
         # Update the config with the processed agents and repositories
         config["agents"] = agents
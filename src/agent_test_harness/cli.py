@@ -12,6 +12,7 @@ from .agent_test_harness import AgentTestHarness
 from .events import events
 from .report_results import report_results
 from .benchmark_config import BenchmarkConfig
+from .results_store import JSON_STORE, open_results_store
 
 class Cli:
     def __init__(self):
@@ -22,9 +23,17 @@ class Cli:
         parser = argparse.ArgumentParser()
         parser.add_argument("-c", "--config", help="Path to the config file", default="config.yaml")
         parser.add_argument("--report-results", help="Report results into a JSON file", default=False, action="store_true")
+        parser.add_argument("--coverage-detail", default=False, action="store_true",
+                            help="Report the coverage difference per file (parses the full coverage reports)")
         parser.add_argument("--print-config", help="Print the final configuration and exit", default=False, action="store_true")
         parser.add_argument("--agent", help="Run a specific agent (overrides config)")
         parser.add_argument("--repository", help="Run against a specific repository (overrides config)")
+        parser.add_argument("-j", "--jobs", type=int,
+                            help="Number of benchmark runs to execute, or runs to report, in parallel (overrides config)")
+        parser.add_argument("--shared-workspace-provider", default=False, action="store_true",
+                            help="Serve all workspaces from one long-lived workspace provider")
+        parser.add_argument("--rebuild-snapshots", default=False, action="store_true",
+                            help="Ignore cached workspace snapshots and set up every workspace again")
         self.args = parser.parse_args()
 
     def read_config(self, path: str) -> dict:
@@ -80,7 +89,10 @@ class Cli:
         """Run the benchmark suite"""
         logging.info("Running agent test harness...")
         try:
-            agent_test_harness = AgentTestHarness(self.config)
+            jobs = self.args.jobs or self.config.get("jobs", 1)
+            shared_workspace_provider = self.args.shared_workspace_provider or self.config.get("shared_workspace_provider", False)
+            agent_test_harness = AgentTestHarness(self.config, jobs=jobs, shared_workspace_provider=shared_workspace_provider,
+                                                  rebuild_snapshots=self.args.rebuild_snapshots)
             results = agent_test_harness.benchmark_agents()
             self.export_results(results)
         except Exception as e:
@@ -92,13 +104,17 @@ class Cli:
     def report_results(self) -> None:
         """Generate and export results report"""
         logging.info("Reporting results...")
-        results = json.load(open("tmp/results/results.json", "r"))
-        self.export_results(results)
+        output_path = os.path.join(self.config["results_path"], "test_writing")
+        if not os.path.isdir(output_path):
+            logging.error(f"No results found at {output_path}")
+            exit(1)
+        results_store = open_results_store(output_path, self.config.get("results_store", JSON_STORE))
+        self.export_results(results_store)
 
     def export_results(self, results: Dict[str, Any]) -> None:
         """Export results to JSON files"""
         os.makedirs("tmp/results", exist_ok=True)
-        agents_stats = report_results(results)
+        agents_stats = report_results(results, coverage_detail=self.args.coverage_detail, jobs=self.args.jobs or 1)
         with open("tmp/results/agent_stats.json", "w") as f:
             json.dump(agents_stats, f, indent=2)
 
@@ -0,0 +1,73 @@
+# Summaries of Cobertura coverage reports, computed in one streaming pass
+#
+# Reports only need the totals of a coverage report (line rate, branch rate, statements and misses) and their
+# difference before and after the agent ran. Building a full pycobertura tree for that is slow for big repositories,
+# so the report is read with iterparse and every class element is dropped as soon as its lines are counted.
+
+import io
+import xml.etree.ElementTree as ET
+
+from dataclasses import asdict, dataclass
+from typing import Optional, Union
+
+@dataclass
+class CoverageSummary:
+    line_rate: float
+    branch_rate: Optional[float]
+    total_statements: int
+    total_misses: int
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+def line_hit(line: ET.Element) -> bool:
+    """Whether a line counts as covered, the same way pycobertura decides it: partially covered branches are misses."""
+    condition = line.get("condition-coverage")
+    if condition:
+        return condition.startswith("100%")
+    return line.get("hits") != "0"
+
+def summarize_coverage(report: Union[str, bytes]) -> CoverageSummary:
+    """Summarize a Cobertura XML report, given as a string or bytes, in one pass."""
+    if isinstance(report, str):
+        report = report.encode("utf-8")
+
+    root = None
+    # Elements from the root down to the current one, to tell class lines from method lines
+    path = []
+    total_statements = 0
+    total_misses = 0
+
+    for event, element in ET.iterparse(io.BytesIO(report), events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            path.append(element.tag)
+            continue
+
+        path.pop()
+        if element.tag == "line" and path[-2:] == ["class", "lines"] and "packages" in path:
+            total_statements += 1
+            total_misses += not line_hit(element)
+        elif element.tag == "class":
+            # Nothing below a finished class is needed any more
+            element.clear()
+
+    if root is None or root.tag != "coverage":
+        raise Exception("Invalid coverage report: the root element is not <coverage>")
+
+    branch_rate = root.get("branch-rate")
+    return CoverageSummary(
+        line_rate=float(root.get("line-rate")),
+        branch_rate=None if branch_rate is None else float(branch_rate),
+        total_statements=total_statements,
+        total_misses=total_misses,
+    )
+
+def diff_coverage(before: CoverageSummary, after: CoverageSummary) -> dict:
+    """The change in coverage between two reports, as pycobertura's CoberturaDiff computes it."""
+    return {
+        "line_rate": after.line_rate - before.line_rate,
+        "total_statements": after.total_statements - before.total_statements,
+        "total_misses": after.total_misses - before.total_misses,
+    }
@@ -0,0 +1,304 @@
+# Merging the results of per-file agent runs that worked in parallel workspaces
+#
+# With fan-out every (file, test_file) pair of a test writing run gets its own workspace, all set up from the same
+# baseline. Afterwards their git diffs are combined into one diff, and their Cobertura reports into one report that
+# keeps the highest hit count of every line. Diffs that change the same lines of a file conflict: the first one in file
+# order is kept and the later one is left out, together with its coverage, so the merged report describes exactly the
+# merged diff. Every report numbers the lines of its own workspace's files, so before merging its line numbers are
+# moved to where those lines are in the merged files.
+
+import copy
+import re
+import xml.etree.ElementTree as ET
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@(.*)$")
+CONDITION_COVERAGE = re.compile(r"\((\d+)/(\d+)\)")
+
+@dataclass
+class Hunk:
+    old_start: int
+    old_count: int
+    new_start: int
+    new_count: int
+    heading: str
+    lines: list[str]
+
+    def old_range(self) -> tuple[int, int]:
+        # Pure insertions (old_count 0) go after old_start, they touch the position right after it
+        if self.old_count == 0:
+            return self.old_start, self.old_start + 1
+        return self.old_start, self.old_start + self.old_count
+
+@dataclass
+class FilePatch:
+    """The changes of one diff to one file."""
+    path: str
+    header: list[str]
+    hunks: list[Hunk] = field(default_factory=list)
+
+    def plain(self) -> bool:
+        """Whether the patch only changes lines of an existing text file, no creation, deletion, rename or mode."""
+        return bool(self.hunks) and all(line.startswith(("diff --git ", "index ", "--- ", "+++ ")) for line in self.header)
+
+def parse_diff(diff: str) -> list[FilePatch]:
+    """Split a git diff into the patches of its files."""
+    patches = []
+    for line in diff.splitlines():
+        if line.startswith("diff --git "):
+            path = line.split(" b/", 1)[-1]
+            patches.append(FilePatch(path, [line]))
+        elif not patches:
+            continue
+        elif match := HUNK_HEADER.match(line):
+            old_start, old_count, new_start, new_count, heading = match.groups()
+            patches[-1].hunks.append(Hunk(int(old_start), 1 if old_count is None else int(old_count), int(new_start),
+                                          1 if new_count is None else int(new_count), heading, []))
+        elif patches[-1].hunks:
+            patches[-1].hunks[-1].lines.append(line)
+        else:
+            patches[-1].header.append(line)
+    return patches
+
+def overlaps(first: FilePatch, second: FilePatch) -> bool:
+    """Whether two patches of the same file can't both be applied."""
+    if not (first.plain() and second.plain()):
+        return True
+    for hunk in first.hunks:
+        start, end = hunk.old_range()
+        for other in second.hunks:
+            other_start, other_end = other.old_range()
+            if start < other_end and other_start < end:
+                return True
+    return False
+
+def renumber(hunks: list[Hunk]) -> list[tuple[Hunk, int]]:
+    """The hunks of patches of one file sorted by position, with their new start when they are applied together."""
+    renumbered = []
+    offset = 0
+    for hunk in sorted(hunks, key=lambda hunk: hunk.old_start):
+        # Git numbers a pure insertion after the line it follows, and a pure deletion at the line before it
+        adjustment = 1 if hunk.old_count == 0 else -1 if hunk.new_count == 0 else 0
+        renumbered.append((hunk, hunk.old_start + offset + adjustment))
+        offset += hunk.new_count - hunk.old_count
+    return renumbered
+
+def format_patch(patches: list[FilePatch]) -> str:
+    """One patch of a file with the hunks of all patches, renumbering the new line positions."""
+    # The blob hashes of an "index" line are those of one patch, not of the merged one
+    lines = [line for line in patches[0].header if not line.startswith("index ")]
+    for hunk, new_start in renumber([hunk for patch in patches for hunk in patch.hunks]):
+        lines.append(f"@@ -{hunk.old_start},{hunk.old_count} +{new_start},{hunk.new_count} @@{hunk.heading}")
+        lines.extend(hunk.lines)
+    return "\n".join(lines) + "\n"
+
+def hunk_line_pairs(hunk: Hunk, new_start: int):
+    """The (old, new) line numbers of every line of a hunk, None on the side a line isn't on."""
+    old, new = hunk.old_start, new_start
+    for line in hunk.lines:
+        if line.startswith("+"):
+            yield None, new
+            new += 1
+        elif line.startswith("-"):
+            yield old, None
+            old += 1
+        elif not line.startswith("\\"):
+            yield old, new
+            old += 1
+            new += 1
+
+def to_old_line(hunks: list[Hunk], number: int) -> tuple[Optional[int], Optional[tuple[Hunk, int]]]:
+    """Where a line of a patched file was before the patch.
+
+    Returns the old line number, or for added lines the hunk that added it and the position in its new lines.
+    """
+    offset = 0
+    for hunk in sorted(hunks, key=lambda hunk: hunk.new_start):
+        # Pure deletions (new_count 0) come after new_start
+        if number < hunk.new_start or (hunk.new_count == 0 and number == hunk.new_start):
+            break
+        if number < hunk.new_start + hunk.new_count:
+            for old, new in hunk_line_pairs(hunk, hunk.new_start):
+                if new == number:
+                    return (old, None) if old is not None else (None, (hunk, number - hunk.new_start))
+        offset += hunk.new_count - hunk.old_count
+    return number - offset, None
+
+def to_new_line(renumbered: list[tuple[Hunk, int]], number: int) -> Optional[int]:
+    """Where an old line of a file is after the renumbered hunks are applied, None if they remove it."""
+    offset = 0
+    for hunk, new_start in renumbered:
+        start, end = hunk.old_start, hunk.old_start + hunk.old_count
+        if number < start or (hunk.old_count == 0 and number == start):
+            break
+        if number < end:
+            for old, new in hunk_line_pairs(hunk, new_start):
+                if old == number:
+                    return new
+        offset += hunk.new_count - hunk.old_count
+    return number + offset
+
+@dataclass
+class MergedDiff:
+    diff: str
+    # Indexes of the diffs that are part of the merged diff
+    merged: list[int]
+    # Diffs left out: the index of the diff, the index of the merged diff it conflicts with and the files
+    conflicts: list[dict]
+    # The patches of the merged diffs by index, and all merged patches by file
+    patches: dict[int, list[FilePatch]] = field(default_factory=dict)
+    files: dict[str, list[FilePatch]] = field(default_factory=dict)
+
+    def patched_path(self, filename: str) -> Optional[str]:
+        """The path of the merged file a Cobertura filename (relative to a source directory) refers to."""
+        if filename in self.files:
+            return filename
+        return next((path for path in self.files if path.endswith(f"/{filename}")), None)
+
+    def merged_line(self, index: int, path: str, number: int) -> Optional[int]:
+        """Where a line of a file in the workspace of diff index is in the merged file, None if it isn't."""
+        own_hunks = [hunk for patch in self.patches[index] if patch.path == path for hunk in patch.hunks]
+        renumbered = renumber([hunk for patch in self.files[path] for hunk in patch.hunks])
+        old, added = to_old_line(own_hunks, number)
+        if added is not None:
+            hunk, position = added
+            return next(new_start for other, new_start in renumbered if other is hunk) + position
+        return to_new_line(renumbered, old)
+
+    def remap_coverage(self, index: int, report: str) -> str:
+        """Renumber the lines of the Cobertura report of diff index to the lines of the merged files."""
+        root = ET.fromstring(report)
+        for cls in root.iterfind("packages/package/classes/class"):
+            path = self.patched_path(cls.get("filename"))
+            if path is None:
+                continue
+            for lines in [cls.find("lines"), *cls.iterfind("methods/method/lines")]:
+                if lines is None:
+                    continue
+                for line in lines.findall("line"):
+                    number = self.merged_line(index, path, int(line.get("number")))
+                    if number is None:
+                        lines.remove(line)
+                    else:
+                        line.set("number", str(number))
+        return ET.tostring(root, encoding="unicode")
+
+def merge_diffs(diffs: list[Optional[str]]) -> MergedDiff:
+    """Merge diffs made from the same baseline, leaving out every diff that conflicts with an earlier one."""
+    patches_by_path: dict[str, list[FilePatch]] = {}
+    owners: dict[str, list[int]] = {}
+    merged = []
+    merged_patches = {}
+    conflicts = []
+    for index, diff in enumerate(diffs):
+        if diff is None:
+            continue
+        patches = parse_diff(diff)
+        conflicting = {}
+        for patch in patches:
+            for accepted, owner in zip(patches_by_path.get(patch.path, []), owners.get(patch.path, [])):
+                if overlaps(accepted, patch):
+                    conflicting.setdefault(owner, []).append(patch.path)
+        if conflicting:
+            conflicts.extend({"diff": index, "conflicts_with": owner, "files": sorted(set(paths))}
+                             for owner, paths in conflicting.items())
+            continue
+        for patch in patches:
+            patches_by_path.setdefault(patch.path, []).append(patch)
+            owners.setdefault(patch.path, []).append(index)
+        merged.append(index)
+        merged_patches[index] = patches
+
+    return MergedDiff("".join(format_patch(patches) for patches in patches_by_path.values()), merged, conflicts,
+                      merged_patches, patches_by_path)
+
+def rate(covered: int, valid: int) -> str:
+    # Formatted the way coverage.py writes rates
+    return "%.4g" % (covered / valid) if valid else "1"
+
+def branches(line: ET.Element) -> tuple[int, int]:
+    """The covered and total branches of a line, from a condition-coverage like "50% (1/2)"."""
+    match = CONDITION_COVERAGE.search(line.get("condition-coverage", ""))
+    return (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+
+def merge_lines(lines: ET.Element, other: Optional[ET.Element]):
+    """Merge the line elements of other into lines, keeping the highest hits and the best branch coverage."""
+    if other is None:
+        return
+    by_number = {line.get("number"): line for line in lines.findall("line")}
+    for other_line in other.findall("line"):
+        line = by_number.get(other_line.get("number"))
+        if line is None:
+            lines.append(copy.deepcopy(other_line))
+            continue
+        line.set("hits", str(max(int(line.get("hits", "0")), int(other_line.get("hits", "0")))))
+        if branches(other_line)[0] > branches(line)[0]:
+            line.set("condition-coverage", other_line.get("condition-coverage"))
+            if other_line.get("missing-branches") is None:
+                line.attrib.pop("missing-branches", None)
+            else:
+                line.set("missing-branches", other_line.get("missing-branches"))
+
+def merge_class(merged: ET.Element, other: ET.Element):
+    merge_lines(merged.find("lines"), other.find("lines"))
+    methods = {(method.get("name"), method.get("signature")): method for method in merged.iterfind("methods/method")}
+    for other_method in other.iterfind("methods/method"):
+        method = methods.get((other_method.get("name"), other_method.get("signature")))
+        if method is not None:
+            merge_lines(method.find("lines"), other_method.find("lines"))
+
+def set_rates(element: ET.Element, lines: list[ET.Element]) -> tuple[int, int, int, int]:
+    valid = len(lines)
+    covered = sum(int(line.get("hits", "0")) > 0 for line in lines)
+    branches_covered = branches_valid = 0
+    for line in lines:
+        line_covered, line_valid = branches(line)
+        branches_covered += line_covered
+        branches_valid += line_valid
+    element.set("line-rate", rate(covered, valid))
+    if element.get("branch-rate") is not None:
+        element.set("branch-rate", rate(branches_covered, branches_valid))
+    return valid, covered, branches_valid, branches_covered
+
+def merge_cobertura(reports: list[str]) -> str:
+    """Merge Cobertura reports of the same sources, a line is covered if it is covered in any report."""
+    root = ET.fromstring(reports[0])
+    packages = {package.get("name"): package for package in root.iterfind("packages/package")}
+    classes = {cls.get("filename"): cls for package in packages.values() for cls in package.iterfind("classes/class")}
+
+    for report in reports[1:]:
+        for other_package in ET.fromstring(report).iterfind("packages/package"):
+            for other_class in other_package.iterfind("classes/class"):
+                cls = classes.get(other_class.get("filename"))
+                if cls is not None:
+                    merge_class(cls, other_class)
+                    continue
+                # Files that only some runs measured, e.g. test files they added
+                package = packages.get(other_package.get("name"))
+                if package is None:
+                    package = copy.deepcopy(other_package)
+                    package.find("classes").clear()
+                    root.find("packages").append(package)
+                    packages[package.get("name")] = package
+                cls = copy.deepcopy(other_class)
+                package.find("classes").append(cls)
+                classes[cls.get("filename")] = cls
+
+    all_lines = []
+    for package in packages.values():
+        package_lines = []
+        for cls in package.iterfind("classes/class"):
+            class_lines = cls.findall("lines/line")
+            set_rates(cls, class_lines)
+            package_lines.extend(class_lines)
+        set_rates(package, package_lines)
+        all_lines.extend(package_lines)
+
+    valid, covered, branches_valid, branches_covered = set_rates(root, all_lines)
+    for attribute, value in (("lines-valid", valid), ("lines-covered", covered),
+                             ("branches-valid", branches_valid), ("branches-covered", branches_covered)):
+        if root.get(attribute) is not None:
+            root.set(attribute, str(value))
+    return ET.tostring(root, encoding="unicode")
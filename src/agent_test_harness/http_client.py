@@ -0,0 +1,136 @@
+# HttpClient is a keep-alive, connection-pooled HTTP client for the workspace provider and the LLM proxy
+#
+# A single run makes dozens of round trips to its services, so every client keeps one requests.Session with a pooled
+# adapter instead of opening a new connection per call. Transient connection errors are retried with jittered
+# exponential backoff, and the latency of every call is counted per endpoint. Requests that aren't idempotent (running
+# a command, creating a workspace or project) are only retried when the connection couldn't be made, once they may have
+# reached the service retrying them could run them twice. requests is only imported once a client
+# is created, so commands that never talk to the services don't pay for it.
+
+import logging
+import random
+import threading
+import time
+
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import requests
+
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.2
+DEFAULT_MAX_BACKOFF = 5.0
+DEFAULT_POOL_SIZE = 16
+
+# Methods that can be retried after any connection error
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "DELETE")
+
+def connect_failed(error: Exception) -> bool:
+    """Whether a request failed while connecting, before anything was sent."""
+    import requests
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    # requests wraps urllib3's errors, e.g. ConnectionError(MaxRetryError(reason=NewConnectionError(...)))
+    reason = error.args[0] if error.args else None
+    return isinstance(getattr(reason, "reason", reason), NewConnectionError)
+
+class LatencyStats:
+    """Thread-safe request counters and timings per endpoint."""
+    endpoints: dict[str, dict]
+
+    def __init__(self):
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def record(self, endpoint: str, duration: float, error: bool = False):
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {"count": 0, "errors": 0, "total_time": 0.0, "max_time": 0.0})
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["total_time"] += duration
+            stats["max_time"] = max(stats["max_time"], duration)
+
+    def snapshot(self) -> dict[str, dict]:
+        with self.lock:
+            return {
+                endpoint: {**stats, "mean_time": stats["total_time"] / stats["count"]}
+                for endpoint, stats in sorted(self.endpoints.items())
+            }
+
+class HttpClient:
+    base_url: str
+    retries: int
+    backoff: float
+    max_backoff: float
+    session: "requests.Session"
+    latency: LatencyStats
+
+    def __init__(self, base_url: str, retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF,
+                 max_backoff: float = DEFAULT_MAX_BACKOFF, pool_size: int = DEFAULT_POOL_SIZE,
+                 session: Optional["requests.Session"] = None):
+        """session is a pooled session to share with another client, pool_size only applies to a new one."""
+        self.base_url = base_url
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+        self.latency = LatencyStats()
+
+    @classmethod
+    def from_config(cls, base_url: str, config: Optional[dict] = None) -> "HttpClient":
+        """Create a client with the settings of the 'http' section of the benchmark config."""
+        config = config or {}
+        return cls(base_url,
+                   retries=config.get("retries", DEFAULT_RETRIES),
+                   backoff=config.get("backoff", DEFAULT_BACKOFF),
+                   max_backoff=config.get("max_backoff", DEFAULT_MAX_BACKOFF),
+                   pool_size=config.get("pool_size", DEFAULT_POOL_SIZE))
+
+    def view(self) -> "HttpClient":
+        """A client sharing this client's connection pool, with its own latency counters."""
+        return HttpClient(self.base_url, retries=self.retries, backoff=self.backoff, max_backoff=self.max_backoff,
+                          session=self.session)
+
+    def backoff_delay(self, attempt: int) -> float:
+        # Full jitter, so parallel runs that failed together don't retry together
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, method: str, path: str, endpoint: Optional[str] = None, retries: Optional[int] = None, **kwargs) -> "requests.Response":
+        """Send a request, retrying transient connection errors.
+
+        Only GET, HEAD, OPTIONS and DELETE are retried after any connection error or timeout, other methods only when
+        the connection failed.
+
+        endpoint is the name latency is counted under (e.g. "POST workspaces/{id}/cmd"), defaulting to the path.
+        """
+        import requests
+        endpoint = f"{method} {endpoint or path}"
+        retries = self.retries if retries is None else retries
+
+        for attempt in range(retries + 1):
+            start_time = time.monotonic()
+            try:
+                response = self.session.request(method, f"{self.base_url}/{path}", **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.latency.record(endpoint, time.monotonic() - start_time, error=True)
+                if attempt == retries or (method.upper() not in IDEMPOTENT_METHODS and not connect_failed(e)):
+                    raise
+                delay = self.backoff_delay(attempt)
+                logging.warning(f"{endpoint} failed ({e}), retrying in {delay:.2f}s...")
+                time.sleep(delay)
+                continue
+
+            self.latency.record(endpoint, time.monotonic() - start_time, error=response.status_code >= 500)
+            return response
+
+    def close(self):
+        self.session.close()
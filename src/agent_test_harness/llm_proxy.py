@@ -1,5 +1,4 @@
 import json
-import requests
 import subprocess
 import secrets
 import os
@@ -9,7 +8,11 @@ import logging
 import sys
 import signal
 
+from typing import Optional
+
 from .events import events
+from .http_client import HttpClient
+from .readiness import wait_until_ready, DEFAULT_STARTUP_DEADLINE
 
 LLM_PROXY_COMMAND = "amsterdam"
 
@@ -19,14 +22,20 @@ class LLMProxy:
     config: dict
     process: subprocess.Popen
     base_url: str
+    http: HttpClient
     running: bool
     endpoint: str
+    startup_deadline: float
+    startup_time: Optional[float]
 
     def __init__(self, config: dict):
         self.admin_token = secrets.token_hex(16)
         self.config = config
         self.process = None
         self.base_url = "http://localhost:50081"
+        self.http = HttpClient.from_config(self.base_url, config.get("http"))
+        self.startup_deadline = config.get("startup_deadline", DEFAULT_STARTUP_DEADLINE)
+        self.startup_time = None
         self.endpoint = "http://172.17.0.1:50081/v1/openai/v1"
         self.running = False
 
@@ -49,26 +58,20 @@ class LLMProxy:
         events.add_main_exit_event_listener(self.stop)
 
         # wait for the LLM proxy to start by requesting the health endpoint
-        while True:
-            time.sleep(0.2)
-            logging.info("Checking if LLM proxy is running...")
-            try:
-                response = self._request("GET", "health")
-                match response.status_code:
-                    case 200:
-                        break
-                    case _:
-                        raise Exception(f"LLM proxy returned unexpected status code: {response.status_code}")
-            except requests.exceptions.ConnectionError:
-                pass
-            except Exception as e:
-                logging.error(f"Error: {e}")
-                pass
-
-        logging.info("LLM proxy started")
+        try:
+            self.startup_time = wait_until_ready("LLM proxy", self._healthy, self.process, self.startup_deadline)
+        except Exception:
+            self.stop()
+            raise
 
         threading.Thread(target=self.monitor_process, daemon=True).start()
 
+    def _healthy(self) -> bool:
+        response = self._request("GET", "health", retries=0)
+        if response.status_code != 200:
+            raise Exception(f"LLM proxy returned unexpected status code: {response.status_code}")
+        return True
+
     def monitor_process(self):
         while self.running:
             time.sleep(0.2)
@@ -76,24 +79,26 @@ class LLMProxy:
             process.poll()
             if process.returncode is not None and self.running:
                 self.running = False
-                logging.error("LLM proxy process exited early")
-                process.stdout.close()
-                output = process.stdout.read()
-                logging.error(output)
-                process.stderr.close()
-                error = process.stderr.read()
-                logging.error(error)
+                # stdout and stderr go straight to our stderr, so the process output is already in the logs
+                logging.error(f"LLM proxy process exited early with code {process.returncode}")
                 break
 
     def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            self.running = False
+            return
         logging.info("Stopping LLM proxy...")
         self.running = False
         os.killpg(os.getpgid(self.process.pid), signal.SIGTERM)
         # wait for the process to exit
         self.process.wait()
 
-    def _request(self, method: str, path: str, **kwargs):
-        response = requests.request(method, f"{self.base_url}/{path}", **kwargs)
+    def latency_stats(self) -> dict[str, dict]:
+        """Request counts and timings per endpoint."""
+        return self.http.latency.snapshot()
+
+    def _request(self, method: str, path: str, endpoint: Optional[str] = None, **kwargs):
+        response = self.http.request(method, path, endpoint=endpoint, **kwargs)
 
         if response.status_code >= 400:
             raise Exception(f"LLM proxy returned status code {response.status_code}: {response.text}")
@@ -0,0 +1,52 @@
+# Readiness checks for the services the harness starts as child processes (derrick, amsterdam)
+#
+# A service is polled with capped exponential backoff until its readiness check passes. Between polls we wait on the
+# child process itself, so a service that crashes during startup is detected the moment it exits rather than on the
+# next poll, and a service that never becomes ready fails once the startup deadline has passed.
+
+import logging
+import subprocess
+import time
+
+from typing import Callable
+
+DEFAULT_STARTUP_DEADLINE = 120.0
+INITIAL_POLL_DELAY = 0.05
+MAX_POLL_DELAY = 2.0
+
+def wait_until_ready(name: str, check: Callable[[], bool], process: subprocess.Popen,
+                     deadline: float = DEFAULT_STARTUP_DEADLINE,
+                     initial_delay: float = INITIAL_POLL_DELAY, max_delay: float = MAX_POLL_DELAY) -> float:
+    """Poll check() until it returns True and return the time it took for the service to become ready.
+
+    Raises if the process exits or the deadline passes before the service is ready.
+    """
+    import requests
+    logging.info(f"Waiting for {name} to start...")
+    start_time = time.monotonic()
+    delay = initial_delay
+
+    while True:
+        if process.poll() is not None:
+            raise Exception(f"{name} exited with code {process.returncode} before it was ready")
+
+        try:
+            if check():
+                time_to_ready = time.monotonic() - start_time
+                logging.info(f"{name} ready after {time_to_ready:.2f}s")
+                return time_to_ready
+        except requests.exceptions.ConnectionError:
+            pass
+        except Exception as e:
+            logging.error(f"Error checking if {name} is ready: {e}")
+
+        remaining = deadline - (time.monotonic() - start_time)
+        if remaining <= 0:
+            raise Exception(f"{name} did not become ready within {deadline:.0f}s")
+
+        # Wait on the process instead of sleeping, so a crash ends the wait immediately
+        try:
+            process.wait(timeout=min(delay, remaining))
+        except subprocess.TimeoutExpired:
+            pass
+        delay = min(delay * 2, max_delay)
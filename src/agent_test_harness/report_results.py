@@ -1,9 +1,61 @@
 import logging
 import traceback
 
-from pycobertura import Cobertura, CoberturaDiff
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING
+
+from .aggregation import aggregate, model_stats
+from .coverage_summary import diff_coverage, summarize_coverage
+from .results_store import ResultsStore
+
+if TYPE_CHECKING:
+    from pycobertura import Cobertura
+
+# Bump when the stats computed per run change, so cached stats are computed again
+STATS_VERSION = 1
+
+# Runs submitted to the process pool per job ahead of the one being collected
+IN_FLIGHT_PER_JOB = 4
+
+def cobertura_summary(coverage: "Cobertura") -> dict:
+    return {
+        "line_rate": coverage.line_rate(),
+        "branch_rate": coverage.branch_rate(),
+        "total_statements": coverage.total_statements(),
+        "total_misses": coverage.total_misses(),
+    }
+
+def generate_coverage_report(repository_result, detail=False):
+    """Summarize the coverage before and after the agent ran, and the difference.
+
+    The totals are computed by a streaming summarizer. Only with detail are the reports fully parsed by pycobertura,
+    to add the difference per file.
+    """
+    if detail:
+        return generate_detailed_coverage_report(repository_result)
+
+    try:
+        coverage_before = summarize_coverage(repository_result["initial_coverage_tool_output"])
+    except Exception as e:
+        logging.error(f"Error generating coverage report before: {e}\n{traceback.format_exc()}")
+        coverage_before = None
+
+    try:
+        coverage_after = summarize_coverage(repository_result["final_coverage_tool_output"])
+    except Exception as e:
+        coverage_after = None
+
+    return {
+        "coverage_before": coverage_before.to_dict() if coverage_before else None,
+        "coverage_after": coverage_after.to_dict() if coverage_after else None,
+        "coverage_diff": diff_coverage(coverage_before, coverage_after) if coverage_before and coverage_after else None
+    }
+
+def generate_detailed_coverage_report(repository_result):
+    # pycobertura is only needed for --coverage-detail
+    from pycobertura import Cobertura, CoberturaDiff
 
-def generate_coverage_report(repository_result):
     try:
         coverage_before = Cobertura(repository_result["initial_coverage_tool_output"])
     except Exception as e:
@@ -21,115 +73,116 @@ def generate_coverage_report(repository_result):
         coverage_diff = None
 
     return {
-        "coverage_before": coverage_before,
-        "coverage_after": coverage_after,
-        "coverage_diff": coverage_diff
+        "coverage_before": cobertura_summary(coverage_before) if coverage_before else None,
+        "coverage_after": cobertura_summary(coverage_after) if coverage_after else None,
+        "coverage_diff": {
+            "line_rate": coverage_diff.diff_line_rate(),
+            "total_statements": coverage_diff.diff_total_statements(),
+            "total_misses": coverage_diff.diff_total_misses(),
+            "files": [
+                {
+                    "filename": filename,
+                    "line_rate": coverage_diff.diff_line_rate(filename),
+                    "total_statements": coverage_diff.diff_total_statements(filename),
+                    "total_misses": coverage_diff.diff_total_misses(filename),
+                } for filename in coverage_diff.files()
+            ]
+        } if coverage_diff else None
     }
 
-def report_results(results):
-    agents_stats = []
-    for run in results:
-        agent_name = run["agent_name"]
-        repository_stats = []
-        logging.info(f"Organizing results for agent run {run['run']}")
-        benchmark_result = run["result"]
-        repository_url = run["repository_url"]
-        run_id = run["run"]
-
-        if "error" in benchmark_result:
-            repository_stats.append({
-                "repository_url": repository_url,
-                "run_id": run_id,
-                "successful": False,
-                "coverage_before": None,
-                "coverage_after": None,
-                "coverage_diff": None,
-                "agent_execution_time": None,
-                "total_completion_tokens": None,
-                "completions_count": None,
-                "total_prompt_tokens": None,
-                "total_token_count": None,
-                "models": None,
-                "error": benchmark_result["error"],
-                "backtrace": benchmark_result["backtrace"],
-            })
-            continue
-
-        llm_metrics = benchmark_result["llm_metrics"]
-        models = list(set([llm_metric["model_name"] for llm_metric in llm_metrics]))
-
-        coverage_report = generate_coverage_report(benchmark_result)
-        coverage_after = coverage_report["coverage_after"]
-        coverage_before = coverage_report["coverage_before"]
-        coverage_diff = coverage_report["coverage_diff"]
-
-        repository_stats.append({
+def run_stats(run, coverage_detail=False):
+    """The statistics of a single run."""
+    logging.info(f"Organizing results for agent run {run['run']}")
+    benchmark_result = run["result"]
+    repository_url = run["repository_url"]
+    run_id = run["run"]
+
+    if "error" in benchmark_result:
+        return {
             "repository_url": repository_url,
             "run_id": run_id,
-            "successful": coverage_after is not None,
-            "coverage_before": {
-                "line_rate": coverage_before.line_rate(),
-                "branch_rate": coverage_before.branch_rate(),
-                "total_statements": coverage_before.total_statements(),
-                "total_misses": coverage_before.total_misses(),
-            } if coverage_before else None,
-            "coverage_after": {
-                "line_rate": coverage_after.line_rate(),
-                "branch_rate": coverage_after.branch_rate(),
-                "total_statements": coverage_after.total_statements(),
-                "total_misses": coverage_after.total_misses(),
-            } if coverage_after else None,
-            "coverage_diff": {
-                "line_rate": coverage_diff.diff_line_rate(),
-                "total_statements": coverage_diff.diff_total_statements(),
-                "total_misses": coverage_diff.diff_total_misses(),
-            } if coverage_diff else None,
-            "agent_execution_time": benchmark_result["agent_execution_time"],
-            "total_completion_tokens": sum([llm_metric["completion_token_count"] for llm_metric in llm_metrics]),
-            "completions_count": len(llm_metrics),
-            "total_prompt_tokens": sum([llm_metric["prompt_token_count"] for llm_metric in llm_metrics]),
-            "total_token_count": sum([llm_metric["total_token_count"] for llm_metric in llm_metrics]),
-            "models": [
-                {
-                    "name": model,
-                    "completions_count": len([llm_metric for llm_metric in llm_metrics if llm_metric["model_name"] == model]),
-                    "total_completion_tokens": sum([llm_metric["completion_token_count"] for llm_metric in llm_metrics if llm_metric["model_name"] == model]),
-                    "total_prompt_tokens": sum([llm_metric["prompt_token_count"] for llm_metric in llm_metrics if llm_metric["model_name"] == model]),
-                    "total_token_count": sum([llm_metric["total_token_count"] for llm_metric in llm_metrics if llm_metric["model_name"] == model]),
-                } for model in models
-            ]
-        })
-
-        successful_repositories = [repository_stat for repository_stat in repository_stats if repository_stat["successful"]]
-
-        def get_model_stats(model):
-            stats = []
-            for repo in repository_stats:
-                for model in repo["models"]:
-                    if model["name"] == model:
-                        stats.append(model)
-            return stats
-
-        agent_stats = {
-            "name": agent_name,
-            "runs": repository_stats,
-            "total_completion_tokens": sum([repo["total_completion_tokens"] for repo in repository_stats]),
-            "total_prompt_tokens": sum([repo["total_prompt_tokens"] for repo in repository_stats]),
-            "total_token_count": sum([repo["total_token_count"] for repo in repository_stats]),
-            "runs_count": len(repository_stats),
-            "successful_runs_count": len(successful_repositories),
-            "average_coverage_diff": sum([repo["coverage_diff"]["line_rate"] for repo in successful_repositories]) / len(successful_repositories) if successful_repositories else None,
-            "average_agent_execution_time": sum([repo["agent_execution_time"] for repo in repository_stats]) / len(repository_stats) if repository_stats else None,
-            "average_coverage_before": sum([repo["coverage_before"]["line_rate"] for repo in successful_repositories]) / len(successful_repositories) if successful_repositories else None,
-            "average_coverage_after": sum([repo["coverage_after"]["line_rate"] for repo in successful_repositories]) / len(successful_repositories) if successful_repositories else None,
-            "models": [
-                {
-                    "name": model,
-                    "total_completion_tokens": sum([model_stat["total_completion_tokens"] for model_stat in get_model_stats(model)]),
-                    "total_prompt_tokens":     sum([model_stat["total_prompt_tokens"] for model_stat in get_model_stats(model)]),
-                    "total_token_count":       sum([model_stat["total_token_count"] for model_stat in get_model_stats(model)]),
-                } for model in models
-            ]
+            "successful": False,
+            "coverage_before": None,
+            "coverage_after": None,
+            "coverage_diff": None,
+            "agent_execution_time": None,
+            "provisioning_saved_time": None,
+            "total_completion_tokens": None,
+            "completions_count": None,
+            "total_prompt_tokens": None,
+            "total_token_count": None,
+            "models": None,
+            "error": benchmark_result["error"],
+            "backtrace": benchmark_result["backtrace"],
         }
-        agents_stats.append(agent_stats)
-    return agents_stats
\ No newline at end of file
+
+    tokens, models = model_stats(benchmark_result["llm_metrics"])
+    coverage_report = generate_coverage_report(benchmark_result, detail=coverage_detail)
+    coverage_after = coverage_report["coverage_after"]
+
+    return {
+        "repository_url": repository_url,
+        "run_id": run_id,
+        "successful": coverage_after is not None,
+        "coverage_before": coverage_report["coverage_before"],
+        "coverage_after": coverage_after,
+        "coverage_diff": coverage_report["coverage_diff"],
+        "agent_execution_time": benchmark_result["agent_execution_time"],
+        "provisioning_saved_time": benchmark_result.get("provisioning", {}).get("saved_time"),
+        **tokens.to_dict(),
+        "models": models
+    }
+
+def map_ordered(fn, args, jobs=1):
+    """Yield fn(*arguments) for every tuple in args, in order, computed on up to `jobs` processes.
+
+    Arguments are submitted as the results are consumed, so only a bounded number of runs is in memory at once.
+    """
+    if jobs <= 1:
+        for arguments in args:
+            yield fn(*arguments)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        in_flight = deque()
+        for arguments in args:
+            in_flight.append(executor.submit(fn, *arguments))
+            if len(in_flight) >= jobs * IN_FLIGHT_PER_JOB:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+def stored_run_stats(results_store: ResultsStore, coverage_detail=False, jobs=1):
+    """The stats of every run in a results store, computing and caching them only for new or changed runs."""
+    entries = results_store.entries()
+    stats_by_run = {}
+    missing = []
+    for entry in entries:
+        # Manifests written before runs were hashed have no hash, those runs are never cached
+        key = f"{STATS_VERSION}:{entry['hash']}:{int(coverage_detail)}" if "hash" in entry else None
+        stats = results_store.cached_stats(entry["run_name"], key) if key else None
+        if stats is None:
+            missing.append((entry["run_name"], key))
+        else:
+            stats_by_run[entry["run_name"]] = stats
+    logging.info(f"Reused the cached stats of {len(stats_by_run)} of {len(entries)} runs")
+
+    runs = ((results_store[run_name], coverage_detail) for run_name, _ in missing)
+    for (run_name, key), stats in zip(missing, map_ordered(run_stats, runs, jobs)):
+        if key:
+            results_store.cache_stats(run_name, key, stats)
+        stats_by_run[run_name] = stats
+
+    return [(entry["agent_name"], stats_by_run[entry["run_name"]]) for entry in entries]
+
+def report_results(results, coverage_detail=False, jobs=1):
+    """Statistics per agent over all runs, with the stats of each run and rollups per model and repository.
+
+    results is an iterable of run results, or a ResultsStore to reuse the stats cached in it. With jobs > 1 runs are
+    summarized in parallel processes; the report is the same as with one job.
+    """
+    if isinstance(results, ResultsStore):
+        return aggregate(stored_run_stats(results, coverage_detail, jobs))
+    runs = list(results)
+    stats = map_ordered(run_stats, ((run, coverage_detail) for run in runs), jobs)
+    return aggregate((run["agent_name"], stats_of_run) for run, stats_of_run in zip(runs, stats))
@@ -0,0 +1,127 @@
+# LargeFields stores the large text fields of run results compressed, next to the result instead of inside it
+#
+# Agent output, test output, diffs and coverage reports can be megabytes each. Fields above a threshold are compressed
+# into side files and replaced in the result by a reference, and fields can be capped to a maximum size, keeping their
+# start and end. Results stores inflate the references again when a result is read.
+
+import gzip
+import os
+
+from typing import Optional
+
+from .scheduling import result_payload
+
+LARGE_FIELDS = ("agent_output", "validation_output", "git_diff", "initial_coverage_tool_output", "final_coverage_tool_output")
+
+GZIP = "gzip"
+ZSTD = "zstd"
+COMPRESSIONS = (GZIP, ZSTD)
+EXTENSIONS = {GZIP: ".gz", ZSTD: ".zst"}
+
+# Fields smaller than this stay inline, compressing them isn't worth a file
+DEFAULT_THRESHOLD = 64 * 1024
+
+# Marks a field stored in a side file, e.g. {"$blob": "run.agent_output.gz", "size": 123, "truncated": false}
+BLOB_KEY = "$blob"
+
+def truncate(value: str, max_size: int) -> str:
+    """Cut a text down to about max_size characters, keeping its start and end."""
+    if len(value) <= max_size:
+        return value
+    keep = max_size // 2
+    omitted = len(value) - 2 * keep
+    return f"{value[:keep]}\n[... {omitted} characters truncated ...]\n{value[-keep:]}"
+
+def compress(data: bytes, compression: str) -> bytes:
+    if compression == ZSTD:
+        import zstandard
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data)
+
+def decompress(data: bytes, compression: str) -> bytes:
+    if compression == ZSTD:
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+def compression_of(file: str) -> str:
+    return ZSTD if file.endswith(EXTENSIONS[ZSTD]) else GZIP
+
+class LargeFields:
+    """How large result fields are stored: the compression, the size above which they are moved out of the result,
+    and the maximum size per field."""
+    compression: str
+    threshold: int
+    max_sizes: dict[str, int]
+
+    def __init__(self, compression: str = GZIP, threshold: int = DEFAULT_THRESHOLD,
+                 max_sizes: Optional[dict[str, int]] = None):
+        if compression == ZSTD:
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                raise Exception("zstd compression of result fields requires the zstandard package (pip install 'agent-test-harness[zstd]')")
+        self.compression = compression
+        self.threshold = threshold
+        self.max_sizes = max_sizes or {}
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> "LargeFields":
+        """Create the policy from the 'large_fields' section of the benchmark config."""
+        config = config or {}
+        return cls(compression=config.get("compression", GZIP),
+                   threshold=config.get("threshold", DEFAULT_THRESHOLD),
+                   max_sizes=config.get("max_sizes"))
+
+    def _truncated(self, payload: dict) -> dict[str, str]:
+        return {field: truncate(payload[field], max_size) for field, max_size in self.max_sizes.items()
+                if isinstance(payload.get(field), str) and len(payload[field]) > max_size}
+
+    def limit(self, result: dict) -> dict:
+        """Apply the maximum field sizes to a result, returning a copy if anything was truncated."""
+        truncated = self._truncated(result_payload(result))
+        return self._replace(result, truncated) if truncated else result
+
+    def pack(self, run_name: str, result: dict, directory: str) -> dict:
+        """Truncate and move the large fields of a result into compressed files in directory.
+
+        Returns the result to store, with the moved fields replaced by references.
+        """
+        payload = result_payload(result)
+        truncated = self._truncated(payload)
+        fields = dict(truncated)
+        for field in LARGE_FIELDS:
+            value = truncated.get(field, payload.get(field))
+            if not isinstance(value, str) or len(value) < self.threshold:
+                continue
+            data = value.encode("utf-8")
+            file = f"{run_name}.{field}{EXTENSIONS[self.compression]}"
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = os.path.join(directory, f"{file}.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(compress(data, self.compression))
+            os.replace(tmp_path, os.path.join(directory, file))
+            fields[field] = {BLOB_KEY: file, "size": len(data), "truncated": field in truncated}
+
+        return self._replace(result, fields) if fields else result
+
+    @staticmethod
+    def unpack(result: dict, directory: str) -> dict:
+        """Replace the references to compressed fields in a stored result by their content."""
+        payload = result_payload(result)
+        inflated = {}
+        for field, value in payload.items():
+            if isinstance(value, dict) and BLOB_KEY in value:
+                with open(os.path.join(directory, value[BLOB_KEY]), "rb") as f:
+                    inflated[field] = decompress(f.read(), compression_of(value[BLOB_KEY])).decode("utf-8")
+        if not inflated:
+            return result
+        payload.update(inflated)
+        return result
+
+    @staticmethod
+    def _replace(result: dict, fields: dict) -> dict:
+        # Test writing results nest the benchmark output in "result", SWE-bench results are flat
+        if result_payload(result) is result:
+            return {**result, **fields}
+        return {**result, "result": {**result["result"], **fields}}
@@ -0,0 +1,341 @@
+# Results stores keep the results of a benchmark's runs
+#
+# Run results hold the full agent output, diff and coverage reports, so they are only read when a report or export
+# asks for them. Which runs are done, and a short summary of each, is kept separately, so resuming a campaign only has
+# to read the summaries.
+#
+# JsonResultsStore keeps one JSON file per run with an append-only manifest (index.jsonl) next to them, and large
+# fields compressed in runs/blobs. SqliteResultsStore keeps all runs of a benchmark in one SQLite database, with the
+# summary fields in indexed columns and the results compressed.
+#
+# Both can cache stats computed from a run (see report_results) under a key that includes the run's content hash, so
+# a run is only summarized again when it changed.
+#
+# Stores of other campaigns, e.g. the schedule history or the shards being merged, are opened read-only: they are
+# read without creating, migrating or indexing anything, and stats computed from them are not cached.
+
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import zlib
+
+from abc import ABC, abstractmethod
+from collections.abc import Mapping
+from typing import Iterator, Optional
+
+from .result_fields import LargeFields
+from .scheduling import result_history_key, result_payload, run_duration
+
+INDEX_FILE = "index.jsonl"
+DATABASE_FILE = "results.sqlite"
+
+JSON_STORE = "json"
+SQLITE_STORE = "sqlite"
+RESULTS_STORES = (JSON_STORE, SQLITE_STORE)
+
+SUMMARY_FIELDS = ("agent_name", "agent_version", "instance_id", "repository_url")
+
+def content_hash(result: dict) -> str:
+    return hashlib.sha256(json.dumps(result, sort_keys=True).encode("utf-8")).hexdigest()
+
+def summarize(run_name: str, result: dict, iteration: Optional[int] = None) -> dict:
+    """The manifest entry of a run: its identity, whether it failed, how long it took and a hash of its content."""
+    entry = {"run_name": run_name, "status": "error" if "error" in result_payload(result) else "ok",
+             "hash": content_hash(result)}
+    for field in SUMMARY_FIELDS:
+        if field in result:
+            entry[field] = result[field]
+    if iteration is not None:
+        entry["iteration"] = iteration
+    duration = run_duration(result)
+    if duration is not None:
+        entry["duration"] = duration
+    return entry
+
+def open_results_store(output_path: str, backend: str = JSON_STORE,
+                       large_fields: Optional[LargeFields] = None) -> "ResultsStore":
+    """Open the results store of the benchmark with the given output directory."""
+    if backend == SQLITE_STORE:
+        return SqliteResultsStore(os.path.join(output_path, DATABASE_FILE), large_fields)
+    if backend == JSON_STORE:
+        return JsonResultsStore(os.path.join(output_path, "runs"), large_fields)
+    raise ValueError(f"Unknown results store '{backend}', expected one of: {', '.join(RESULTS_STORES)}")
+
+def open_results_path(path: str, read_only: bool = False) -> "ResultsStore":
+    """Open an existing store by path: a results database, or a directory of run files."""
+    if os.path.isfile(path):
+        return SqliteResultsStore(path, read_only=read_only)
+    return JsonResultsStore(path, read_only=read_only)
+
+def read_only_error(path: str) -> Exception:
+    return Exception(f"Results store {path} is open read-only")
+
+class ResultsStore(ABC, Mapping):
+    """Maps run names to results, loading each result only when it is accessed."""
+
+    @abstractmethod
+    def add(self, run_name: str, result: dict, iteration: Optional[int] = None):
+        ...
+
+    @abstractmethod
+    def entries(self) -> list[dict]:
+        """The summaries of all stored runs."""
+
+    @abstractmethod
+    def cached_stats(self, run_name: str, key: str) -> Optional[dict]:
+        """Stats computed earlier from a run, if they were cached under the same key."""
+
+    @abstractmethod
+    def cache_stats(self, run_name: str, key: str, stats: dict):
+        ...
+
+    def query(self, agent_name: Optional[str] = None, agent_version: Optional[str] = None,
+              instance: Optional[str] = None, iteration: Optional[int] = None,
+              status: Optional[str] = None) -> list[dict]:
+        """The summaries of the runs matching all given fields. instance is a glob on the instance id or repository
+        url, e.g. query(agent_name="kwaak", instance="astropy__*", status="error")."""
+        return [
+            entry for entry in self.entries()
+            if (agent_name is None or entry.get("agent_name") == agent_name)
+            and (agent_version is None or entry.get("agent_version") == agent_version)
+            and (instance is None or fnmatch.fnmatchcase(result_history_key(entry) or "", instance))
+            and (iteration is None or entry.get("iteration") == iteration)
+            and (status is None or entry["status"] == status)
+        ]
+
+class JsonResultsStore(ResultsStore):
+    """One JSON file per run, with a manifest of the finished runs."""
+    runs_path: str
+    index_path: str
+    blobs_path: str
+    index: dict[str, dict]
+    # How large fields of added results are stored, None keeps them in the result
+    large_fields: Optional[LargeFields]
+    read_only: bool
+
+    def __init__(self, runs_path: str, large_fields: Optional[LargeFields] = None, read_only: bool = False):
+        self.runs_path = runs_path
+        self.index_path = os.path.join(runs_path, INDEX_FILE)
+        self.blobs_path = os.path.join(runs_path, "blobs")
+        self.stats_path = os.path.join(runs_path, "stats")
+        self.large_fields = large_fields
+        self.read_only = read_only
+        self.index = {}
+        self.lock = threading.Lock()
+        if not read_only:
+            os.makedirs(runs_path, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut short by a crash, the run is indexed again from its file below
+                        continue
+                    self.index[entry["run_name"]] = entry
+
+        # Listing the directory is cheap compared to parsing the results. Runs whose file was deleted (to run them
+        # again) are dropped, runs stored before the manifest existed, or whose entry was lost, are indexed again.
+        files = os.listdir(self.runs_path) if os.path.isdir(self.runs_path) else []
+        stored = {file.split(".json")[0] for file in files if file.endswith(".json")}
+        for run_name in self.index.keys() - stored:
+            del self.index[run_name]
+
+        missing = []
+        for run_name in sorted(stored - self.index.keys()):
+            with open(self.path(run_name), "r") as f:
+                missing.append(summarize(run_name, json.load(f)))
+
+        for entry in missing:
+            self.index[entry["run_name"]] = entry
+        # A read-only store indexes the runs missing from its manifest in memory only
+        if missing and not self.read_only:
+            logging.info(f"Indexing {len(missing)} stored run(s) in {self.index_path}...")
+            try:
+                self._append_index(missing)
+            except OSError as e:
+                logging.warning(f"Could not update results manifest {self.index_path}: {e}")
+
+    def _append_index(self, entries: list[dict]):
+        with open(self.index_path, "a") as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+
+    def path(self, run_name: str) -> str:
+        return os.path.join(self.runs_path, f"{run_name}.json")
+
+    def add(self, run_name: str, result: dict, iteration: Optional[int] = None):
+        if self.read_only:
+            raise read_only_error(self.runs_path)
+        entry = summarize(run_name, result, iteration)
+        if self.large_fields:
+            result = self.large_fields.pack(run_name, result, self.blobs_path)
+
+        # Write to a temporary file first so concurrent readers never see a partial result
+        path = self.path(run_name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(result, f, indent=2)
+
+        with self.lock:
+            os.replace(tmp_path, path)
+            self._append_index([entry])
+            self.index[run_name] = entry
+
+    def entries(self) -> list[dict]:
+        with self.lock:
+            return list(self.index.values())
+
+    def cached_stats(self, run_name: str, key: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(self.stats_path, f"{run_name}.json"), "r") as f:
+                cached = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        return cached["stats"] if cached.get("key") == key else None
+
+    def cache_stats(self, run_name: str, key: str, stats: dict):
+        if self.read_only:
+            return
+        os.makedirs(self.stats_path, exist_ok=True)
+        path = os.path.join(self.stats_path, f"{run_name}.json")
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"key": key, "stats": stats}, f)
+        os.replace(f"{path}.tmp", path)
+
+    def __getitem__(self, run_name: str) -> dict:
+        if run_name not in self.index:
+            raise KeyError(run_name)
+        with open(self.path(run_name), "r") as f:
+            return LargeFields.unpack(json.load(f), self.blobs_path)
+
+    def __contains__(self, run_name) -> bool:
+        return run_name in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.index))
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+class SqliteResultsStore(ResultsStore):
+    """All runs in one SQLite database, safe to write from parallel workers and processes.
+
+    Results are compressed as a whole, so of the large fields policy only the maximum sizes apply.
+    """
+    path: str
+    large_fields: Optional[LargeFields]
+    read_only: bool
+
+    def __init__(self, path: str, large_fields: Optional[LargeFields] = None, read_only: bool = False):
+        self.path = path
+        self.large_fields = large_fields
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        if read_only:
+            # Neither the journal mode nor the schema of another campaign's database is changed
+            self.connection = sqlite3.connect(f"{pathlib.Path(path).absolute().as_uri()}?mode=ro", uri=True,
+                                              timeout=30, check_same_thread=False)
+            return
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Workers share the connection, writes are serialized by the lock and run in a transaction each
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.connection:
+            # WAL lets reports read while a campaign is writing, and other processes wait for the write lock
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_name TEXT PRIMARY KEY,
+                    agent_name TEXT,
+                    agent_version TEXT,
+                    instance TEXT,
+                    iteration INTEGER,
+                    status TEXT NOT NULL,
+                    summary TEXT NOT NULL,
+                    result BLOB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS runs_agent ON runs (agent_name, agent_version);
+                CREATE INDEX IF NOT EXISTS runs_instance ON runs (instance);
+                CREATE INDEX IF NOT EXISTS runs_status ON runs (status);
+                CREATE TABLE IF NOT EXISTS run_stats (
+                    run_name TEXT PRIMARY KEY,
+                    key TEXT NOT NULL,
+                    stats TEXT NOT NULL
+                );
+            """)
+
+    def add(self, run_name: str, result: dict, iteration: Optional[int] = None):
+        if self.read_only:
+            raise read_only_error(self.path)
+        entry = summarize(run_name, result, iteration)
+        if self.large_fields:
+            result = self.large_fields.limit(result)
+        compressed = zlib.compress(json.dumps(result).encode("utf-8"))
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO runs (run_name, agent_name, agent_version, instance, iteration, status, summary, result) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_name, entry.get("agent_name"), entry.get("agent_version"), result_history_key(entry), iteration,
+                 entry["status"], json.dumps(entry), compressed))
+
+    def _select(self, sql: str, parameters: tuple = ()) -> list[tuple]:
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def entries(self) -> list[dict]:
+        return [json.loads(summary) for summary, in self._select("SELECT summary FROM runs ORDER BY rowid")]
+
+    def query(self, agent_name: Optional[str] = None, agent_version: Optional[str] = None,
+              instance: Optional[str] = None, iteration: Optional[int] = None,
+              status: Optional[str] = None) -> list[dict]:
+        conditions = []
+        parameters = []
+        for column, value in (("agent_name", agent_name), ("agent_version", agent_version),
+                              ("iteration", iteration), ("status", status)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        if instance is not None:
+            conditions.append("instance GLOB ?")
+            parameters.append(instance)
+
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._select(f"SELECT summary FROM runs{where} ORDER BY rowid", tuple(parameters))
+        return [json.loads(summary) for summary, in rows]
+
+    def cached_stats(self, run_name: str, key: str) -> Optional[dict]:
+        rows = self._select("SELECT stats FROM run_stats WHERE run_name = ? AND key = ?", (run_name, key))
+        return json.loads(rows[0][0]) if rows else None
+
+    def cache_stats(self, run_name: str, key: str, stats: dict):
+        if self.read_only:
+            return
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO run_stats (run_name, key, stats) VALUES (?, ?, ?)",
+                                    (run_name, key, json.dumps(stats)))
+
+    def __getitem__(self, run_name: str) -> dict:
+        rows = self._select("SELECT result FROM runs WHERE run_name = ?", (run_name,))
+        if not rows:
+            raise KeyError(run_name)
+        return json.loads(zlib.decompress(rows[0][0]))
+
+    def __contains__(self, run_name) -> bool:
+        return bool(self._select("SELECT 1 FROM runs WHERE run_name = ?", (run_name,)))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([run_name for run_name, in self._select("SELECT run_name FROM runs ORDER BY rowid")])
+
+    def __len__(self) -> int:
+        return self._select("SELECT COUNT(*) FROM runs")[0][0]
+
+    def close(self):
+        self.connection.close()
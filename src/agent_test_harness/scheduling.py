@@ -0,0 +1,85 @@
+# Duration-aware ordering of benchmark runs
+#
+# With parallel workers the makespan of a campaign is dominated by whatever long runs are left at the end. Dispatching
+# the runs that are expected to take longest first (LPT scheduling) keeps the workers busy until the end. Durations are
+# estimated from the results of earlier runs: agent execution time plus provisioning time.
+
+import heapq
+import statistics
+
+from typing import Iterable, Optional
+
+DEFAULT_ORDER = "default"
+LONGEST_FIRST = "longest_first"
+SCHEDULES = (DEFAULT_ORDER, LONGEST_FIRST)
+
+# Used when there is no history at all, a typical SWE-bench run including setup
+DEFAULT_RUN_DURATION = 15 * 60
+
+def result_payload(result: dict) -> dict:
+    # Test writing results wrap the benchmark output in "result", SWE-bench results are flat
+    return result["result"] if isinstance(result.get("result"), dict) else result
+
+def history_key(instance) -> str:
+    """The key runs of an instance are recognized by across campaigns."""
+    if isinstance(instance, dict):
+        return instance["url"]
+    return instance.instance_id
+
+def result_history_key(result: dict) -> Optional[str]:
+    return result.get("instance_id") or result.get("repository_url")
+
+def run_duration(result: dict) -> Optional[float]:
+    """The wall-clock time a finished run took, or None if it did not get as far as running the agent."""
+    payload = result_payload(result)
+    if "agent_execution_time" not in payload:
+        return None
+    duration = payload["agent_execution_time"]
+    duration += payload.get("provisioning", {}).get("provisioning_time", 0)
+    return duration
+
+class DurationEstimator:
+    """Estimates run durations from earlier runs of the same agent and instance, then of the same instance.
+
+    The history is given as results manifest entries, which carry the run's duration under 'duration'.
+    """
+    by_agent_instance: dict[tuple[str, str], list[float]]
+    by_instance: dict[str, list[float]]
+    default: float
+
+    def __init__(self, entries: Iterable[dict], default: Optional[float] = None):
+        self.by_agent_instance = {}
+        self.by_instance = {}
+        durations = []
+
+        for entry in entries:
+            duration = entry.get("duration")
+            key = result_history_key(entry)
+            if duration is None or key is None:
+                continue
+            durations.append(duration)
+            self.by_instance.setdefault(key, []).append(duration)
+            if "agent_name" in entry:
+                self.by_agent_instance.setdefault((entry["agent_name"], key), []).append(duration)
+
+        # Runs without history are assumed to be typical for this campaign
+        if default is not None:
+            self.default = default
+        elif durations:
+            self.default = statistics.median(durations)
+        else:
+            self.default = DEFAULT_RUN_DURATION
+
+    def estimate(self, agent: dict, instance) -> float:
+        key = history_key(instance)
+        durations = self.by_agent_instance.get((agent["name"], key)) or self.by_instance.get(key)
+        if durations:
+            return statistics.mean(durations)
+        return self.default
+
+def estimate_makespan(durations: Iterable[float], jobs: int) -> float:
+    """Simulate dispatching runs in order to the first free of `jobs` workers and return the total time."""
+    workers = [0.0] * max(jobs, 1)
+    for duration in durations:
+        heapq.heapreplace(workers, workers[0] + duration)
+    return max(workers)
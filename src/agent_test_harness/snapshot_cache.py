@@ -0,0 +1,160 @@
+# SnapshotCache keeps docker images of workspaces right after their setup script has run
+#
+# Setting up a workspace (apt, conda, pip, agent installers) is identical for every agent and iteration that runs on
+# the same repository revision, so the first successful setup is committed to an image and later runs start from it.
+# Images are keyed by a hash of the repository url, commit and the combined setup script. Repositories without a
+# pinned commit are keyed by the commit their default branch resolves to, so snapshots don't go stale when it moves.
+# In docker provisioning mode the workspace id is the id of the workspace container, which is what gets committed,
+# with the environment variables of the run that set it up (e.g. its LLM project token) reset.
+
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+SNAPSHOT_IMAGE_REPOSITORY = "agent-test-harness-snapshot"
+DEFAULT_SNAPSHOT_PATH = "tmp/snapshots"
+DEFAULT_SNAPSHOT_MAX_SIZE_GB = 50
+
+class SnapshotCache:
+    path: str
+    max_size_bytes: int
+    rebuild: bool
+    index: dict[str, dict]
+
+    def __init__(self, path: str = DEFAULT_SNAPSHOT_PATH, max_size_gb: float = DEFAULT_SNAPSHOT_MAX_SIZE_GB, rebuild: bool = False):
+        self.path = path
+        self.max_size_bytes = int(max_size_gb * 1024 ** 3)
+        self.rebuild = rebuild
+        self.lock = threading.Lock()
+        # Keys that were rebuilt during this campaign, so --rebuild-snapshots only discards each snapshot once
+        self.rebuilt = set()
+
+        os.makedirs(self.path, exist_ok=True)
+        self.index_path = os.path.join(self.path, "index.json")
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                self.index = json.load(f)
+
+    @classmethod
+    def from_config(cls, config: dict, rebuild: bool = False) -> Optional["SnapshotCache"]:
+        """Create the cache from the 'snapshots' section of the benchmark config, if enabled."""
+        snapshots = config.get("snapshots")
+        if not snapshots or not snapshots.get("enabled", True):
+            return None
+        return cls(
+            path=snapshots.get("path", DEFAULT_SNAPSHOT_PATH),
+            max_size_gb=snapshots.get("max_size_gb", DEFAULT_SNAPSHOT_MAX_SIZE_GB),
+            rebuild=rebuild
+        )
+
+    @staticmethod
+    def key(repository_url: str, commit: str, setup_script: str) -> str:
+        digest = hashlib.sha256()
+        for part in (repository_url, commit, setup_script):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the image for a key and mark it as recently used, or None on a miss."""
+        with self.lock:
+            if self.rebuild and key not in self.rebuilt:
+                return None
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            entry["last_used"] = time.time()
+            self._write_index()
+            return entry["image"]
+
+    def save(self, key: str, container_id: str, reset_env: Iterable[str] = ()) -> Optional[str]:
+        """Commit a freshly set up workspace container as the snapshot for key.
+
+        The environment variables in reset_env are emptied in the image, runs that start from it set their own.
+        """
+        image = f"{SNAPSHOT_IMAGE_REPOSITORY}:{key}"
+        logging.info(f"Saving workspace snapshot {image}...")
+        changes = [argument for name in reset_env for argument in ("--change", f"ENV {name}=")]
+        result = subprocess.run(["docker", "commit", *changes, container_id, image], capture_output=True, text=True)
+        if result.returncode != 0:
+            logging.error(f"Failed to save workspace snapshot {image}: {result.stderr}")
+            return None
+
+        with self.lock:
+            self.rebuilt.add(key)
+            now = time.time()
+            self.index[key] = {"image": image, "size": self._image_size(image), "created": now, "last_used": now}
+            self._evict()
+            self._write_index()
+        return image
+
+    def size(self) -> int:
+        return sum(entry["size"] for entry in self.index.values())
+
+    def _evict(self):
+        # Drop the least recently used snapshots until the cache fits again
+        for key, entry in sorted(self.index.items(), key=lambda item: item[1]["last_used"]):
+            if self.size() <= self.max_size_bytes:
+                break
+            logging.info(f"Evicting workspace snapshot {entry['image']}...")
+            subprocess.run(["docker", "image", "rm", "-f", entry["image"]], capture_output=True)
+            del self.index[key]
+
+    def _image_size(self, image: str) -> int:
+        result = subprocess.run(["docker", "image", "inspect", "--format", "{{.Size}}", image], capture_output=True, text=True)
+        if result.returncode != 0:
+            return 0
+        return int(result.stdout.strip() or 0)
+
+    def _write_index(self):
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+def resolve_head(repository_url: str) -> Optional[str]:
+    """The commit the default branch of a repository points at, or None if it can't be resolved."""
+    result = subprocess.run(["git", "ls-remote", repository_url, "HEAD"], capture_output=True, text=True)
+    commit = result.stdout.split()[0] if result.returncode == 0 and result.stdout.strip() else None
+    if commit is None:
+        logging.warning(f"Could not resolve HEAD of {repository_url}: {result.stderr.strip()}")
+    return commit
+
+@dataclass
+class WorkspaceSnapshot:
+    """The snapshot of a single run: restored from the cache, or saved once its workspace is set up."""
+    cache: SnapshotCache
+    key: str
+    image: Optional[str] = None
+    repository_url: str = ""
+    setup_script: str = ""
+
+    @classmethod
+    def lookup(cls, cache: Optional[SnapshotCache], repository_url: str, commit: Optional[str], setup_script: str) -> Optional["WorkspaceSnapshot"]:
+        if cache is None:
+            return None
+        commit = commit or resolve_head(repository_url)
+        if commit is None:
+            return None
+        key = SnapshotCache.key(repository_url, commit, setup_script)
+        return cls(cache=cache, key=key, image=cache.get(key), repository_url=repository_url, setup_script=setup_script)
+
+    @property
+    def restored(self) -> bool:
+        return self.image is not None
+
+    def save(self, workspace_id: str, head: Optional[str] = None, reset_env: Iterable[str] = ()):
+        """Save the workspace, keyed by head (the commit checked out in it) if given."""
+        if not self.restored:
+            if head:
+                # The default branch may have moved since the lookup resolved it
+                self.key = SnapshotCache.key(self.repository_url, head, self.setup_script)
+            self.image = self.cache.save(self.key, workspace_id, reset_env)
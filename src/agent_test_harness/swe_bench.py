@@ -1,15 +1,30 @@
-from datasets import load_dataset
+import argparse
+import hashlib
+import itertools
 import os
-import yaml
 import subprocess
 import json
 import logging
+import time
+import traceback
+
+from collections import ChainMap
+from collections.abc import Mapping
+from typing import Optional
 
 from .agent_test_benchmark import AgentTestBenchmark
 from .llm_proxy import LLMProxy
-from .workspace_provider import WorkspaceProvider
-from .swe_bench_types import SWEBenchItem
+from .workspace_provider import WorkspaceProvider, start_shared_workspace_provider, start_workspace_provider
+from .swe_bench_dataset import DEFAULT_DATASET, DEFAULT_DATASET_CACHE_PATH, DEFAULT_SPLIT, SWEBenchDataset
 from .benchmark import Benchmark
+from .result_fields import COMPRESSIONS, GZIP
+from .results_store import DATABASE_FILE, JSON_STORE, RESULTS_STORES, open_results_path
+from .snapshot_cache import SnapshotCache, WorkspaceSnapshot, DEFAULT_SNAPSHOT_PATH, DEFAULT_SNAPSHOT_MAX_SIZE_GB
+from .readiness import DEFAULT_STARTUP_DEADLINE
+from .workspace_pool import PreparedRun, WorkspacePool, provisioning_stats, DEFAULT_POOL_SIZE
+from .scheduling import DEFAULT_ORDER, SCHEDULES
+from .templates import AGENTS, REPOSITORIES, TemplateRegistry
+from .test_selection import estimate_time_saved
 
 def cleanup_processes():
     """Kill any existing LLM proxy and workspace provider processes."""
@@ -27,67 +42,255 @@ def get_repository_template(repo: str, version: str) -> dict:
     repo_name = repo.split("/")[1]
     template_name = f"swe-bench/{repo_name}_{version}"
     
-    templates_dir = os.path.join(os.path.dirname(__file__), "templates", "repositories")
-    template_path = os.path.join(templates_dir, f"{template_name}.yaml")
-    
-    if not os.path.exists(template_path):
-        raise ValueError(f"No template found for repository {repo} version {version} at {template_path}")
-        
-    with open(template_path, "r") as f:
-        return yaml.safe_load(f)
+    templates = TemplateRegistry.shared()
+    template = templates.load(REPOSITORIES, template_name)
+    if template is None:
+        raise ValueError(f"No template found for repository {repo} version {version} at {templates.path(REPOSITORIES, template_name)}")
+    return template
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the SWE-bench benchmark")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of benchmark runs to execute in parallel")
+    parser.add_argument("--shared-workspace-provider", default=False, action="store_true",
+                        help="Serve all workspaces from one long-lived workspace provider")
+    parser.add_argument("--snapshots", default=False, action="store_true",
+                        help="Reuse snapshots of set up workspaces across runs")
+    parser.add_argument("--snapshot-path", default=DEFAULT_SNAPSHOT_PATH, help="Directory of the snapshot cache index")
+    parser.add_argument("--snapshot-max-size-gb", type=float, default=DEFAULT_SNAPSHOT_MAX_SIZE_GB,
+                        help="Evict least recently used snapshots above this total size")
+    parser.add_argument("--rebuild-snapshots", default=False, action="store_true",
+                        help="Ignore cached workspace snapshots and set up every workspace again")
+    parser.add_argument("--shard", type=parse_shard,
+                        help="Only run shard i of N (1-based, e.g. 2/4); instances are partitioned by instance_id")
+    parser.add_argument("--startup-deadline", type=float, default=DEFAULT_STARTUP_DEADLINE,
+                        help="Seconds the LLM proxy and workspace providers get to become ready")
+    parser.add_argument("--lookahead", type=int, default=0,
+                        help="Provision workspaces for this many upcoming runs while earlier runs execute")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE,
+                        help="Number of workspaces provisioned ahead of time in parallel")
+    parser.add_argument("--results-store", choices=RESULTS_STORES, default=JSON_STORE,
+                        help="Store run results as JSON files or in one SQLite database")
+    parser.add_argument("--result-compression", choices=COMPRESSIONS, default=GZIP,
+                        help="Compression of large result fields (agent output, diffs, test output)")
+    parser.add_argument("--schedule", choices=SCHEDULES, default=DEFAULT_ORDER,
+                        help="Order of runs; longest_first dispatches the runs expected to take longest first")
+    parser.add_argument("--schedule-history", action="append", default=[], metavar="RUNS_PATH",
+                        help="Runs directory of an earlier campaign to estimate run durations from (repeatable)")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="SWE-bench dataset to run")
+    parser.add_argument("--dataset-cache", default=DEFAULT_DATASET_CACHE_PATH,
+                        help="Directory of the local, indexed copy of the dataset")
+    parser.add_argument("--refresh-dataset", default=False, action="store_true",
+                        help="Download the dataset again instead of using the local copy")
+    parser.add_argument("--instance-id", action="append", default=[], dest="instance_ids",
+                        help="Only run this instance (repeatable)")
+    parser.add_argument("--targeted-tests", default=False, action="store_true",
+                        help="Only run an instance's FAIL_TO_PASS and PASS_TO_PASS tests where the repository template can select them")
+    return parser.parse_args()
+
+class SWEBenchRunner:
+    """Runs SWE-bench instances of a benchmark, each in its own workspace."""
+    benchmark: Benchmark
+    llm_proxy: LLMProxy
+    agent_template: dict
+    jobs: int
+    shared_workspace_provider: Optional[WorkspaceProvider]
+    snapshot_cache: Optional[SnapshotCache]
+    parallel: bool
+    targeted_tests: bool
+
+    def __init__(self, benchmark: Benchmark, llm_proxy: LLMProxy, agent_template: dict, jobs: int = 1,
+                 shared_workspace_provider: Optional[WorkspaceProvider] = None,
+                 snapshot_cache: Optional[SnapshotCache] = None, pool_lookahead: int = 0,
+                 config: Optional[dict] = None, targeted_tests: bool = False):
+        self.benchmark = benchmark
+        self.config = config or {}
+        self.llm_proxy = llm_proxy
+        self.agent_template = agent_template
+        self.jobs = jobs
+        self.shared_workspace_provider = shared_workspace_provider
+        self.snapshot_cache = snapshot_cache
+        self.pool_lookahead = pool_lookahead
+        # Several providers are alive at once when runs execute or are provisioned in parallel
+        self.parallel = jobs > 1 or pool_lookahead > 0
+        self.targeted_tests = targeted_tests
+
+    def prepare_run(self, next_run: dict) -> PreparedRun:
+        """Start the workspace provider and provision the workspace for a run."""
+        item = next_run["instance"]
+
+        # Get repository template
+        repository = get_repository_template(item.repo, item.version)
+
+        # Configure workspace provider
+        repo_setup_script = repository.get("setup_script", "")
+        agent_setup_script = self.agent_template.get("setup_script", "")
+        setup_script = f"{repo_setup_script}\n\n# Agent setup script:\n\n{agent_setup_script}"
+
+        snapshot = WorkspaceSnapshot.lookup(self.snapshot_cache, repository["url"], item.base_commit, setup_script)
+        if snapshot and snapshot.restored:
+            logging.info(f"Restoring workspace for {item.instance_id} from snapshot {snapshot.image}...")
+
+        workspace_provider = start_workspace_provider(
+            name=item.instance_id,
+            repository=repository,
+            setup_script=setup_script,
+            daemon=self.shared_workspace_provider,
+            parallel=self.parallel,
+            image=snapshot.image if snapshot else None,
+            config=self.config
+        )
+
+        agent_test_benchmark = AgentTestBenchmark(
+            name=item.instance_id,
+            llm_proxy=self.llm_proxy,
+            workspace_provider=workspace_provider,
+            agent=self.agent_template,
+            repository=repository,
+            swebench_item=item,
+            snapshot=snapshot,
+            log_path=self.benchmark.log_path(next_run["run_name"]),
+            targeted_tests=self.targeted_tests
+        )
+        try:
+            agent_test_benchmark.provision()
+        except Exception:
+            workspace_provider.stop()
+            raise
+
+        return PreparedRun(workspace_provider, agent_test_benchmark, snapshot)
+
+    def run_instance(self, next_run: dict):
+        """Run a single SWE-bench instance and store its result in the benchmark.
+
+        Runs that fail store an error result, so they aren't handed out again and retried by every worker.
+        """
+        item = next_run["instance"]
+        run_name = next_run["run_name"]
+        try:
+            benchmark_result = self.benchmark_instance(next_run)
+        except Exception as e:
+            logging.error(f"Error running benchmark {run_name} for {item.instance_id}: {e}")
+            benchmark_result = {
+                "instance_id": item.instance_id,
+                "agent_name": self.agent_template["name"],
+                "agent_version": self.agent_template["version"],
+                "error": str(e),
+                "backtrace": traceback.format_exc(),
+            }
+        self.benchmark.add_result(run_name, benchmark_result)
+
+    def benchmark_instance(self, next_run: dict) -> dict:
+        """Run the agent on a SWE-bench instance and return the result."""
+        item = next_run["instance"]
+        run_name = next_run["run_name"]
+
+        logging.info(f"Running benchmark {run_name} for {item.instance_id} from repository {item.repo} version {item.version} at commit {item.base_commit}")
+        logging.info(f"Expected failing tests: {item.FAIL_TO_PASS}")
+        logging.info(f"Expected passing tests: {item.PASS_TO_PASS}")
+
+        if "prepare_error" in next_run:
+            raise next_run["prepare_error"]
+
+        prepared = next_run.get("prepared")
+        if prepared is None:
+            start_time = time.time()
+            prepared = self.prepare_run(next_run)
+            provisioning_time = time.time() - start_time
+            next_run["provisioning"] = provisioning_stats(provisioning_time, provisioning_time)
+
+        logging.info(f"Provisioning time saved for {item.instance_id}: {next_run['provisioning']['saved_time']:.1f}s")
+        prepared.agent_test_benchmark.results["provisioning"] = next_run["provisioning"]
+
+        # Run the benchmark
+        try:
+            benchmark_result = prepared.agent_test_benchmark.run()
+            benchmark_result["http_latency"] = prepared.workspace_provider.latency_stats()
+            benchmark_result["startup_times"] = {
+                "llm_proxy": self.llm_proxy.startup_time,
+                "workspace_provider": prepared.workspace_provider.startup_time,
+            }
+        finally:
+            prepared.stop()
+
+        benchmark_result["instance_id"] = item.instance_id
+        benchmark_result["agent_name"] = self.agent_template["name"]
+        benchmark_result["agent_version"] = self.agent_template["version"]
+
+        if "error" in benchmark_result:
+            logging.error(f"Error running benchmark {run_name} for {item.instance_id}: {benchmark_result['error']}")
+
+        return benchmark_result
+
+    def run(self, pool_size: int = DEFAULT_POOL_SIZE):
+        pool = None
+        if self.pool_lookahead > 0:
+            pool = WorkspacePool(self.benchmark.next_run, self.prepare_run, size=pool_size, lookahead=self.pool_lookahead,
+                                 requeue=self.benchmark.requeue)
+        try:
+            self.benchmark.run(self.run_instance, self.jobs, next_run=pool.next_run if pool else None)
+        finally:
+            if pool:
+                pool.close()
+        logging.info(f"LLM proxy latency per endpoint: {self.llm_proxy.latency_stats()}")
+        if self.targeted_tests:
+            self.log_test_time_saved()
+
+    def log_test_time_saved(self):
+        """Log the test time targeted runs saved, compared to the full suite runs of the same templates in this
+        campaign and in the campaigns given as schedule history."""
+        history = [open_results_path(path, read_only=True) for path in self.benchmark.config.get("schedule_history", [])
+                   if os.path.exists(path)]
+        saved = estimate_time_saved(self.benchmark.results.values(),
+                                    itertools.chain.from_iterable(store.values() for store in history))
+        logging.info(f"Targeted test runs: {saved['targeted_runs']}, estimated test time saved over "
+                     f"{saved['estimated_runs']} of them: {saved['saved_time']:.1f}s")
 
 def run_swe_bench():
     """Run a SWE-bench benchmark."""
+    args = parse_args()
+
     # Configure logging
     logging.basicConfig(level=logging.INFO)
     
     # Clean up any existing processes
     cleanup_processes()
     
-    # Load the dataset
-    dataset = load_dataset('princeton-nlp/SWE-bench_Verified', split='test')
+    # Load the dataset, from the local cache after the first time
+    dataset = SWEBenchDataset.load(args.dataset, DEFAULT_SPLIT, args.dataset_cache, refresh=args.refresh_dataset)
     logging.info(f"Total items in test split: {len(dataset)}\n")
-    predictions = []
-
-    all_repos = list(set([item["repo"] for item in dataset]))
 
-    # Convert dataset to list and sort by instance_id
-    dataset_list = list(dataset)
-    dataset_list.sort(key=lambda x: x["instance_id"])
+    if args.instance_ids:
+        missing = [instance_id for instance_id in args.instance_ids if dataset.get(instance_id) is None]
+        if missing:
+            raise ValueError(f"Unknown instance ids: {', '.join(missing)}")
+        dataset_items = [dataset.get(instance_id) for instance_id in args.instance_ids]
+    else:
+        # Get the first 10 items for each repo from the dataset
+        dataset_items = dataset.first_per_repo(10)
 
-    # Get the first 10 items for each repo from the dataset
-    raw_dataset_items = []
-    for repo in all_repos:
-        repo_items = [item for item in dataset_list if item["repo"] == repo]
-        raw_dataset_items.extend(repo_items[:10])
-
-    print(f"Total items for each repo: {len(raw_dataset_items)}\n")
+    print(f"Total items for each repo: {len(dataset_items)}\n")
     # Print all instance_ids
-    print(f"Instance ids: {list(set([item['instance_id'] for item in raw_dataset_items]))}\n")
+    print(f"Instance ids: {[item.instance_id for item in dataset_items]}\n")
+
+    if args.shard:
+        dataset_items = [item for item in dataset_items if in_shard(item.instance_id, args.shard)]
+        print(f"Items in shard {args.shard[0]}/{args.shard[1]}: {len(dataset_items)}\n")
 
     # Get agent template
-    agent_template_path = os.path.join(os.path.dirname(__file__), "templates", "agents", "kwaak.yaml")
-    with open(agent_template_path, "r") as f:
-        agent_template = yaml.safe_load(f)
+    agent_template = load_agent_template()
 
     # Configure benchmark, output path should be current working directory, not relative to the current file
     benchmark_config = {
             "results_path": os.path.join(os.getcwd(), "results"),
-            "runs": 1
+            "runs": 1,
+            "results_store": args.results_store,
+            "large_fields": {"compression": args.result_compression},
+            "schedule": args.schedule,
+            "schedule_history": args.schedule_history
     }
 
     logging.info(f"Results path: {benchmark_config['results_path']}")
-    logging.info(f"Running benchmark with {benchmark_config['runs']} runs")
-
-    dataset_items = []
-    for item in raw_dataset_items:
-        # Parse the JSON strings into lists
-        item["FAIL_TO_PASS"] = json.loads(item["FAIL_TO_PASS"])
-        item["PASS_TO_PASS"] = json.loads(item["PASS_TO_PASS"])
-
-        item = SWEBenchItem(**item)
-        dataset_items.append(item)
-
+    logging.info(f"Running benchmark with {benchmark_config['runs']} runs and {args.jobs} parallel job(s)")
 
     benchmark = Benchmark("swe_bench", benchmark_config, [agent_template], dataset_items)
 
@@ -99,73 +302,118 @@ def run_swe_bench():
             "api_key": os.environ.get("OPENAI_API_KEY"),
             "base_url": os.environ.get("OPENAI_API_BASE"),
             "model": "gpt-4"
-        }
+        },
+        "startup_deadline": args.startup_deadline
     }
     llm_proxy = LLMProxy(config)
     llm_proxy.run()
 
-    while next_run := benchmark.next_run():
-        item = next_run["instance"]
-        run_name = next_run["run_name"]
+    snapshot_cache = None
+    if args.snapshots:
+        snapshot_cache = SnapshotCache(args.snapshot_path, args.snapshot_max_size_gb, rebuild=args.rebuild_snapshots)
 
-        logging.info(f"Running benchmark {run_name} for {item.instance_id} from repository {item.repo} version {item.version} at commit {item.base_commit}")
-        logging.info(f"Expected failing tests: {item.FAIL_TO_PASS}")
-        logging.info(f"Expected passing tests: {item.PASS_TO_PASS}")
-        
-        # Get repository template
-        repository = get_repository_template(item.repo, item.version)
+    shared_workspace_provider = None
+    if args.shared_workspace_provider:
+        shared_workspace_provider = start_shared_workspace_provider(config=config)
 
-        # Configure workspace provider
-        repo_setup_script = repository.get("setup_script", "")
-        agent_setup_script = agent_template.get("setup_script", "")
-        setup_script = f"{repo_setup_script}\n\n# Agent setup script:\n\n{agent_setup_script}"
+    runner = SWEBenchRunner(benchmark, llm_proxy, agent_template, jobs=args.jobs,
+                            shared_workspace_provider=shared_workspace_provider,
+                            snapshot_cache=snapshot_cache, pool_lookahead=args.lookahead, config=config,
+                            targeted_tests=args.targeted_tests)
+    try:
+        runner.run(pool_size=args.pool_size)
+    finally:
+        if shared_workspace_provider:
+            shared_workspace_provider.stop()
 
-        workspace_provider = WorkspaceProvider(
-            name=item.instance_id,
-            repository=repository,
-            setup_script=setup_script
-        )
-        workspace_provider.run()
-        
-        # Run the benchmark
-        benchmark_result = AgentTestBenchmark(
-            name=item.instance_id,
-            llm_proxy=llm_proxy,
-            workspace_provider=workspace_provider,
-            agent=agent_template,
-            repository=repository,
-            swebench_item=item
-        ).run()
+    export_results(benchmark.results, agent_template)
 
-        benchmark_result["instance_id"] = item.instance_id
+def export_results(results: Mapping[str, dict], agent_template: dict, output_path: str = "."):
+    """Write the SWE-bench predictions and the raw results of all runs.
 
-        workspace_provider.stop()
+    Both files are written in one pass, loading one result at a time.
+    """
+    with open(os.path.join(output_path, "predictions.jsonl"), "w") as predictions, \
+            open(os.path.join(output_path, "swe_bench_results.json"), "w") as raw_results:
+        raw_results.write("{")
+        for index, name in enumerate(sorted(results)):
+            result = results[name]
+            raw_results.write(f"{', ' if index else ''}{json.dumps(name)}: {json.dumps(result)}")
 
-        if "error" in benchmark_result:
-            logging.error(f"Error running benchmark {run_name} for {item.instance_id}: {benchmark_result['error']}")
+            if "error" in result:
+                continue
+
+            agent_name = result.get("agent_name", agent_template["name"])
+            agent_version = result.get("agent_version", agent_template["version"])
+            prediction = {
+                "instance_id": result["instance_id"],
+                "model_name_or_path": f"{agent_name}-{agent_version}",
+                "model_patch": result['git_diff'],
+                "run_name": name
+            }
+            predictions.write(json.dumps(prediction) + "\n")
+        raw_results.write("}")
+
+def load_agent_template(name: str = "kwaak") -> dict:
+    templates = TemplateRegistry.shared()
+    template = templates.load(AGENTS, name)
+    if template is None:
+        raise FileNotFoundError(f"No agent template at {templates.path(AGENTS, name)}")
+    return template
 
-        benchmark.add_result(run_name, benchmark_result)
+def parse_shard(shard: str) -> tuple[int, int]:
+    """Parse a 1-based "i/N" shard specification."""
+    try:
+        index, count = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid shard '{shard}', expected i/N, e.g. 1/4")
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"Invalid shard '{shard}', i must be between 1 and N")
+    return index, count
+
+def in_shard(instance_id: str, shard: tuple[int, int]) -> bool:
+    """Deterministically assign an instance to one of N shards, the same way on every machine."""
+    index, count = shard
+    digest = hashlib.sha256(instance_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count == index - 1
+
+def merge_results(results_paths: list[str]) -> Mapping[str, dict]:
+    """Combine the run results of several shards.
 
+    Each path is a results directory, or the swe_bench/runs directory or swe_bench/results.sqlite database in it.
 
-    for name, result in benchmark.results.items():
-        if "error" in result:
-            continue
+    Results are read from the shards when they are accessed, so merging does not hold every run in memory.
+    """
+    stores = []
+    for results_path in results_paths:
+        runs_path = results_path
+        for candidate in (os.path.join(results_path, "swe_bench", DATABASE_FILE), os.path.join(results_path, "swe_bench", "runs")):
+            if os.path.exists(candidate):
+                runs_path = candidate
+                break
 
-        prediction = {
-            "instance_id": result["instance_id"],
-            "model_name_or_path": f"{agent_template['name']}-{agent_template['version']}",
-            "model_patch": result['git_diff'],
-            "run_name": name
-        }
+        store = open_results_path(runs_path, read_only=True)
+        for existing in stores:
+            for run_name in sorted(existing.keys() & store.keys()):
+                logging.warning(f"Run {run_name} found in more than one shard, using the one from {runs_path}")
+        stores.append(store)
 
-        predictions.append(prediction)
+    # Later shards take precedence, as the first mapping of a ChainMap wins
+    return ChainMap(*reversed(stores))
 
-    with open("predictions.jsonl", "w") as f:
-        for prediction in predictions:
-            f.write(json.dumps(prediction) + "\n")
+def merge_swe_bench():
+    """Merge the results of sharded SWE-bench runs into one predictions.jsonl and swe_bench_results.json."""
+    parser = argparse.ArgumentParser(description="Merge the results of sharded SWE-bench runs")
+    parser.add_argument("results_paths", nargs="+", help="Results directories of the shards")
+    parser.add_argument("-o", "--output", default=".", help="Directory to write the merged predictions and results to")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
 
-    with open("swe_bench_results.json", "w") as f:
-        json.dump(benchmark.results, f)
+    results = merge_results(args.results_paths)
+    os.makedirs(args.output, exist_ok=True)
+    export_results(results, load_agent_template(), args.output)
+    logging.info(f"Merged {len(results)} runs from {len(args.results_paths)} shard(s) into {args.output}")
 
 if __name__ == "__main__":
     run_swe_bench()
@@ -0,0 +1,100 @@
+# SWEBenchDataset is a local, indexed copy of a SWE-bench split
+#
+# The split is downloaded with the datasets library once, converted to SWEBenchItems (with FAIL_TO_PASS and
+# PASS_TO_PASS parsed) and pickled together with indexes by instance id, repository and repository version. Later
+# campaigns load the pickle without network access or the datasets library, and select instances through the indexes.
+
+import json
+import logging
+import os
+import pickle
+
+from typing import Iterable, Optional
+
+from .swe_bench_types import SWEBenchItem
+
+DEFAULT_DATASET = "princeton-nlp/SWE-bench_Verified"
+DEFAULT_SPLIT = "test"
+DEFAULT_DATASET_CACHE_PATH = "tmp/swe_bench"
+
+# Bump when the cached format changes, so older caches are rebuilt
+CACHE_VERSION = 1
+
+def to_item(row: dict) -> SWEBenchItem:
+    row = dict(row)
+    for field in ("FAIL_TO_PASS", "PASS_TO_PASS"):
+        # The dataset stores the test lists as JSON strings
+        if isinstance(row[field], str):
+            row[field] = json.loads(row[field])
+    return SWEBenchItem(**{name: row[name] for name in SWEBenchItem.__dataclass_fields__})
+
+class SWEBenchDataset:
+    """SWE-bench items sorted by instance id, with indexes to select them."""
+    items: list[SWEBenchItem]
+    by_instance_id: dict[str, SWEBenchItem]
+    by_repo: dict[str, list[SWEBenchItem]]
+    by_repo_version: dict[tuple[str, str], list[SWEBenchItem]]
+
+    def __init__(self, items: Iterable[SWEBenchItem]):
+        self.items = sorted(items, key=lambda item: item.instance_id)
+        self.by_instance_id = {}
+        self.by_repo = {}
+        self.by_repo_version = {}
+        for item in self.items:
+            self.by_instance_id[item.instance_id] = item
+            self.by_repo.setdefault(item.repo, []).append(item)
+            self.by_repo_version.setdefault((item.repo, item.version), []).append(item)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[dict]) -> "SWEBenchDataset":
+        return cls(to_item(row) for row in rows)
+
+    @classmethod
+    def load(cls, dataset: str = DEFAULT_DATASET, split: str = DEFAULT_SPLIT,
+             cache_path: str = DEFAULT_DATASET_CACHE_PATH, refresh: bool = False) -> "SWEBenchDataset":
+        """Load a split from the cache, downloading and caching it first if it isn't cached or refresh is set."""
+        path = cls.cache_file(cache_path, dataset, split)
+        if not refresh and os.path.exists(path):
+            try:
+                with open(path, "rb") as f:
+                    cached = pickle.load(f)
+                if cached.get("version") == CACHE_VERSION:
+                    logging.info(f"Loaded {len(cached['dataset'].items)} SWE-bench items from {path}")
+                    return cached["dataset"]
+                logging.info(f"Dataset cache {path} has an older format, rebuilding it")
+            except (OSError, ValueError, EOFError, AttributeError, ImportError, pickle.UnpicklingError) as e:
+                logging.warning(f"Could not read dataset cache {path}, rebuilding it: {e}")
+
+        from datasets import load_dataset
+        swe_bench = cls.from_rows(load_dataset(dataset, split=split))
+
+        os.makedirs(cache_path, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"version": CACHE_VERSION, "dataset": swe_bench}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        logging.info(f"Cached {len(swe_bench.items)} SWE-bench items in {path}")
+        return swe_bench
+
+    @staticmethod
+    def cache_file(cache_path: str, dataset: str, split: str) -> str:
+        return os.path.join(cache_path, f"{dataset.replace('/', '__')}-{split}.pickle")
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def repos(self) -> list[str]:
+        return sorted(self.by_repo)
+
+    def get(self, instance_id: str) -> Optional[SWEBenchItem]:
+        return self.by_instance_id.get(instance_id)
+
+    def for_repo(self, repo: str, version: Optional[str] = None) -> list[SWEBenchItem]:
+        """The items of a repository, or of one version of it, sorted by instance id."""
+        if version is None:
+            return self.by_repo.get(repo, [])
+        return self.by_repo_version.get((repo, version), [])
+
+    def first_per_repo(self, count: int) -> list[SWEBenchItem]:
+        """The first count items by instance id of every repository."""
+        return [item for repo in self.repos() for item in self.by_repo[repo][:count]]
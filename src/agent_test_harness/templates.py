@@ -0,0 +1,119 @@
+# TemplateRegistry loads agent, platform and repository templates once per process
+#
+# There are hundreds of templates and every run of a campaign looks one up. The registry keeps every template it has
+# parsed in a precompiled (pickled) form keyed by its path, and reparses it only when the file's modification time or
+# size changes. Config entries are merged with their templates once per distinct entry. Lookups return fresh copies,
+# so callers can change what they get without affecting the cache or each other.
+
+import json
+import os
+import pickle
+import threading
+
+from typing import Callable, Optional
+
+import yaml
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), "templates")
+
+AGENTS = "agents"
+PLATFORMS = "platforms"
+REPOSITORIES = "repositories"
+
+def file_signature(path: str) -> Optional[tuple[int, int]]:
+    """The modification time and size of a file, or None if it can't be read."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+class TemplateRegistry:
+    templates_dir: str
+    # Pickled templates by path, with the signature of the file they were parsed from
+    compiled: dict[str, tuple[tuple[int, int], bytes]]
+    # Pickled config entries merged with their templates by the loader used, with the signatures of the templates used
+    resolved: dict[tuple[str, str, Callable], tuple[list[tuple[str, tuple[int, int]]], bytes]]
+
+    registries: dict[str, "TemplateRegistry"] = {}
+    registries_lock = threading.Lock()
+
+    def __init__(self, templates_dir: str = TEMPLATES_DIR):
+        self.templates_dir = templates_dir
+        self.compiled = {}
+        self.resolved = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, templates_dir: str = TEMPLATES_DIR) -> "TemplateRegistry":
+        """The registry of a templates directory, shared by everything in the process."""
+        with cls.registries_lock:
+            if templates_dir not in cls.registries:
+                cls.registries[templates_dir] = cls(templates_dir)
+            return cls.registries[templates_dir]
+
+    def path(self, template_type: str, name: str) -> str:
+        return os.path.join(self.templates_dir, template_type, f"{name}.yaml")
+
+    def load(self, template_type: str, name: str) -> Optional[dict]:
+        """A copy of a template, or None if there is no such template."""
+        path = self.path(template_type, name)
+        # A single stat tells whether a cached template is current, existence is only checked for files it can't read
+        signature = file_signature(path)
+        if signature is None and not os.path.exists(path):
+            return None
+
+        with self.lock:
+            cached = self.compiled.get(path)
+        if cached and signature is not None and cached[0] == signature:
+            return pickle.loads(cached[1])
+
+        with open(path, "r") as f:
+            template = yaml.safe_load(f)
+        # Files that can't be stat'ed are not cached, there is nothing to tell when they change
+        if signature is not None:
+            with self.lock:
+                self.compiled[path] = (signature, pickle.dumps(template))
+        return template
+
+    def resolve(self, kind: str, overrides: dict, load: Optional[Callable[[str, str], Optional[dict]]] = None) -> dict:
+        """Merge an agent or repository entry of a config with its templates.
+
+        Repositories are merged from their template, then their platform template, with the entry itself taking
+        precedence over both. The result is computed once per distinct entry and loader, until one of its templates
+        changes.
+        """
+        load = load or self.load
+        key = (kind, json.dumps(overrides, sort_keys=True, default=str), load)
+        with self.lock:
+            cached = self.resolved.get(key)
+        if cached and all(file_signature(path) == signature for path, signature in cached[0]):
+            return pickle.loads(cached[1])
+
+        sources = []
+
+        def load_source(template_type: str, name: str) -> Optional[dict]:
+            sources.append(self.path(template_type, name))
+            return load(template_type, name)
+
+        entry = {}
+        if kind == AGENTS:
+            if "name" in overrides:
+                entry = load_source(AGENTS, overrides["name"]) or {}
+            entry.update(overrides)
+        else:
+            if "name" in overrides:
+                entry = load_source(REPOSITORIES, overrides["name"]) or {}
+            entry.update(overrides)
+            if "platform" in entry:
+                # Platform template has lowest precedence
+                entry.update(load_source(PLATFORMS, entry["platform"]) or {})
+            # override again because platform template might have overridden some fields
+            entry.update(overrides)
+
+        signatures = [(path, file_signature(path)) for path in sources]
+        # Only entries made from template files alone are cached, names without a template are rare and cheap
+        if all(signature is not None for _, signature in signatures):
+            with self.lock:
+                self.resolved[key] = (signatures, pickle.dumps(entry))
+        return entry
@@ -0,0 +1,66 @@
+# Test-impact selection for the per-file loop of test writing runs
+#
+# The baseline test run records which tests executed every source file (coverage.py's dynamic contexts). After the
+# agent worked on a file, only the tests that cover the files it changed or the target file, and the test files it
+# changed, run again instead of the whole suite. Repository or platform templates opt in with a
+# `test_contexts_command` that runs the suite recording contexts into the JSON report at `coverage_contexts_path`,
+# and an `impact_test_command` with a `{tests}` placeholder for the selected test files.
+
+import json
+import os
+import shlex
+
+from typing import Iterable, Optional
+
+TEST_FILE_PREFIXES = ("test_",)
+TEST_FILE_SUFFIXES = ("_test.py", "_tests.py")
+
+def is_test_file(path: str) -> bool:
+    name = os.path.basename(path)
+    return name.endswith(".py") and (name.startswith(TEST_FILE_PREFIXES) or name.endswith(TEST_FILE_SUFFIXES))
+
+def context_test_file(context: str) -> Optional[str]:
+    """The test file of a coverage context like tests/test_a.py::TestA::test_b|run, None for the empty context."""
+    test = context.split("|")[0]
+    if not test:
+        return None
+    return test.split("::")[0]
+
+class TestImpact:
+    """Which test files execute each source file, from the baseline run."""
+    # Not a test class, despite its name
+    __test__ = False
+    tests_by_file: dict[str, set[str]]
+
+    def __init__(self, tests_by_file: dict[str, set[str]]):
+        self.tests_by_file = tests_by_file
+
+    @classmethod
+    def from_coverage_json(cls, report: str) -> "TestImpact":
+        """Read a report of `coverage json --show-contexts`."""
+        tests_by_file = {}
+        for path, file_report in json.loads(report).get("files", {}).items():
+            tests = set()
+            for contexts in file_report.get("contexts", {}).values():
+                for context in contexts:
+                    test_file = context_test_file(context)
+                    if test_file:
+                        tests.add(test_file)
+            tests_by_file[os.path.normpath(path)] = tests
+        return cls(tests_by_file)
+
+    def tests_for(self, changed_files: Iterable[str], target_file: str) -> list[str]:
+        """The test files to run after the agent changed files while working on target_file."""
+        tests = set()
+        for path in [*changed_files, target_file]:
+            path = os.path.normpath(path)
+            if is_test_file(path):
+                tests.add(path)
+            tests.update(self.tests_by_file.get(path, ()))
+        return sorted(tests)
+
+def impact_test_command(repository: dict, tests: list[str]) -> str:
+    return repository["impact_test_command"].replace("{tests}", " ".join(shlex.quote(test) for test in tests))
+
+def supports_test_impact(repository: dict) -> bool:
+    return all(key in repository for key in ("test_contexts_command", "coverage_contexts_path", "impact_test_command"))
@@ -0,0 +1,120 @@
+# Targeted test execution for SWE-bench validation
+#
+# SWE-bench only checks the outcome of an instance's FAIL_TO_PASS and PASS_TO_PASS tests, so running the whole suite
+# before and after the agent is wasted time for big suites like sympy and django. Repository templates that can select
+# tests declare a `targeted_test_command` with a `{tests}` placeholder and a `test_selection` format that tells how
+# test ids are passed to their runner. Templates without them keep running the full `test_command`.
+
+import itertools
+import re
+import shlex
+
+from typing import Iterable, Optional
+
+from .swe_bench_types import SWEBenchItem
+
+# pytest node ids, e.g. tests/test_a.py::TestA::test_b[1]
+PYTEST = "pytest"
+# Django's runtests.py labels, e.g. "test_b (module.tests.TestA)" is passed as module.tests.TestA.test_b
+DJANGO = "django"
+# sympy's bin/test takes the test files of the instance's test patch
+SYMPY = "sympy"
+TEST_SELECTIONS = (PYTEST, DJANGO, SYMPY)
+
+TARGETED = "targeted"
+FULL = "full"
+
+# Past this length the command line is too long for a shell, tests are selected by file instead
+MAX_ARGUMENTS_LENGTH = 100_000
+
+DJANGO_TEST_ID = re.compile(r"^(\w+) \(([\w.]+)\)$")
+PATCH_FILE = re.compile(r"^diff --git a/(\S+) b/", re.MULTILINE)
+
+def patch_files(test_patch: str) -> list[str]:
+    """The files changed by a patch, in order."""
+    return list(dict.fromkeys(PATCH_FILE.findall(test_patch)))
+
+def pytest_arguments(test_ids: list[str]) -> list[str]:
+    # Node ids that pytest prints can't always be passed back, SWE-bench cuts parametrized ids at spaces
+    if all(" " not in test_id for test_id in test_ids) and sum(len(test_id) + 3 for test_id in test_ids) < MAX_ARGUMENTS_LENGTH:
+        return test_ids
+    return list(dict.fromkeys(test_id.split("::")[0] for test_id in test_ids))
+
+def django_arguments(test_ids: list[str], test_patch: str) -> list[str]:
+    labels = []
+    for test_id in test_ids:
+        match = DJANGO_TEST_ID.match(test_id)
+        if not match:
+            # Tests with docstrings are listed by their description, select the modules of the test patch instead
+            return [django_module(path) for path in patch_files(test_patch) if path.endswith(".py")]
+        method, path = match.groups()
+        # Python 3.11+ prints the full path of a test, e.g. test_q (queries.test_q.QTests.test_q)
+        labels.append(path if path.endswith(f".{method}") else f"{path}.{method}")
+    return labels
+
+def django_module(path: str) -> str:
+    """The test label of a test module, e.g. tests/queries/test_q.py is queries.test_q."""
+    if path.startswith("tests/"):
+        path = path[len("tests/"):]
+    return path[:-len(".py")].replace("/", ".")
+
+def selection_arguments(test_selection: str, item: SWEBenchItem) -> list[str]:
+    """The arguments that select the tests of an instance for a runner, empty if they can't be selected."""
+    test_ids = list(dict.fromkeys([*item.FAIL_TO_PASS, *item.PASS_TO_PASS]))
+    if not test_ids:
+        return []
+    if test_selection == PYTEST:
+        return pytest_arguments(test_ids)
+    if test_selection == DJANGO:
+        return django_arguments(test_ids, item.test_patch)
+    if test_selection == SYMPY:
+        return [path for path in patch_files(item.test_patch) if path.endswith(".py")]
+    raise ValueError(f"Unknown test selection '{test_selection}', expected one of {', '.join(TEST_SELECTIONS)}")
+
+def targeted_test_command(repository: dict, item: SWEBenchItem) -> Optional[str]:
+    """The command that runs only the tests of an instance, or None if the full test command has to run."""
+    command = repository.get("targeted_test_command")
+    if not command:
+        return None
+    arguments = selection_arguments(repository.get("test_selection", PYTEST), item)
+    if not arguments:
+        return None
+    return command.replace("{tests}", " ".join(shlex.quote(argument) for argument in arguments))
+
+def template_key(item: SWEBenchItem) -> str:
+    """Instances of the same repository and version share a template and so a test suite."""
+    return f"{item.repo}@{item.version}"
+
+def estimate_time_saved(results: Iterable[dict], history: Iterable[dict] = ()) -> dict:
+    """Estimate the test time saved by the targeted runs among results.
+
+    For every template the full suite takes the average time of its full runs in results and history, per test
+    invocation. Targeted runs of templates that never ran the full suite are counted but not estimated.
+    """
+    full_times = {}
+    targeted = []
+    for result, in_history in itertools.chain(((result, False) for result in results),
+                                              ((result, True) for result in history)):
+        selection = result.get("test_selection")
+        if not selection or not selection["invocations"]:
+            continue
+        if selection["mode"] == FULL:
+            total, count = full_times.get(selection["template"], (0.0, 0))
+            full_times[selection["template"]] = (total + selection["test_time"], count + selection["invocations"])
+        elif not in_history:
+            targeted.append(selection)
+
+    saved_time = 0.0
+    estimated_runs = 0
+    for selection in targeted:
+        if selection["template"] not in full_times:
+            continue
+        total, count = full_times[selection["template"]]
+        saved_time += total / count * selection["invocations"] - selection["test_time"]
+        estimated_runs += 1
+
+    return {
+        "targeted_runs": len(targeted),
+        "estimated_runs": estimated_runs,
+        "saved_time": saved_time,
+    }
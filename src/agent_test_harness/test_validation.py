@@ -1,60 +1,221 @@
 """Functions for validating test output in SWE-bench tests."""
 
+import io
+import itertools
+import re
+import xml.etree.ElementTree as ET
+
 from dataclasses import dataclass
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Set, Union
 
 
 @dataclass
 class TestResults:
-    passed: List[str]
-    failed: List[str]
-    output: str
+    # Not a test class, despite its name
+    __test__ = False
+
+    passed: Set[str]
+    failed: Set[str]
+    output: str = ""
+    # The format the output was recognized as, e.g. "pytest" or "junit"
+    format: Optional[str] = None
+
+    def __post_init__(self):
+        # Sets make membership checks constant time, instances can have thousands of expected tests
+        self.passed = set(self.passed)
+        self.failed = set(self.failed)
+
+
+# pytest -rA short test summary: "PASSED test_id" or "FAILED test_id - message"
+# An expected failure passes, as in the SWE-bench harness, which grades XFAIL like PASSED. A non-strict XPASS is a test
+# that ran without failing.
+PYTEST_SUMMARY_STATUSES = {"PASSED": True, "XPASS": True, "XFAIL": True, "FAILED": False, "ERROR": False}
+# pytest -v: "tests/test_a.py::test_b PASSED    [ 10%]"
+PYTEST_VERBOSE_LINE = re.compile(r"^(\S+::[^\s\[]+(?:\[.*\])?) (PASSED|FAILED|ERROR|XPASS|XFAIL)\b")
+# Django and unittest -v: "test_name (module.TestCase) ... ok"
+UNITTEST_LINE = re.compile(r"^(\S+ \([\w.]+\))(?: \S.*)? \.\.\. (ok|FAIL|ERROR|expected failure)$")
+# Tests with a docstring print their name on one line and "Docstring ... ok" on the next
+UNITTEST_NAME_LINE = re.compile(r"^(\S+ \([\w.]+\))$")
+UNITTEST_STATUS_LINE = re.compile(r"^.* \.\.\. (ok|FAIL|ERROR|expected failure)$")
+# sympy's bin/test: "test_name ok" or "test_name F"
+SYMPY_LINE = re.compile(r"^(test_\w+) (ok|F|E)$")
+
+UNITTEST_STATUSES = {"ok": True, "expected failure": True, "FAIL": False, "ERROR": False}
+SYMPY_STATUSES = {"ok": True, "F": False, "E": False}
+
+
+def summary_test_id(rest: str) -> str:
+    """The test id of a pytest summary line without its status, dropping the " - message" that may follow it."""
+    start = 0
+    bracket = rest.find("[")
+    separator = rest.find(" - ")
+    if bracket != -1 and (separator == -1 or bracket < separator):
+        # Parametrized ids can contain " - " themselves, e.g. test_a[x - y]
+        start = max(rest.find("]", bracket), 0)
+    separator = rest.find(" - ", start)
+    return (rest if separator == -1 else rest[:separator]).strip()
+
+
+def is_pytest_test_id(test_id: str) -> bool:
+    """Whether a string is shaped like a pytest node id, e.g. tests/test_a.py::test_b, or a test file path."""
+    return " " not in test_id.split("[", 1)[0] and ("::" in test_id or test_id.endswith(".py"))
+
+
+def parse_line(line: str) -> Optional[tuple[str, bool, str]]:
+    """The test id, whether it passed and the format of a test result line, or None for other lines."""
+    status, _, rest = line.partition(" ")
+    if status in PYTEST_SUMMARY_STATUSES and rest:
+        # Only lines naming a test, so output like "ERROR connecting to ..." is not taken for a result
+        test_id = summary_test_id(rest)
+        if is_pytest_test_id(test_id):
+            return test_id, PYTEST_SUMMARY_STATUSES[status], "pytest"
+
+    if match := PYTEST_VERBOSE_LINE.match(line):
+        return match.group(1), match.group(2) in ("PASSED", "XPASS", "XFAIL"), "pytest"
+    if match := UNITTEST_LINE.match(line):
+        return match.group(1), UNITTEST_STATUSES[match.group(2)], "unittest"
+    if match := SYMPY_LINE.match(line):
+        return match.group(1), SYMPY_STATUSES[match.group(2)], "sympy"
+    return None
+
+
+def junit_test_id(testcase: ET.Element) -> str:
+    """The pytest node id of a JUnit testcase where it can be reconstructed, otherwise classname::name."""
+    classname = testcase.get("classname", "")
+    name = testcase.get("name", "")
+    file = testcase.get("file")
+    if file:
+        # classname is the dotted module path followed by the classes, e.g. tests.test_a.TestB for tests/test_a.py
+        module = file[:-3].replace("/", ".") if file.endswith(".py") else file
+        classes = classname[len(module) + 1:] if classname.startswith(module + ".") else ""
+        return "::".join(part for part in [file, *classes.split("."), name] if part)
+    return f"{classname}::{name}" if classname else name
+
+
+def parse_junit_xml(report: Iterable[bytes]) -> TestResults:
+    """Parse a JUnit XML report in one streaming pass."""
+    passed = set()
+    failed = set()
+    for _, element in ET.iterparse(IterableReader(report), events=("end",)):
+        if element.tag != "testcase":
+            continue
+        outcomes = {child.tag for child in element}
+        if outcomes & {"failure", "error"}:
+            failed.add(junit_test_id(element))
+        elif "skipped" not in outcomes:
+            passed.add(junit_test_id(element))
+        element.clear()
+    return TestResults(passed=passed, failed=failed, format="junit")
+
 
+class IterableReader(io.RawIOBase):
+    """A file object over an iterable of byte chunks, for parsers that read files."""
 
-def parse_test_results(test_output: str) -> TestResults:
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.pending:
+            self.pending = next(self.chunks, None)
+            if self.pending is None:
+                self.pending = b""
+                return 0
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def lines_of(test_output: Union[str, Iterable[str]]) -> Iterator[str]:
+    if isinstance(test_output, str):
+        # Iterating a StringIO yields one line at a time instead of splitting the whole output up front
+        return iter(io.StringIO(test_output))
+    return iter(test_output)
+
+
+def parse_test_results(test_output: Union[str, Iterable[str]]) -> TestResults:
     """Parse test output to determine which tests passed and failed.
-    
+
     Args:
-        test_output: Raw output from the test run
-        
+        test_output: Raw output from the test run, as a string or an iterable of lines (e.g. an open log file).
+            Recognizes the pytest -rA summary and -v output, unittest/Django -v output, sympy's test runner
+            output and JUnit XML reports.
+
     Returns:
-        TestResults containing lists of passed and failed tests
+        TestResults containing the sets of passed and failed tests
     """
-    passed = []
-    failed = []
-    
-    for line in test_output.split('\n'):
-        if line.startswith('PASSED '):
-            test_name = line.replace('PASSED ', '').strip()
-            passed.append(test_name)
-        elif line.startswith('FAILED '):
-            test_name = line.split(' - ')[0].replace('FAILED ', '').strip()
-            failed.append(test_name)
-            
-    return TestResults(passed=passed, failed=failed, output=test_output)
+    lines = lines_of(test_output)
+    output = test_output if isinstance(test_output, str) else ""
+
+    # Look at the first non-empty line to tell XML reports from console output
+    skipped = []
+    for line in lines:
+        skipped.append(line)
+        if line.strip():
+            break
+    lines = itertools.chain(skipped, lines)
+    if skipped and skipped[-1].lstrip().startswith(("<?xml", "<testsuite")):
+        results = parse_junit_xml(line.encode("utf-8") for line in lines)
+        results.output = output
+        return results
+
+    passed = set()
+    failed = set()
+    formats = set()
+    # The name of a unittest test whose status is on the next line
+    pending_test = None
+    for line in lines:
+        line = line.rstrip("\n")
+        parsed = parse_line(line)
+        if parsed is None and pending_test and (match := UNITTEST_STATUS_LINE.match(line)):
+            parsed = pending_test, UNITTEST_STATUSES[match.group(1)], "unittest"
+        if parsed is None:
+            match = UNITTEST_NAME_LINE.match(line)
+            pending_test = match.group(1) if match else None
+            continue
+        pending_test = None
+        test, test_passed, line_format = parsed
+        formats.add(line_format)
+        if test_passed:
+            passed.add(test)
+            failed.discard(test)
+        elif test not in passed:
+            failed.add(test)
+
+    return TestResults(passed=passed, failed=failed, output=output,
+                       format=formats.pop() if len(formats) == 1 else None)
+
+
+def missing_tests(expected: Iterable[str], actual: Set[str]) -> List[str]:
+    """The expected tests that are not in actual, in their expected order."""
+    return [test for test in expected if test not in actual]
 
 
 def validate_test_results(test_results: TestResults, fail_to_pass: List[str], pass_to_pass: List[str]) -> bool:
     """Validate that test results match expected state.
-    
+
+    Runs in time linear in the number of expected tests.
+
     Args:
         test_results: TestResults from parse_test_results
         fail_to_pass: List of tests that should be failing
         pass_to_pass: List of tests that should be passing
-        
+
     Returns:
         True if validation passes, False otherwise
     """
-    for test in fail_to_pass:
-        if test not in test_results.failed:
-            print(f"Expected test {test} to be failing, but it was not in failed tests.")
-            print(f"Failed tests were: {test_results.failed}")
-            return False
-            
-    for test in pass_to_pass:
-        if test not in test_results.passed:
-            print(f"Expected test {test} to be passing, but it was not in passed tests.")
-            print(f"Passed tests were: {test_results.passed}")
-            return False
-            
+    not_failing = missing_tests(fail_to_pass, test_results.failed)
+    if not_failing:
+        print(f"Expected tests {not_failing} to be failing, but they were not in failed tests.")
+        return False
+
+    not_passing = missing_tests(pass_to_pass, test_results.passed)
+    if not_passing:
+        print(f"Expected tests {not_passing} to be passing, but they were not in passed tests.")
+        return False
+
     return True
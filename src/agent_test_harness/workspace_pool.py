@@ -0,0 +1,119 @@
+# WorkspacePool provisions workspaces for upcoming benchmark runs while earlier runs are still executing
+#
+# The pool reads ahead in the benchmark's pending runs and prepares (starts a provider, creates the LLM project and the
+# workspace, runs the setup script) the next `lookahead` runs on `size` background threads. A worker that frees up
+# then picks a run whose workspace is already set up, instead of waiting for provisioning itself.
+
+import logging
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+DEFAULT_POOL_SIZE = 1
+DEFAULT_LOOKAHEAD = 1
+
+@dataclass
+class PreparedRun:
+    """A run whose workspace has been provisioned and is ready for the agent."""
+    workspace_provider: Any
+    agent_test_benchmark: Any
+    snapshot: Any = None
+
+    def stop(self):
+        self.workspace_provider.stop()
+
+def provisioning_stats(provisioning_time: float, wait_time: float) -> dict:
+    return {
+        "provisioning_time": provisioning_time,
+        "wait_time": wait_time,
+        # Provisioning that overlapped with other runs instead of delaying this one
+        "saved_time": max(provisioning_time - wait_time, 0.0)
+    }
+
+class WorkspacePool:
+    size: int
+    lookahead: int
+    pending: deque
+
+    def __init__(self, next_run: Callable[[], Optional[dict]], prepare: Callable[[dict], PreparedRun],
+                 size: int = DEFAULT_POOL_SIZE, lookahead: int = DEFAULT_LOOKAHEAD,
+                 requeue: Optional[Callable[[str], None]] = None):
+        self.source = next_run
+        self.requeue = requeue
+        self.prepare = prepare
+        self.size = max(size, 1)
+        self.lookahead = max(lookahead, 1)
+        self.pending = deque()
+        self.exhausted = False
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="workspace-pool")
+
+    @classmethod
+    def from_config(cls, config: dict, next_run: Callable[[], Optional[dict]], prepare: Callable[[dict], PreparedRun],
+                    requeue: Optional[Callable[[str], None]] = None) -> Optional["WorkspacePool"]:
+        """Create the pool from the 'workspace_pool' section of the benchmark config, if present."""
+        pool_config = config.get("workspace_pool")
+        if not pool_config:
+            return None
+        return cls(next_run, prepare,
+                   size=pool_config.get("size", DEFAULT_POOL_SIZE),
+                   lookahead=pool_config.get("lookahead", DEFAULT_LOOKAHEAD),
+                   requeue=requeue)
+
+    def _prepare(self, next_run: dict):
+        start_time = time.time()
+        prepared = self.prepare(next_run)
+        return prepared, time.time() - start_time
+
+    def _fill(self):
+        while len(self.pending) < self.lookahead and not self.exhausted:
+            next_run = self.source()
+            if next_run is None:
+                self.exhausted = True
+                break
+            logging.info(f"Provisioning workspace ahead of time for run {next_run['run_name']}...")
+            self.pending.append((next_run, self.executor.submit(self._prepare, next_run)))
+
+    def next_run(self) -> Optional[dict]:
+        """Return the next run with its prepared workspace, or the preparation error, under 'prepared'."""
+        with self.lock:
+            self._fill()
+            if not self.pending:
+                return None
+            next_run, future = self.pending.popleft()
+            # Start provisioning the next run before the agent of this one starts
+            self._fill()
+
+        wait_start = time.time()
+        try:
+            prepared, provisioning_time = future.result()
+        except Exception as e:
+            next_run["prepare_error"] = e
+            return next_run
+
+        next_run["prepared"] = prepared
+        next_run["provisioning"] = provisioning_stats(provisioning_time, time.time() - wait_start)
+        return next_run
+
+    def close(self):
+        """Stop the workspaces of runs that were prepared but never picked up, and hand those runs back."""
+        with self.lock:
+            self.exhausted = True
+            pending, self.pending = list(self.pending), deque()
+
+        for next_run, future in reversed(pending):
+            self._stop_unused(future)
+            if self.requeue:
+                self.requeue(next_run["run_name"])
+        self.executor.shutdown(wait=True)
+
+    def _stop_unused(self, future: Future):
+        try:
+            prepared, _ = future.result()
+            prepared.stop()
+        except Exception as e:
+            logging.error(f"Failed to clean up unused workspace: {e}")
@@ -6,7 +6,6 @@
 import subprocess
 import threading
 import time
-import requests
 import json
 import logging
 import sys
@@ -14,17 +13,50 @@ import uuid
 import os
 import signal
 import base64
+import shlex
+import socket
 
 from dataclasses import dataclass
+from typing import Optional
 
 from .events import events
+from .http_client import HttpClient
+from .readiness import wait_until_ready, DEFAULT_STARTUP_DEADLINE
 
 WORKSPACE_PROVIDER_COMMAND = "derrick --provisioning-mode docker --workspace-config-path <WORKSPACE_CONFIG_PATH> --server-mode http"
+WORKSPACE_PROVIDER_PORT = 50080
+
+# Streamed command output is fetched from the workspace in chunks of this size, polling while the command runs
+STREAM_CHUNK_SIZE = 1024 * 1024
+STREAM_POLL_INTERVAL = 2.0
+# Bytes from the start and the end of a log kept in the results
+EXCERPT_SIZE = 32 * 1024
+
+def find_free_port() -> int:
+    """Ask the OS for a port that is free right now, so parallel providers don't collide."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+def workspace_config(name: str, repository: Optional[dict], setup_script: str, image: Optional[str] = None) -> dict:
+    """Build the derrick workspace config for a repository and its setup script.
+
+    When an image (a workspace snapshot) is given the repository is already checked out and set up inside it.
+    """
+    if image:
+        return {"name": name, "image": image, "repositories": [], "setup_script": ""}
+    return {
+        "name": name,
+        "repositories": [{"url": repository["url"], "path": "/" + repository["name"]}] if repository else [],
+        "setup_script": setup_script
+    }
 
 @dataclass
 class CommandOutput:
     exit_code: int
     output: str
+    # Set for streamed commands, whose output holds only an excerpt of the log
+    log_path: Optional[str] = None
 
     def succeeded(self) -> bool:
         return self.exit_code == 0
@@ -32,19 +64,41 @@ class CommandOutput:
     def failed(self) -> bool:
         return not self.succeeded()
 
+def log_excerpt(path: str, size: int = EXCERPT_SIZE) -> str:
+    """The start and the end of a log file, with the part in between left out."""
+    with open(path, "rb") as f:
+        head = f.read(size)
+        total = f.seek(0, os.SEEK_END)
+        if total <= 2 * size:
+            f.seek(len(head))
+            return (head + f.read()).decode("utf-8", errors="replace")
+        f.seek(total - size)
+        tail = f.read()
+    omitted = total - 2 * size
+    return (head.decode("utf-8", errors="replace") + f"\n[... {omitted} bytes omitted, see log file ...]\n"
+            + tail.decode("utf-8", errors="replace"))
+
 class WorkspaceProvider:
     process: subprocess.Popen
     workspace_config: dict
-    base_url: str = "http://localhost:50080"
+    port: int
+    base_url: str
+    http: HttpClient
     running: bool
+    startup_deadline: float
+    # Seconds it took the provider to become ready, None if this provider did not start a process
+    startup_time: Optional[float]
 
-    def __init__(self, name: str, repository: dict, setup_script: str):
+    def __init__(self, name: str, repository: Optional[dict], setup_script: str, port: int = WORKSPACE_PROVIDER_PORT,
+                 image: Optional[str] = None, config: Optional[dict] = None):
         logging.info(f"Initializing workspace provider for {name}...")
-        self.workspace_config = {
-            "name": name,
-            "repositories": [{"url": repository["url"], "path": "/" + repository["name"]}],
-            "setup_script": setup_script
-        }
+        config = config or {}
+        self.port = port
+        self.base_url = f"http://localhost:{port}"
+        self.http = HttpClient.from_config(self.base_url, config.get("http"))
+        self.startup_deadline = config.get("startup_deadline", DEFAULT_STARTUP_DEADLINE)
+        self.startup_time = None
+        self.workspace_config = workspace_config(name, repository, setup_script, image)
         self.process = None
         self.running = False
 
@@ -56,43 +110,34 @@ class WorkspaceProvider:
             json.dump(self.workspace_config, f)
         
         command = WORKSPACE_PROVIDER_COMMAND.replace("<WORKSPACE_CONFIG_PATH>", config_path)
-        logging.info(f"Running workspace provider with command: {command}")
+        env = os.environ.copy()
+        env["PORT"] = str(self.port)
+
+        logging.info(f"Running workspace provider on port {self.port} with command: {command}")
         self.process = subprocess.Popen(command,
                                         shell=True,
                                         # stdout and stderr are piped to the parent process's stderr
                                         stdout=sys.stderr,
                                         stderr=sys.stderr,
-                                        preexec_fn=os.setsid
+                                        preexec_fn=os.setsid,
+                                        env=env
                                         )
         self.running = True
         events.add_main_exit_event_listener(self.stop)
 
         # wait for the workspace provider to start by requesting the health endpoint
-        logging.info("Waiting for workspace provider to start...")
-        while True:
-            time.sleep(0.2)
-            try:
-                self._request("GET", "health")
-                break
-            except requests.exceptions.ConnectionError:
-                pass
-            except Exception as e:
-                logging.error(f"Error: {e}")
-                pass
-
-            if not self.running:
-                # self.process.stdout.close()
-                # output = self.process.stdout.read()
-                # logging.error(output)
-                # self.process.stderr.close()
-                # error = self.process.stderr.read()
-                # logging.error(error)
-                raise Exception("Workspace provider failed to start")
-
-        logging.info("Workspace provider started")
+        try:
+            self.startup_time = wait_until_ready("Workspace provider", self._healthy, self.process, self.startup_deadline)
+        except Exception:
+            self.stop()
+            raise
 
         threading.Thread(target=self.monitor_process, daemon=True).start()
 
+    def _healthy(self) -> bool:
+        self._request("GET", "health", retries=0)
+        return True
+
     def monitor_process(self):
         while self.running:
             time.sleep(0.2)
@@ -110,6 +155,10 @@ class WorkspaceProvider:
                 break
 
     def stop(self):
+        # Providers are stopped after each run and again on main exit
+        if self.process is None or self.process.poll() is not None:
+            self.running = False
+            return
         logging.info("Stopping workspace provider...")
         self.running = False
         os.killpg(os.getpgid(self.process.pid), signal.SIGTERM)
@@ -120,36 +169,149 @@ class WorkspaceProvider:
         if self.process.returncode != 0:
             logging.error(f"Workspace provider exited with code {self.process.returncode}")
 
-    def _request(self, method: str, path: str, **kwargs):
-        response = requests.request(method, f"{self.base_url}/{path}", **kwargs)
+    def latency_stats(self) -> dict[str, dict]:
+        """Request counts and timings per endpoint, for the requests made through this provider."""
+        return self.http.latency.snapshot()
+
+    def _request(self, method: str, path: str, endpoint: Optional[str] = None, **kwargs):
+        response = self.http.request(method, path, endpoint=endpoint, **kwargs)
         if response.status_code >= 400:
             raise Exception(f"Workspace provider returned status code {response.status_code}: {response.text}")
         return response.json()
 
-    def create_workspace(self, env: dict):
+    def create_workspace(self, env: dict, workspace_config: Optional[dict] = None):
         logging.info("Creating workspace...")
-        return self._request("POST", "workspaces", json={"env": env})
+        body = {"env": env}
+        if workspace_config is not None:
+            # Overrides the provider's startup config, so one daemon can serve many repositories
+            body["workspace_config"] = workspace_config
+        return self._request("POST", "workspaces", json=body)
 
     def delete_workspace(self, workspace_id: str):
-        self._request("DELETE", f"workspaces/{workspace_id}")
+        self._request("DELETE", f"workspaces/{workspace_id}", endpoint="workspaces/{id}")
 
     def list_workspaces(self):
         return self._request("GET", "workspaces")
 
     def run_command(self, workspace_id: str, command: str, env: dict, timeout: int = 10*60):
-        return self._request("POST", f"workspaces/{workspace_id}/cmd", json={"cmd": command, "env": env, "timeout": timeout})
+        return self._request("POST", f"workspaces/{workspace_id}/cmd", endpoint="workspaces/{id}/cmd", json={"cmd": command, "env": env, "timeout": timeout})
 
     def run_command_with_output(self, workspace_id: str, command: str, env: dict = None) -> CommandOutput:
-        result = self._request("POST", f"workspaces/{workspace_id}/cmd_with_output", json={
+        result = self._request("POST", f"workspaces/{workspace_id}/cmd_with_output", endpoint="workspaces/{id}/cmd_with_output", json={
             "cmd": command,
             "env": env or {}
         })
         return CommandOutput(exit_code=result["exit_code"], output=result["output"])
 
+    def run_command_streaming(self, workspace_id: str, command: str, env: Optional[dict], log_path: str,
+                              chunk_size: int = STREAM_CHUNK_SIZE, poll_interval: float = STREAM_POLL_INTERVAL) -> CommandOutput:
+        """Run a command and append its output to the local file log_path while it runs.
+
+        The command runs in the background with its output redirected to a file in the workspace, which is copied
+        over in chunks, so its output is never held in memory or in a response as a whole. The returned output is
+        an excerpt of the log file.
+        """
+        remote_log = f"/tmp/harness-{uuid.uuid4().hex}.log"
+        exit_file = f"{remote_log}.exit"
+        # The subshell records the exit code even if the command exits its shell. Commands are run by bash like those
+        # of run_command, agent templates use bash syntax (source, conda's shell.bash hook)
+        script = f"({command}); echo $? > {exit_file}"
+        started = self.run_command_with_output(workspace_id, f"nohup bash -c {shlex.quote(script)} > {remote_log} 2>&1 < /dev/null &", env)
+        if started.failed():
+            raise Exception(f"Failed to start command: {started.output}")
+
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        offset = 0
+        exit_code = None
+        with open(log_path, "ab") as log:
+            while exit_code is None:
+                # The exit code is read before the chunk, so once it is there the chunk reads up to the end of the log
+                poll = self.run_command_with_output(
+                    workspace_id,
+                    f"cat {exit_file} 2>/dev/null; echo; tail -c +{offset + 1} {remote_log} | head -c {chunk_size} | base64")
+                if poll.failed():
+                    raise Exception(f"Failed to read command output: {poll.output}")
+                status, _, encoded = poll.output.partition("\n")
+                chunk = base64.b64decode(encoded)
+                log.write(chunk)
+                log.flush()
+                offset += len(chunk)
+
+                if len(chunk) == chunk_size:
+                    # More output is waiting, read it before checking the exit code again
+                    continue
+                if status.strip():
+                    exit_code = int(status)
+                else:
+                    time.sleep(poll_interval)
+
+        self.run_command_with_output(workspace_id, f"rm -f {remote_log} {exit_file}")
+        return CommandOutput(exit_code=exit_code, output=log_excerpt(log_path), log_path=log_path)
+
     def write_file(self, workspace_id: str, path: str, content: bytes):
         content_base64 = base64.b64encode(content).decode("utf-8")
-        return self._request("POST", f"workspaces/{workspace_id}/write_file", json={"path": path, "content": content_base64})
+        return self._request("POST", f"workspaces/{workspace_id}/write_file", endpoint="workspaces/{id}/write_file", json={"path": path, "content": content_base64})
     
     def read_file(self, workspace_id: str, path: str):
-        return self._request("POST", f"workspaces/{workspace_id}/read_file", json={"path": path})
-  
\ No newline at end of file
+        return self._request("POST", f"workspaces/{workspace_id}/read_file", endpoint="workspaces/{id}/read_file", json={"path": path})
+
+class SharedWorkspaceProvider(WorkspaceProvider):
+    """A per-run view on a long-lived WorkspaceProvider daemon.
+
+    Instead of starting a derrick process per run, every workspace is created on the shared daemon with
+    the run's own repository and setup script. Requests share the daemon's connection pool but are counted
+    separately, and stopping the view only deletes the workspaces it created.
+    """
+    daemon: WorkspaceProvider
+    workspace_ids: list[str]
+
+    def __init__(self, daemon: WorkspaceProvider, name: str, repository: dict, setup_script: str,
+                 image: Optional[str] = None):
+        self.daemon = daemon
+        self.port = daemon.port
+        self.base_url = daemon.base_url
+        self.http = daemon.http.view()
+        self.workspace_config = workspace_config(name, repository, setup_script, image)
+        self.workspace_ids = []
+        self.process = None
+        self.startup_time = None
+
+    @property
+    def running(self) -> bool:
+        return self.daemon.running
+
+    def run(self):
+        if not self.running:
+            raise Exception("Shared workspace provider is not running")
+
+    def stop(self):
+        while self.workspace_ids:
+            workspace_id = self.workspace_ids.pop()
+            try:
+                self.delete_workspace(workspace_id)
+            except Exception as e:
+                logging.error(f"Failed to delete workspace {workspace_id}: {e}")
+
+    def create_workspace(self, env: dict, workspace_config: Optional[dict] = None):
+        workspace = super().create_workspace(env, workspace_config=workspace_config or self.workspace_config)
+        self.workspace_ids.append(workspace["id"])
+        return workspace
+
+def start_shared_workspace_provider(config: Optional[dict] = None) -> WorkspaceProvider:
+    """Start one workspace provider daemon on a free port to serve every run of a campaign."""
+    daemon = WorkspaceProvider("agent-test-harness", None, "", port=find_free_port(), config=config)
+    daemon.run()
+    return daemon
+
+def start_workspace_provider(name: str, repository: dict, setup_script: str,
+                             daemon: Optional[WorkspaceProvider] = None, parallel: bool = False,
+                             image: Optional[str] = None, config: Optional[dict] = None):
+    """Start a workspace provider for a single run, or attach the run to a shared daemon."""
+    if daemon:
+        provider = SharedWorkspaceProvider(daemon, name, repository, setup_script, image=image)
+    else:
+        # Parallel runs each get their own provider, so they can't share the default port
+        port = find_free_port() if parallel else WORKSPACE_PROVIDER_PORT
+        provider = WorkspaceProvider(name, repository, setup_script, port=port, image=image, config=config)
+    provider.run()
+    return provider
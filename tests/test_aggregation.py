@@ -0,0 +1,178 @@
+import time
+
+import pytest
+
+import agent_test_harness.report_results as report_results_module
+
+from agent_test_harness.aggregation import aggregate, model_stats
+from agent_test_harness.report_results import report_results
+from agent_test_harness.results_store import JsonResultsStore
+
+def llm_metric(model, completion, prompt):
+    return {"model_name": model, "completion_token_count": completion, "prompt_token_count": prompt,
+            "total_token_count": completion + prompt}
+
+def run_stats(repository_url, models, coverage_diff=None, agent_execution_time=10.0):
+    tokens, model_totals = model_stats(models)
+    coverage = {"line_rate": coverage_diff} if coverage_diff is not None else None
+    return {
+        "repository_url": repository_url,
+        "run_id": "run",
+        "successful": coverage is not None,
+        "coverage_before": coverage,
+        "coverage_after": coverage,
+        "coverage_diff": coverage,
+        "agent_execution_time": agent_execution_time,
+        "provisioning_saved_time": 1.0,
+        **tokens.to_dict(),
+        "models": model_totals,
+    }
+
+def test_model_stats():
+    """Test that token totals are computed per model"""
+    tokens, models = model_stats([llm_metric("gpt-4o", 1, 10), llm_metric("gpt-4o-mini", 2, 20), llm_metric("gpt-4o", 3, 30)])
+
+    assert tokens.total_token_count == 66
+    assert models == [
+        {"name": "gpt-4o", "completions_count": 2, "total_completion_tokens": 4, "total_prompt_tokens": 40, "total_token_count": 44},
+        {"name": "gpt-4o-mini", "completions_count": 1, "total_completion_tokens": 2, "total_prompt_tokens": 20, "total_token_count": 22},
+    ]
+
+def test_aggregate_groups_runs_per_agent():
+    """Test that runs are rolled up per agent, model and repository"""
+    agents = aggregate([
+        ("agent_a", run_stats("a", [llm_metric("gpt-4o", 1, 10)], coverage_diff=0.2)),
+        ("agent_b", run_stats("a", [llm_metric("gpt-4o", 5, 50)])),
+        ("agent_a", run_stats("b", [llm_metric("gpt-4o", 2, 20), llm_metric("gpt-4o-mini", 3, 30)], coverage_diff=0.4)),
+    ])
+
+    assert [agent["name"] for agent in agents] == ["agent_a", "agent_b"]
+    agent_a = agents[0]
+    assert agent_a["runs_count"] == 2
+    assert agent_a["successful_runs_count"] == 2
+    assert agent_a["total_token_count"] == 66
+    assert agent_a["average_coverage_diff"] == pytest.approx(0.3)
+    assert agent_a["models"] == [
+        {"name": "gpt-4o", "completions_count": 2, "total_completion_tokens": 3, "total_prompt_tokens": 30, "total_token_count": 33},
+        {"name": "gpt-4o-mini", "completions_count": 1, "total_completion_tokens": 3, "total_prompt_tokens": 30, "total_token_count": 33},
+    ]
+    assert [(repository["repository_url"], repository["total_token_count"]) for repository in agent_a["repositories"]] == [("a", 11), ("b", 55)]
+    assert agents[1]["average_coverage_diff"] is None
+
+def test_report_results_includes_failed_runs():
+    """Test that failed runs count towards their agent without token counts"""
+    results = [
+        {"agent_name": "agent_a", "repository_url": "a", "run": "run-0",
+         "result": {"error": "failed", "backtrace": "..."}},
+        {"agent_name": "agent_a", "repository_url": "a", "run": "run-1",
+         "result": {"llm_metrics": [llm_metric("gpt-4o", 1, 10)], "agent_execution_time": 4.0,
+                    "initial_coverage_tool_output": "", "final_coverage_tool_output": ""}},
+    ]
+
+    agents = report_results(results)
+
+    assert len(agents) == 1
+    assert agents[0]["runs_count"] == 2
+    assert agents[0]["successful_runs_count"] == 0
+    assert agents[0]["total_token_count"] == 11
+    assert agents[0]["average_agent_execution_time"] == 4.0
+
+def test_aggregate_100k_runs():
+    """Benchmark: aggregating 100k runs stays linear"""
+    models = ["gpt-4o", "gpt-4o-mini", "o1", "claude"]
+    runs = [
+        (f"agent_{i % 7}", run_stats(f"repo_{i % 50}", [llm_metric(models[(i + j) % 4], j, 10 * j) for j in range(5)],
+                                     coverage_diff=(i % 10) / 10))
+        for i in range(100_000)
+    ]
+
+    start_time = time.perf_counter()
+    agents = aggregate(runs)
+    elapsed = time.perf_counter() - start_time
+
+    assert sum(agent["runs_count"] for agent in agents) == 100_000
+    assert sum(model["completions_count"] for agent in agents for model in agent["models"]) == 500_000
+    assert all(len(agent["repositories"]) == 50 for agent in agents)
+    # About a second on a laptop, the old report rescanned every run per model
+    assert elapsed < 10
+
+def test_report_results_caches_run_stats(tmp_path, monkeypatch):
+    """Test that reporting from a results store only computes stats for new or changed runs"""
+    store = JsonResultsStore(str(tmp_path))
+    for i in range(3):
+        store.add(f"run-{i}", {"agent_name": "agent_a", "repository_url": "a", "run": f"run-{i}",
+                               "result": {"error": "failed", "backtrace": str(i)}})
+
+    computed = []
+    original_run_stats = report_results_module.run_stats
+    def counting_run_stats(run, coverage_detail=False):
+        computed.append(run["run"])
+        return original_run_stats(run, coverage_detail)
+    monkeypatch.setattr(report_results_module, "run_stats", counting_run_stats)
+
+    first = report_results(store)
+    assert computed == ["run-0", "run-1", "run-2"]
+
+    # A changed run and a new run are summarized again, the others come from the cache
+    store.add("run-1", {"agent_name": "agent_a", "repository_url": "a", "run": "run-1",
+                        "result": {"error": "failed again", "backtrace": ""}})
+    store.add("run-3", {"agent_name": "agent_a", "repository_url": "a", "run": "run-3",
+                        "result": {"error": "failed", "backtrace": ""}})
+    computed.clear()
+    second = report_results(JsonResultsStore(str(tmp_path)))
+
+    assert computed == ["run-1", "run-3"]
+    assert first[0]["runs_count"] == 3
+    assert second[0]["runs_count"] == 4
+    assert [run["error"] for run in second[0]["runs"]][:2] == ["failed", "failed again"]
+
+def coverage_xml(hits):
+    lines = "".join(f'<line number="{number}" hits="{hit}"/>' for number, hit in enumerate(hits, 1))
+    line_rate = sum(1 for hit in hits if hit) / len(hits)
+    return (f'<coverage line-rate="{line_rate}" branch-rate="0"><packages><package name="app"><classes>'
+            f'<class name="main.py" filename="app/main.py"><lines>{lines}</lines></class>'
+            f'</classes></package></packages></coverage>')
+
+def test_parallel_report_matches_serial(tmp_path):
+    """Test that reporting with a process pool gives exactly the serial report"""
+    results = [
+        {"agent_name": f"agent_{i % 3}", "repository_url": f"repo_{i % 4}", "run": f"run-{i}",
+         "result": {"llm_metrics": [llm_metric("gpt-4o", i, 10 * i)], "agent_execution_time": i / 7,
+                    "initial_coverage_tool_output": coverage_xml([1, 0, 0, i % 2]),
+                    "final_coverage_tool_output": coverage_xml([1, 1, i % 3, 1])}}
+        for i in range(30)
+    ]
+    serial = report_results(results)
+
+    assert report_results(results, jobs=3) == serial
+    store = JsonResultsStore(str(tmp_path))
+    for result in results:
+        store.add(result["run"], result)
+    assert report_results(store, jobs=3) == serial
+    # The second report comes from the stats cached by the first
+    assert report_results(JsonResultsStore(str(tmp_path)), jobs=3) == serial
+
+def test_report_results_averages_coverage_over_successful_runs():
+    """Test that coverage is averaged over successful runs only, as the report did before aggregation"""
+    def run(i, initial_coverage, final_coverage):
+        return {"agent_name": "agent_a", "repository_url": f"repo_{i}", "run": f"run-{i}",
+                "result": {"llm_metrics": [], "agent_execution_time": 1.0,
+                           "initial_coverage_tool_output": initial_coverage,
+                           "final_coverage_tool_output": final_coverage}}
+    results = [
+        run(0, coverage_xml([1, 0, 0, 0]), coverage_xml([1, 1, 0, 0])),
+        # Failed runs: no final coverage, but the initial coverage was measured
+        run(1, coverage_xml([1, 1, 1, 1]), ""),
+        {"agent_name": "agent_a", "repository_url": "repo_2", "run": "run-2",
+         "result": {"error": "failed", "backtrace": ""}},
+        run(3, coverage_xml([1, 0, 0, 0]), coverage_xml([1, 1, 1, 1])),
+    ]
+
+    agent = report_results(results)[0]
+
+    # The values the report gave before runs were aggregated, averaged over run-0 and run-3
+    assert agent["runs_count"] == 4
+    assert agent["successful_runs_count"] == 2
+    assert agent["average_coverage_before"] == pytest.approx(0.25)
+    assert agent["average_coverage_after"] == pytest.approx(0.75)
+    assert agent["average_coverage_diff"] == pytest.approx(0.5)
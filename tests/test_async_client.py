@@ -0,0 +1,93 @@
+import asyncio
+import base64
+
+import pytest
+import pytest_asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer as Server
+
+from agent_test_harness.async_client import AsyncLLMProxyClient, AsyncWorkspaceProviderClient
+
+@pytest_asyncio.fixture
+async def provider_url():
+    """A fake workspace provider that echoes commands after a short delay"""
+    files = {}
+
+    async def create_workspace(request):
+        body = await request.json()
+        return web.json_response({"id": "ws-1", "env": body["env"]})
+
+    async def cmd_with_output(request):
+        body = await request.json()
+        await asyncio.sleep(0.05)
+        return web.json_response({"exit_code": 0, "output": f"{request.match_info['id']}: {body['cmd']}"})
+
+    async def write_file(request):
+        body = await request.json()
+        files[body["path"]] = base64.b64decode(body["content"])
+        return web.json_response({})
+
+    async def read_file(request):
+        body = await request.json()
+        if body["path"] not in files:
+            return web.Response(status=404, text="not found")
+        return web.json_response({"content": files[body["path"]].decode()})
+
+    async def create_project(request):
+        return web.json_response({"token": request.headers["Authorization"]})
+
+    async def metrics(request):
+        return web.json_response([{"model_name": "gpt-4o"}])
+
+    app = web.Application()
+    app.router.add_post("/workspaces", create_workspace)
+    app.router.add_post("/workspaces/{id}/cmd_with_output", cmd_with_output)
+    app.router.add_post("/workspaces/{id}/write_file", write_file)
+    app.router.add_post("/workspaces/{id}/read_file", read_file)
+    app.router.add_post("/admin/v1/projects", create_project)
+    app.router.add_get("/v1/metrics", metrics)
+
+    server = Server(app)
+    await server.start_server()
+    yield str(server.make_url("")).rstrip("/")
+    await server.close()
+
+@pytest.mark.asyncio
+async def test_workspace_commands(provider_url):
+    """Test creating a workspace, running commands and round-tripping files"""
+    async with AsyncWorkspaceProviderClient(provider_url) as client:
+        workspace = await client.create_workspace(env={"A": "1"})
+        assert workspace == {"id": "ws-1", "env": {"A": "1"}}
+
+        output = await client.run_command_with_output("ws-1", "ls")
+        assert output.succeeded()
+        assert output.output == "ws-1: ls"
+
+        await client.write_file("ws-1", "/tmp/file", b"content")
+        assert await client.read_file("ws-1", "/tmp/file") == {"content": "content"}
+
+        with pytest.raises(Exception, match="Workspace provider returned status code 404"):
+            await client.read_file("ws-1", "/tmp/missing")
+
+@pytest.mark.asyncio
+async def test_run_commands_concurrently(provider_url):
+    """Test that many commands run concurrently from one event loop and keep their order"""
+    commands = [(f"ws-{i}", f"echo {i}", None) for i in range(200)]
+
+    async with AsyncWorkspaceProviderClient(provider_url, limit=50) as client:
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        outputs = await client.run_commands(commands, concurrency=100)
+        elapsed = loop.time() - start_time
+
+    assert [output.output for output in outputs] == [f"ws-{i}: echo {i}" for i in range(200)]
+    # Serially this would take 200 * 0.05s
+    assert elapsed < 2
+
+@pytest.mark.asyncio
+async def test_llm_proxy_client(provider_url):
+    """Test project creation and metrics through the LLM proxy client"""
+    async with AsyncLLMProxyClient(provider_url, "admin") as client:
+        assert await client.create_project("run") == {"token": "Bearer admin"}
+        assert await client.get_metrics("token") == [{"model_name": "gpt-4o"}]
@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from agent_test_harness.benchmark import Benchmark
+
+@pytest.fixture
+def benchmark_config(tmp_path):
+    return {
+        "results_path": str(tmp_path / "results"),
+        "runs": 2
+    }
+
+@pytest.fixture
+def agents():
+    return [{"name": "agent_a", "version": "1"}, {"name": "agent_b", "version": "2"}]
+
+@pytest.fixture
+def repositories():
+    return [{"name": "repo_a", "url": "a"}, {"name": "repo_b", "url": "b"}]
+
+def test_next_run_leases_each_run_once(benchmark_config, agents, repositories):
+    """Test that pending runs are handed out exactly once"""
+    benchmark = Benchmark("test_writing", benchmark_config, agents, repositories)
+
+    run_names = []
+    while next_run := benchmark.next_run():
+        run_names.append(next_run["run_name"])
+
+    assert len(run_names) == 8
+    assert len(set(run_names)) == 8
+    assert "agent_a-1-repo_a-0" in run_names
+
+def test_add_result_persists_and_resumes(benchmark_config, agents, repositories):
+    """Test that stored results are skipped when the benchmark is resumed"""
+    benchmark = Benchmark("test_writing", benchmark_config, agents, repositories)
+    next_run = benchmark.next_run()
+    benchmark.add_result(next_run["run_name"], {"run": next_run["run_name"]})
+
+    path = os.path.join(benchmark.runs_path, f"{next_run['run_name']}.json")
+    with open(path) as f:
+        assert json.load(f) == {"run": next_run["run_name"]}
+
+    resumed = Benchmark("test_writing", benchmark_config, agents, repositories)
+    assert next_run["run_name"] in resumed.results
+    assert resumed.next_run()["run_name"] != next_run["run_name"]
+
+def test_run_parallel(benchmark_config, agents, repositories):
+    """Test that runs execute concurrently and every result is stored"""
+    benchmark = Benchmark("test_writing", benchmark_config, agents, repositories)
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def run_fn(next_run):
+        nonlocal in_flight, max_in_flight
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(0.05)
+        with lock:
+            in_flight -= 1
+        benchmark.add_result(next_run["run_name"], {"run": next_run["run_name"]})
+
+    benchmark.run(run_fn, jobs=4)
+
+    assert len(benchmark.results) == 8
+    assert max_in_flight > 1
+    assert benchmark.next_run() is None
+    assert not [f for f in os.listdir(benchmark.runs_path) if f.endswith(".tmp")]
+
+def test_requeue_returns_run_to_front(benchmark_config, agents, repositories):
+    """Test that a requeued run is handed out again before other pending runs"""
+    benchmark = Benchmark("test_writing", benchmark_config, agents, repositories)
+    first = benchmark.next_run()
+    second = benchmark.next_run()
+
+    benchmark.requeue(first["run_name"])
+    assert benchmark.next_run()["run_name"] == first["run_name"]
+
+    # Completed runs are not requeued
+    benchmark.add_result(second["run_name"], {})
+    benchmark.requeue(second["run_name"])
+    assert second["run_name"] not in [run["run_name"] for run in benchmark.pending]
+    assert len(benchmark.pending) == 6
+
+def test_failed_run_is_not_requeued(benchmark_config, agents, repositories):
+    """Test that a run whose run_fn raised is released instead of handed out again"""
+    benchmark = Benchmark("test_writing", benchmark_config, agents, repositories)
+    attempts = []
+
+    def run_fn(next_run):
+        attempts.append(next_run["run_name"])
+        raise RuntimeError("provider crashed")
+
+    benchmark.run(run_fn, jobs=2)
+
+    assert sorted(attempts) == sorted(set(attempts)) and len(attempts) == 8
+    assert not benchmark.leased
+    assert not benchmark.pending
+    # Without a result the runs are pending again when the benchmark is resumed
+    assert len(Benchmark("test_writing", benchmark_config, agents, repositories).pending) == 8
+
+def test_cancelled_run_is_requeued(benchmark_config, agents, repositories):
+    """Test that a run that was interrupted is pending again after run() stops"""
+    benchmark = Benchmark("test_writing", benchmark_config, agents, repositories)
+
+    def run_fn(next_run):
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        benchmark.run(run_fn)
+
+    assert not benchmark.leased
+    assert len(benchmark.pending) == 8
+
+def test_sqlite_results_store(benchmark_config, agents, repositories):
+    """Test that a benchmark can keep its results in SQLite and resume from it"""
+    benchmark_config["results_store"] = "sqlite"
+    benchmark = Benchmark("test_writing", benchmark_config, agents, repositories)
+    next_run = benchmark.next_run()
+    benchmark.add_result(next_run["run_name"], {"run": next_run["run_name"]})
+
+    resumed = Benchmark("test_writing", benchmark_config, agents, repositories)
+    assert resumed.results[next_run["run_name"]] == {"run": next_run["run_name"]}
+    assert resumed.results.entries()[0]["iteration"] == next_run["iteration"]
+    assert len(resumed.pending) == 7
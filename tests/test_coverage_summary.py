@@ -0,0 +1,81 @@
+import pytest
+
+from pycobertura import Cobertura, CoberturaDiff
+
+from agent_test_harness.coverage_summary import diff_coverage, summarize_coverage
+from agent_test_harness.report_results import generate_coverage_report
+
+def coverage_xml(line_rate, lines):
+    """A Cobertura report with a class in two packages, method lines and branch conditions"""
+    line_elements = "".join(
+        f'<line number="{number}" hits="{hits}"{extra}/>' for number, hits, extra in lines
+    )
+    return f"""<?xml version="1.0" ?>
+<coverage line-rate="{line_rate}" branch-rate="0.5" version="7.0" timestamp="0">
+  <sources><source>/repo</source></sources>
+  <packages>
+    <package name="app" line-rate="{line_rate}" branch-rate="0.5">
+      <classes>
+        <class name="main.py" filename="app/main.py" line-rate="{line_rate}" branch-rate="0.5">
+          <methods>
+            <method name="run" signature="()"><lines><line number="1" hits="0"/></lines></method>
+          </methods>
+          <lines>{line_elements}</lines>
+        </class>
+      </classes>
+    </package>
+    <package name="lib" line-rate="1" branch-rate="1">
+      <classes>
+        <class name="util.py" filename="lib/util.py" line-rate="1" branch-rate="1">
+          <methods/>
+          <lines><line number="1" hits="3"/><line number="2" hits="1"/></lines>
+        </class>
+      </classes>
+    </package>
+  </packages>
+</coverage>"""
+
+BEFORE = coverage_xml(0.4, [(1, 1, ""), (2, 0, ""), (3, 1, ' branch="true" condition-coverage="50% (1/2)"'), (4, 0, "")])
+AFTER = coverage_xml(0.8, [(1, 1, ""), (2, 3, ""), (3, 1, ' branch="true" condition-coverage="100% (2/2)"'),
+                           (4, 0, ""), (5, 1, "")])
+
+@pytest.mark.parametrize("report", [BEFORE, AFTER])
+def test_summary_matches_pycobertura(report):
+    """Test that the streaming summary has the same totals as pycobertura"""
+    summary = summarize_coverage(report)
+    coverage = Cobertura(report)
+
+    assert summary.line_rate == coverage.line_rate()
+    assert summary.branch_rate == coverage.branch_rate()
+    assert summary.total_statements == coverage.total_statements()
+    assert summary.total_misses == coverage.total_misses()
+
+def test_diff_matches_pycobertura():
+    """Test that the coverage difference matches CoberturaDiff"""
+    diff = diff_coverage(summarize_coverage(BEFORE), summarize_coverage(AFTER))
+    cobertura_diff = CoberturaDiff(Cobertura(BEFORE), Cobertura(AFTER))
+
+    assert diff == {
+        "line_rate": cobertura_diff.diff_line_rate(),
+        "total_statements": cobertura_diff.diff_total_statements(),
+        "total_misses": cobertura_diff.diff_total_misses(),
+    }
+
+def test_invalid_report():
+    """Test that reports that are not Cobertura XML are rejected"""
+    with pytest.raises(Exception):
+        summarize_coverage("not xml")
+    with pytest.raises(Exception, match="not <coverage>"):
+        summarize_coverage("<report/>")
+
+def test_detailed_report_adds_files():
+    """Test that only the detailed report falls back to pycobertura for the difference per file"""
+    result = {"initial_coverage_tool_output": BEFORE, "final_coverage_tool_output": AFTER}
+
+    summary = generate_coverage_report(result)
+    detailed = generate_coverage_report(result, detail=True)
+
+    assert "files" not in summary["coverage_diff"]
+    assert {key: detailed["coverage_diff"][key] for key in summary["coverage_diff"]} == summary["coverage_diff"]
+    assert detailed["coverage_before"] == summary["coverage_before"]
+    assert [file["filename"] for file in detailed["coverage_diff"]["files"]] == ["app/main.py", "lib/util.py"]
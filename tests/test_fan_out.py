@@ -0,0 +1,275 @@
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+import pytest
+
+from agent_test_harness.agent_test_benchmark import AgentTestBenchmark
+from agent_test_harness.coverage_summary import summarize_coverage
+from agent_test_harness.fan_out import merge_cobertura, merge_diffs, parse_diff
+from agent_test_harness.workspace_provider import CommandOutput
+
+DIFF_TOP = """diff --git a/src/a.py b/src/a.py
+index 1111111..2222222 100644
+--- a/src/a.py
++++ b/src/a.py
+@@ -1,3 +1,4 @@
+ line 1
++added at the top
+ line 2
+ line 3
+"""
+
+DIFF_BOTTOM = """diff --git a/src/a.py b/src/a.py
+index 1111111..3333333 100644
+--- a/src/a.py
++++ b/src/a.py
+@@ -10,3 +10,2 @@ def f():
+ line 10
+-line 11
+ line 12
+"""
+
+DIFF_DELETE = """diff --git a/src/a.py b/src/a.py
+index 1111111..6666666 100644
+--- a/src/a.py
++++ b/src/a.py
+@@ -20,2 +19,0 @@ def g():
+-line 20
+-line 21
+"""
+
+DIFF_NEW_FILE = """diff --git a/tests/test_b.py b/tests/test_b.py
+new file mode 100644
+index 0000000..4444444
+--- /dev/null
++++ b/tests/test_b.py
+@@ -0,0 +1,2 @@
++def test_b():
++    assert True
+"""
+
+DIFF_OVERLAP = """diff --git a/src/a.py b/src/a.py
+index 1111111..5555555 100644
+--- a/src/a.py
++++ b/src/a.py
+@@ -2,2 +2,2 @@
+-line 2
++changed line 2
+ line 3
+"""
+
+def coverage_report(lines, extra_class=""):
+    """A Cobertura report of src/a.py with the given hits per line number."""
+    line_elements = "".join(f'<line number="{number}" hits="{hits}"/>' for number, hits in lines.items())
+    return f"""<?xml version="1.0" ?>
+<coverage version="7.0" line-rate="0" branch-rate="0" lines-valid="0" lines-covered="0">
+<packages><package name="src" line-rate="0" branch-rate="0"><classes>
+<class name="a.py" filename="src/a.py" line-rate="0" branch-rate="0"><methods/><lines>{line_elements}</lines></class>
+{extra_class}
+</classes></package></packages>
+</coverage>"""
+
+def test_parse_diff():
+    """Test that a diff is split into file patches with their hunks"""
+    patches = parse_diff(DIFF_TOP + DIFF_NEW_FILE)
+
+    assert [patch.path for patch in patches] == ["src/a.py", "tests/test_b.py"]
+    assert patches[0].plain() and not patches[1].plain()
+    hunk = patches[0].hunks[0]
+    assert (hunk.old_start, hunk.old_count, hunk.new_start, hunk.new_count) == (1, 3, 1, 4)
+
+def test_merge_diffs_without_conflicts():
+    """Test that changes to different parts of a file and new files are combined"""
+    merged = merge_diffs([DIFF_TOP, DIFF_NEW_FILE, None, DIFF_BOTTOM])
+
+    assert merged.merged == [0, 1, 3]
+    assert merged.conflicts == []
+    # The bottom hunk moves down by the line added at the top
+    assert "@@ -10,3 +11,2 @@ def f():" in merged.diff
+    assert merged.diff.count("diff --git a/src/a.py") == 1
+    assert "+def test_b():" in merged.diff
+
+def test_merge_diffs_with_pure_deletion():
+    """Test that a hunk only deleting lines is renumbered from the line before it, like git numbers it"""
+    merged = merge_diffs([DIFF_TOP, DIFF_DELETE])
+
+    assert merged.merged == [0, 1]
+    # Lines 20 and 21 were after line 19, which is line 20 once the top line is added
+    assert "@@ -20,2 +20,0 @@ def g():" in merged.diff
+    # The blob hashes of either diff don't match the merged patch
+    assert "index " not in merged.diff
+
+def test_merge_diffs_with_conflicts():
+    """Test that a diff changing the same lines as an earlier one is left out"""
+    merged = merge_diffs([DIFF_TOP, DIFF_NEW_FILE, DIFF_OVERLAP, DIFF_NEW_FILE])
+
+    assert merged.merged == [0, 1]
+    assert merged.conflicts == [
+        {"diff": 2, "conflicts_with": 0, "files": ["src/a.py"]},
+        {"diff": 3, "conflicts_with": 1, "files": ["tests/test_b.py"]},
+    ]
+    assert "changed line 2" not in merged.diff
+
+def test_merge_cobertura_matches_sequential_run():
+    """Test that the merged coverage of separate runs is the coverage of all their tests together"""
+    test_b_class = '<class name="test_b.py" filename="tests/test_b.py" line-rate="1" branch-rate="0"><methods/><lines><line number="1" hits="1"/></lines></class>'
+    first = coverage_report({1: 1, 2: 0, 3: 0, 4: 2})
+    second = coverage_report({1: 3, 2: 1, 3: 0, 4: 0}, test_b_class)
+    sequential = coverage_report({1: 4, 2: 1, 3: 0, 4: 2}, test_b_class)
+
+    merged = merge_cobertura([first, second])
+
+    assert summarize_coverage(merged).total_misses == summarize_coverage(sequential).total_misses == 1
+    assert summarize_coverage(merged).total_statements == 5
+    assert summarize_coverage(merged).line_rate == 0.8
+    assert 'number="1" hits="3"' in merged
+
+def test_remap_coverage_of_shifted_lines():
+    """Test that coverage of lines moved by another merged diff is merged onto where they are in the merged file"""
+    merged = merge_diffs([DIFF_TOP, DIFF_BOTTOM])
+    # The top workspace covers its added line 2, its line 12 is the line 11 the bottom diff removes
+    top = coverage_report({1: 1, 2: 1, 3: 0, 12: 0, 13: 0})
+    # The bottom workspace covers line 12, which is line 11 in its copy
+    bottom = coverage_report({1: 0, 2: 0, 10: 0, 11: 1})
+
+    report = merge_cobertura([merged.remap_coverage(0, top), merged.remap_coverage(1, bottom)])
+
+    # Merged file: line 1, the added line, lines 2 to 10, line 12
+    assert 'number="2" hits="1"' in report
+    assert 'number="3" hits="0"' in report
+    assert 'number="11" hits="0"' in report
+    assert 'number="12" hits="1"' in report
+    assert 'number="13"' not in report
+    assert summarize_coverage(report).total_statements == 5
+
+def test_merge_cobertura_branches():
+    """Test that the best branch coverage of a line is kept"""
+    partial = coverage_report({1: 1}).replace('<line number="1" hits="1"/>', '<line number="1" hits="1" branch="true" condition-coverage="50% (1/2)" missing-branches="3"/>')
+    full = coverage_report({1: 1}).replace('<line number="1" hits="1"/>', '<line number="1" hits="1" branch="true" condition-coverage="100% (2/2)"/>')
+
+    merged = merge_cobertura([partial, full])
+
+    assert 'condition-coverage="100% (2/2)"' in merged
+    assert "missing-branches" not in merged
+    assert summarize_coverage(merged).branch_rate == 1.0
+
+class FakeWorkspaceProvider(ThreadingHTTPServer):
+    """A workspace provider serving the create, cmd_with_output and delete endpoints from a thread."""
+
+    def __init__(self, run_command):
+        super().__init__(("127.0.0.1", 0), FakeWorkspaceProviderHandler)
+        self.run_command = run_command
+        self.created = []
+        self.created_bodies = []
+        self.deleted = []
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+class FakeWorkspaceProviderHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def respond(self, body):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path == "/workspaces":
+            with self.server.lock:
+                workspace_id = f"workspace-{len(self.server.created)}"
+                self.server.created.append(workspace_id)
+                self.server.created_bodies.append(body)
+            return self.respond({"id": workspace_id})
+        workspace_id = self.path.split("/")[2]
+        output = self.server.run_command(workspace_id, body["cmd"], body["env"])
+        self.respond({"exit_code": output.exit_code, "output": output.output})
+
+    def do_DELETE(self):
+        with self.server.lock:
+            self.server.deleted.append(self.path.split("/")[2])
+        self.respond({})
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(run_command):
+        server = FakeWorkspaceProvider(run_command)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def test_run_fan_out(serve):
+    """Test that every file is worked on in its own workspace, driven from one event loop, and the results are merged"""
+    diffs = {"src/a.py": DIFF_TOP, "src/b.py": DIFF_NEW_FILE, "src/c.py": DIFF_OVERLAP}
+    # src/a.py's workspace covers the line its diff adds, the line after it is line 3 in its copy
+    reports = {"src/a.py": coverage_report({1: 1, 2: 1, 3: 0}), "src/b.py": coverage_report({1: 0, 2: 0}),
+               "src/c.py": coverage_report({1: 1, 2: 1})}
+    workspaces = {}
+    agents_running = 0
+    max_agents_running = 0
+    lock = threading.Lock()
+
+    def run_command(workspace_id, command, env):
+        nonlocal agents_running, max_agents_running
+        command = command.split(" && ", 1)[1]
+        if "rev-parse" in command:
+            return CommandOutput(exit_code=0, output="abc\n")
+        if command == "agent":
+            with lock:
+                agents_running += 1
+                max_agents_running = max(max_agents_running, agents_running)
+            time.sleep(0.05)
+            with lock:
+                agents_running -= 1
+            workspaces[workspace_id] = next(file for file in diffs if file in env["PROMPT"])
+            return CommandOutput(exit_code=0, output=f"worked on {workspaces[workspace_id]}\n")
+        file = workspaces.get(workspace_id)
+        if command.startswith("cat "):
+            return CommandOutput(exit_code=0, output=reports[file] if file else coverage_report({1: 0, 2: 0}))
+        if command.startswith("git diff"):
+            return CommandOutput(exit_code=0, output=diffs[file])
+        return CommandOutput(exit_code=0, output="")
+
+    server = serve(run_command)
+    # The run's own workspace is used through the sync provider, which already runs with its startup config
+    workspace_provider = MagicMock(base_url=server.base_url, workspace_config={"name": "repo"})
+    workspace_provider.run_command_with_output.side_effect = run_command
+    llm_proxy = MagicMock(endpoint="http://localhost:8080")
+    llm_proxy.get_metrics.return_value = []
+    repository = {"name": "repo", "url": "https://github.com/example/repo", "test_command": "run_tests.sh",
+                  "coverage_report_path": "coverage.xml",
+                  "files": [["src/a.py", "tests/test_a.py"], ["src/b.py", "tests/test_b.py"], ["src/c.py", "tests/test_c.py"]]}
+    benchmark = AgentTestBenchmark("run", llm_proxy, workspace_provider, {"command": "agent"}, repository, fan_out=3)
+    benchmark.project = {"token": "token"}
+    benchmark.workspace = {"id": "main"}
+
+    results = benchmark.run()
+
+    assert len(server.created) == 3
+    assert all("workspace_config" not in body for body in server.created_bodies)
+    assert sorted(server.deleted) == sorted(server.created)
+    assert max_agents_running > 1
+    assert results["fan_out"]["merged_files"] == ["src/a.py", "src/b.py"]
+    assert results["fan_out"]["conflicts"] == [{"diff": "src/c.py", "conflicts_with": "src/a.py", "files": ["src/a.py"]}]
+    assert "+def test_b():" in results["git_diff"] and "added at the top" in results["git_diff"]
+    # Only the coverage of the merged diffs counts, the line only src/c.py's run covered stays missed
+    assert summarize_coverage(results["final_coverage_tool_output"]).total_misses == 1
+    assert results["agent_output"].index("worked on src/a.py") < results["agent_output"].index("worked on src/c.py")
@@ -0,0 +1,83 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from agent_test_harness.http_client import HttpClient, LatencyStats
+
+def connection_refused():
+    reason = NewConnectionError(None, "Connection refused")
+    return requests.exceptions.ConnectionError(MaxRetryError(None, "/", reason=reason))
+
+def test_latency_stats():
+    """Test that latency is aggregated per endpoint"""
+    stats = LatencyStats()
+    stats.record("GET health", 0.1)
+    stats.record("GET health", 0.3, error=True)
+    stats.record("POST workspaces", 1.0)
+
+    snapshot = stats.snapshot()
+    assert snapshot["GET health"]["count"] == 2
+    assert snapshot["GET health"]["errors"] == 1
+    assert snapshot["GET health"]["max_time"] == 0.3
+    assert snapshot["GET health"]["mean_time"] == pytest.approx(0.2)
+    assert snapshot["POST workspaces"]["count"] == 1
+
+def test_request_retries_connection_errors():
+    """Test that connections that couldn't be made are retried with backoff, also for non-idempotent requests"""
+    client = HttpClient("http://localhost:1", retries=2, backoff=0.01)
+    response = MagicMock(status_code=200)
+
+    with patch.object(client.session, "request", side_effect=[connection_refused(), response]) as request, \
+         patch("agent_test_harness.http_client.time.sleep") as sleep:
+        assert client.request("POST", "workspaces/ws-1/cmd", endpoint="workspaces/{id}/cmd") is response
+
+    assert request.call_count == 2
+    sleep.assert_called_once()
+    assert 0 <= sleep.call_args.args[0] <= 0.01
+    stats = client.latency.snapshot()["POST workspaces/{id}/cmd"]
+    assert stats["count"] == 2
+    assert stats["errors"] == 1
+
+def test_request_does_not_retry_sent_non_idempotent_requests():
+    """Test that a command whose connection dropped after it was sent is not run again"""
+    client = HttpClient("http://localhost:1", retries=2, backoff=0.01)
+
+    for error in (requests.exceptions.ConnectionError("Connection aborted."), requests.exceptions.ReadTimeout()):
+        with patch.object(client.session, "request", side_effect=error) as request, \
+             patch("agent_test_harness.http_client.time.sleep"):
+            with pytest.raises(type(error)):
+                client.request("POST", "workspaces/ws-1/cmd")
+        assert request.call_count == 1
+
+    with patch.object(client.session, "request", side_effect=[requests.exceptions.ReadTimeout(), MagicMock(status_code=200)]) as request, \
+         patch("agent_test_harness.http_client.time.sleep"):
+        client.request("GET", "workspaces/ws-1")
+    assert request.call_count == 2
+
+def test_request_gives_up_after_retries():
+    """Test that the last connection error is raised once retries are exhausted"""
+    client = HttpClient("http://localhost:1", retries=1, backoff=0.01)
+
+    with patch.object(client.session, "request", side_effect=requests.exceptions.ConnectionError()) as request, \
+         patch("agent_test_harness.http_client.time.sleep"):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            client.request("GET", "health")
+
+    assert request.call_count == 2
+
+def test_backoff_delay_is_capped():
+    """Test that the jittered backoff never exceeds the maximum"""
+    client = HttpClient("http://localhost:1", backoff=1.0, max_backoff=3.0)
+    assert all(0 <= client.backoff_delay(attempt) <= 3.0 for attempt in range(10))
+
+def test_view_shares_session():
+    """Test that a view shares the connection pool but counts latency separately"""
+    client = HttpClient("http://localhost:1", retries=5, backoff=0.5, max_backoff=2.0)
+    view = client.view()
+
+    assert view.session is client.session
+    assert view.latency is not client.latency
+    assert (view.base_url, view.retries, view.backoff, view.max_backoff) == ("http://localhost:1", 5, 0.5, 2.0)
@@ -0,0 +1,45 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import agent_test_harness
+
+# Entry point modules and the time they may take to import, in seconds. Generous, so slow CI machines pass, but well
+# below what importing datasets, pycobertura or requests up front costs.
+IMPORT_BUDGETS = {
+    "agent_test_harness.main": 1.0,
+    "agent_test_harness.test_repository": 1.0,
+    "agent_test_harness.swe_bench": 1.0,
+}
+
+# Dependencies only the code paths that use them may import
+HEAVY_MODULES = ["aiohttp", "datasets", "pandas", "pyarrow", "pycobertura", "requests"]
+
+MEASURE_IMPORT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+duration = time.perf_counter() - start
+print(json.dumps({{"duration": duration, "loaded": [name for name in {heavy_modules!r} if name in sys.modules]}}))
+"""
+
+def measure_import(module):
+    """Import a module in a fresh interpreter and return its import time and the heavy modules it loaded"""
+    env = dict(os.environ)
+    source_dir = os.path.dirname(os.path.dirname(agent_test_harness.__file__))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [source_dir, env.get("PYTHONPATH")]))
+    output = subprocess.run([sys.executable, "-c", MEASURE_IMPORT.format(module=module, heavy_modules=HEAVY_MODULES)],
+                            capture_output=True, text=True, check=True, env=env).stdout
+    return json.loads(output)
+
+@pytest.mark.parametrize("module", sorted(IMPORT_BUDGETS))
+def test_entry_point_import_budget(module):
+    """Test that an entry point starts within its budget without loading heavy dependencies"""
+    # The best of a few imports, so a busy machine doesn't fail the budget
+    measurements = [measure_import(module) for _ in range(3)]
+
+    assert measurements[0]["loaded"] == []
+    assert min(measurement["duration"] for measurement in measurements) < IMPORT_BUDGETS[module]
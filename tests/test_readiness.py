@@ -0,0 +1,51 @@
+import subprocess
+import sys
+import time
+
+import pytest
+import requests
+
+from agent_test_harness.readiness import wait_until_ready
+
+@pytest.fixture
+def sleeper():
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    yield process
+    process.kill()
+    process.wait()
+
+def test_ready_after_retries(sleeper):
+    """Test that readiness polling retries until the check passes and reports the time it took"""
+    attempts = []
+
+    def check():
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise requests.exceptions.ConnectionError()
+        return True
+
+    time_to_ready = wait_until_ready("service", check, sleeper, deadline=5, initial_delay=0.01)
+
+    assert len(attempts) == 3
+    assert time_to_ready >= 0.03
+    # Backoff doubles the delay between polls
+    assert attempts[2] - attempts[1] > attempts[1] - attempts[0]
+
+def test_process_exit_stops_waiting():
+    """Test that a crashing service fails the wait as soon as it exits"""
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(0.2); raise SystemExit(3)"])
+    start_time = time.monotonic()
+
+    with pytest.raises(Exception, match="exited with code 3"):
+        wait_until_ready("service", lambda: False, process, deadline=30, initial_delay=5, max_delay=5)
+
+    assert time.monotonic() - start_time < 2
+
+def test_startup_deadline(sleeper):
+    """Test that a service that never becomes ready fails at the deadline"""
+    start_time = time.monotonic()
+
+    with pytest.raises(Exception, match="did not become ready within"):
+        wait_until_ready("service", lambda: False, sleeper, deadline=0.3, initial_delay=0.05)
+
+    assert time.monotonic() - start_time < 1
@@ -0,0 +1,53 @@
+import json
+import os
+
+import pytest
+
+from agent_test_harness.result_fields import BLOB_KEY, LargeFields, truncate
+from agent_test_harness.results_store import JsonResultsStore, SqliteResultsStore
+
+def test_truncate():
+    """Test that truncation keeps the start and end of a text"""
+    assert truncate("abc", 10) == "abc"
+    assert truncate("a" * 10 + "b" * 80 + "c" * 10, 20) == "a" * 10 + "\n[... 80 characters truncated ...]\n" + "c" * 10
+
+def test_json_store_compresses_large_fields(tmp_path):
+    """Test that large fields are stored compressed next to the result and inflated when it is read"""
+    store = JsonResultsStore(str(tmp_path), LargeFields(threshold=100, max_sizes={"agent_output": 1000}))
+    coverage = "<coverage>" + "<line hits='1'/>" * 1000 + "</coverage>"
+    result = {
+        "agent_name": "agent_a",
+        "result": {"agent_output": "x" * 5000, "final_coverage_tool_output": coverage, "git_diff": "small diff"}
+    }
+    store.add("run-0", result)
+
+    with open(store.path("run-0")) as f:
+        stored = json.load(f)["result"]
+    assert stored["git_diff"] == "small diff"
+    assert stored["final_coverage_tool_output"][BLOB_KEY] == "run-0.final_coverage_tool_output.gz"
+    assert stored["agent_output"]["truncated"] is True
+    assert os.path.getsize(os.path.join(store.blobs_path, "run-0.final_coverage_tool_output.gz")) < len(coverage) / 10
+
+    loaded = store["run-0"]["result"]
+    assert loaded["final_coverage_tool_output"] == coverage
+    assert loaded["agent_output"] == truncate("x" * 5000, 1000)
+    # The caller's result is left as it was
+    assert result["result"]["agent_output"] == "x" * 5000
+
+def test_sqlite_store_applies_max_sizes(tmp_path):
+    """Test that the SQLite store truncates fields above their maximum size"""
+    store = SqliteResultsStore(str(tmp_path / "results.sqlite"), LargeFields(max_sizes={"validation_output": 10}))
+    store.add("run-0", {"instance_id": "a", "validation_output": "y" * 100, "git_diff": "diff"})
+
+    assert store["run-0"]["validation_output"] == truncate("y" * 100, 10)
+    assert store["run-0"]["git_diff"] == "diff"
+
+def test_zstd_requires_zstandard():
+    """Test that zstd compression fails early without the zstandard package"""
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        with pytest.raises(Exception, match="zstandard"):
+            LargeFields(compression="zstd")
+    else:
+        assert LargeFields(compression="zstd").compression == "zstd"
@@ -0,0 +1,143 @@
+import json
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from agent_test_harness.results_store import (INDEX_FILE, JsonResultsStore, ResultsStore, SqliteResultsStore,
+                                              open_results_path)
+
+def test_add_and_load_lazily(tmp_path):
+    """Test that results are indexed when added and read from disk when accessed"""
+    store = JsonResultsStore(str(tmp_path))
+    store.add("run-0", {"agent_name": "agent_a", "result": {"agent_execution_time": 10, "agent_output": "x" * 1000}})
+    store.add("run-1", {"agent_name": "agent_a", "result": {"error": "failed"}})
+
+    assert "run-0" in store
+    assert len(store) == 2
+    assert store["run-0"]["result"]["agent_output"] == "x" * 1000
+    assert [entry["status"] for entry in store.entries()] == ["ok", "error"]
+    assert store.entries()[0]["duration"] == 10
+
+    with open(tmp_path / INDEX_FILE) as f:
+        assert [json.loads(line)["run_name"] for line in f] == ["run-0", "run-1"]
+
+def test_resume_reads_only_the_manifest(tmp_path):
+    """Test that reopening a store does not parse the run files"""
+    store = JsonResultsStore(str(tmp_path))
+    store.add("run-0", {"instance_id": "a"})
+    # A run file that is indexed is never parsed when the store is opened
+    with open(store.path("run-0"), "w") as f:
+        f.write("not json")
+
+    resumed = JsonResultsStore(str(tmp_path))
+    assert list(resumed) == ["run-0"]
+    assert resumed.entries()[0]["instance_id"] == "a"
+
+def test_index_runs_without_manifest(tmp_path):
+    """Test that runs stored before the manifest existed are indexed, and deleted runs are dropped"""
+    with open(tmp_path / "run-0.json", "w") as f:
+        json.dump({"instance_id": "a", "agent_execution_time": 5}, f)
+    with open(tmp_path / INDEX_FILE, "w") as f:
+        f.write(json.dumps({"run_name": "deleted", "status": "ok"}) + "\n")
+        f.write('{"run_name": "cut sh')
+
+    store = JsonResultsStore(str(tmp_path))
+    assert list(store) == ["run-0"]
+    entry = store.entries()[0]
+    assert {key: entry[key] for key in ("run_name", "status", "instance_id", "duration")} == \
+        {"run_name": "run-0", "status": "ok", "instance_id": "a", "duration": 5}
+    assert os.path.exists(tmp_path / INDEX_FILE)
+
+def test_sqlite_store(tmp_path):
+    """Test that the SQLite store round-trips results and answers queries from its indexed columns"""
+    path = str(tmp_path / "results.sqlite")
+    store = SqliteResultsStore(path)
+    store.add("kwaak-1-astropy__astropy-1-0", {"agent_name": "kwaak", "agent_version": "1",
+                                                "instance_id": "astropy__astropy-1", "error": "failed"}, iteration=0)
+    store.add("kwaak-1-astropy__astropy-2-0", {"agent_name": "kwaak", "agent_version": "1",
+                                                "instance_id": "astropy__astropy-2", "git_diff": "diff"}, iteration=0)
+    store.add("kwaak-1-sympy__sympy-1-0", {"agent_name": "kwaak", "agent_version": "1",
+                                            "instance_id": "sympy__sympy-1", "error": "failed"}, iteration=0)
+    store.close()
+
+    store = SqliteResultsStore(path)
+    assert len(store) == 3
+    assert "kwaak-1-sympy__sympy-1-0" in store
+    assert store["kwaak-1-astropy__astropy-2-0"]["git_diff"] == "diff"
+
+    failed = store.query(agent_name="kwaak", instance="astropy__*", status="error")
+    assert [entry["run_name"] for entry in failed] == ["kwaak-1-astropy__astropy-1-0"]
+    # The JSON store answers the same queries from its manifest
+    json_store = JsonResultsStore(str(tmp_path / "runs"))
+    for run_name in store:
+        json_store.add(run_name, store[run_name], iteration=0)
+    assert json_store.query(agent_name="kwaak", instance="astropy__*", status="error") == failed
+
+def test_sqlite_store_parallel_writes(tmp_path):
+    """Test that parallel workers can add results to one database"""
+    store = SqliteResultsStore(str(tmp_path / "results.sqlite"))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for i in range(100):
+            executor.submit(store.add, f"run-{i}", {"instance_id": str(i), "agent_output": "x" * 10000})
+
+    assert len(store) == 100
+    assert sorted(store, key=lambda run_name: int(run_name.split("-")[1])) == [f"run-{i}" for i in range(100)]
+
+def test_incomplete_store_cannot_be_created():
+    """Test that a store missing part of the interface fails when it is created, not when it is used"""
+    class ReadOnlyStore(ResultsStore):
+        def __getitem__(self, run_name):
+            raise KeyError(run_name)
+
+        def __iter__(self):
+            return iter([])
+
+        def __len__(self):
+            return 0
+
+        def entries(self):
+            return []
+
+    with pytest.raises(TypeError):
+        ReadOnlyStore()
+
+def test_open_json_store_read_only(tmp_path):
+    """Test that a run directory opened read-only is read without writing its manifest"""
+    (tmp_path / "runs").mkdir()
+    (tmp_path / "runs" / "run-0.json").write_text(json.dumps({"instance_id": "a"}))
+
+    store = open_results_path(str(tmp_path / "runs"), read_only=True)
+
+    assert store.entries()[0]["run_name"] == "run-0"
+    assert store["run-0"] == {"instance_id": "a"}
+    store.cache_stats("run-0", "key", {})
+    with pytest.raises(Exception, match="read-only"):
+        store.add("run-1", {})
+    assert os.listdir(tmp_path / "runs") == ["run-0.json"]
+    assert len(open_results_path(str(tmp_path / "missing"), read_only=True)) == 0
+    assert not os.path.exists(tmp_path / "missing")
+
+def test_open_sqlite_store_read_only(tmp_path):
+    """Test that a results database opened read-only is read without changing it"""
+    path = str(tmp_path / "results.sqlite")
+    store = SqliteResultsStore(path)
+    store.add("run-0", {"instance_id": "a"})
+    store.close()
+    with open(path, "rb") as f:
+        database = f.read()
+
+    store = open_results_path(path, read_only=True)
+
+    assert store["run-0"] == {"instance_id": "a"}
+    assert [entry["run_name"] for entry in store.query(instance="a")] == ["run-0"]
+    store.cache_stats("run-0", "key", {})
+    assert store.cached_stats("run-0", "key") is None
+    with pytest.raises(Exception, match="read-only"):
+        store.add("run-1", {})
+    store.close()
+    # SQLite may add its shared memory file to read a WAL database, the database itself is unchanged
+    with open(path, "rb") as f:
+        assert f.read() == database
@@ -0,0 +1,57 @@
+from agent_test_harness.benchmark import Benchmark
+from agent_test_harness.results_store import summarize
+from agent_test_harness.scheduling import DEFAULT_RUN_DURATION, DurationEstimator, estimate_makespan, run_duration
+
+def harness_result(agent, url, agent_execution_time, provisioning_time=0):
+    return {
+        "agent_name": agent,
+        "repository_url": url,
+        "result": {"agent_execution_time": agent_execution_time,
+                   "provisioning": {"provisioning_time": provisioning_time}}
+    }
+
+def test_run_duration():
+    """Test that run durations include provisioning and skip runs that never ran the agent"""
+    assert run_duration(harness_result("agent_a", "a", 100, 20)) == 120
+    assert run_duration({"instance_id": "astropy-1", "agent_execution_time": 50}) == 50
+    assert run_duration({"agent_name": "agent_a", "result": {"error": "failed"}}) is None
+
+def test_duration_estimator_fallbacks():
+    """Test that estimates prefer the same agent, then the same instance, then the median of all runs"""
+    estimator = DurationEstimator([summarize(f"run-{i}", result) for i, result in enumerate([
+        harness_result("agent_a", "a", 100),
+        harness_result("agent_a", "a", 200),
+        harness_result("agent_b", "a", 900),
+        harness_result("agent_b", "b", 10),
+    ])])
+
+    assert estimator.estimate({"name": "agent_a"}, {"url": "a"}) == 150
+    assert estimator.estimate({"name": "agent_c"}, {"url": "a"}) == 400
+    assert estimator.estimate({"name": "agent_a"}, {"url": "c"}) == 150
+    assert DurationEstimator([]).estimate({"name": "agent_a"}, {"url": "a"}) == DEFAULT_RUN_DURATION
+
+def test_estimate_makespan():
+    """Test that dispatching long runs first shortens the makespan"""
+    assert estimate_makespan([1, 1, 1, 1, 4], jobs=2) == 6
+    assert estimate_makespan([4, 1, 1, 1, 1], jobs=2) == 4
+
+def test_longest_first_schedule(tmp_path):
+    """Test that the longest_first schedule hands out runs by estimated duration, using earlier campaigns"""
+    history_path = tmp_path / "previous"
+    history_path.mkdir()
+    (history_path / "agent_a-1-slow-0.json").write_text(
+        '{"agent_name": "agent_a", "repository_url": "slow", "result": {"agent_execution_time": 1000}}')
+    (history_path / "agent_a-1-fast-0.json").write_text(
+        '{"agent_name": "agent_a", "repository_url": "fast", "result": {"agent_execution_time": 10}}')
+
+    config = {"results_path": str(tmp_path / "results"), "runs": 1,
+              "schedule": "longest_first", "schedule_history": [str(history_path)]}
+    repositories = [{"name": "fast", "url": "fast"}, {"name": "new", "url": "new"}, {"name": "slow", "url": "slow"}]
+    benchmark = Benchmark("test_writing", config, [{"name": "agent_a", "version": "1"}], repositories)
+
+    run_names = []
+    while next_run := benchmark.next_run():
+        run_names.append(next_run["run_name"])
+
+    # The run without history is assumed to take the median of the known runs
+    assert run_names == ["agent_a-1-slow-0", "agent_a-1-new-0", "agent_a-1-fast-0"]
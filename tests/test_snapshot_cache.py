@@ -0,0 +1,88 @@
+import subprocess
+from unittest.mock import patch
+
+import pytest
+
+from agent_test_harness.snapshot_cache import SnapshotCache, WorkspaceSnapshot
+
+GB = 1024 ** 3
+
+@pytest.fixture
+def docker():
+    """Fake docker CLI where every committed image is 1 GB"""
+    calls = []
+
+    def run(args, **kwargs):
+        calls.append(args)
+        stdout = str(GB) if args[:3] == ["docker", "image", "inspect"] else ""
+        return subprocess.CompletedProcess(args, 0, stdout=stdout, stderr="")
+
+    with patch("agent_test_harness.snapshot_cache.subprocess.run", side_effect=run):
+        yield calls
+
+def test_key_depends_on_all_inputs():
+    """Test that the snapshot key changes with url, commit and setup script"""
+    key = SnapshotCache.key("https://example.com/repo", "abc", "setup")
+
+    assert key == SnapshotCache.key("https://example.com/repo", "abc", "setup")
+    assert key != SnapshotCache.key("https://example.com/other", "abc", "setup")
+    assert key != SnapshotCache.key("https://example.com/repo", "def", "setup")
+    assert key != SnapshotCache.key("https://example.com/repo", "abc", "setup 2")
+
+def test_snapshot_saved_and_restored(tmp_path, docker):
+    """Test that a saved snapshot is restored by the next run and survives a restart"""
+    cache = SnapshotCache(str(tmp_path))
+    snapshot = WorkspaceSnapshot.lookup(cache, "url", "abc", "setup")
+    assert not snapshot.restored
+
+    snapshot.save("container-1")
+    assert ["docker", "commit", "container-1", snapshot.image] in docker
+
+    restored = WorkspaceSnapshot.lookup(SnapshotCache(str(tmp_path)), "url", "abc", "setup")
+    assert restored.restored
+    assert restored.image == snapshot.image
+
+def test_snapshot_resets_run_environment(tmp_path, docker):
+    """Test that the run's environment is reset in the image and a moved branch is keyed by the commit checked out"""
+    cache = SnapshotCache(str(tmp_path))
+    snapshot = WorkspaceSnapshot.lookup(cache, "url", "abc", "setup")
+
+    snapshot.save("container-1", head="def", reset_env=["OPENAI_API_KEY"])
+
+    assert ["docker", "commit", "--change", "ENV OPENAI_API_KEY=", "container-1", snapshot.image] in docker
+    assert snapshot.key == SnapshotCache.key("url", "def", "setup")
+
+def test_lookup_resolves_default_branch(tmp_path):
+    """Test that repositories without a commit are keyed by the commit of their default branch"""
+    cache = SnapshotCache(str(tmp_path))
+    ls_remote = subprocess.CompletedProcess([], 0, stdout="0123abcd\tHEAD\n", stderr="")
+
+    with patch("agent_test_harness.snapshot_cache.subprocess.run", return_value=ls_remote):
+        snapshot = WorkspaceSnapshot.lookup(cache, "url", None, "setup")
+    assert snapshot.key == SnapshotCache.key("url", "0123abcd", "setup")
+
+    unreachable = subprocess.CompletedProcess([], 128, stdout="", stderr="fatal: repository not found")
+    with patch("agent_test_harness.snapshot_cache.subprocess.run", return_value=unreachable):
+        assert WorkspaceSnapshot.lookup(cache, "url", None, "setup") is None
+
+def test_lru_eviction(tmp_path, docker):
+    """Test that the least recently used snapshot is evicted when the cache is full"""
+    cache = SnapshotCache(str(tmp_path), max_size_gb=2)
+    first = cache.save("a", "container-a")
+    second = cache.save("b", "container-b")
+    cache.get("a")
+    cache.save("c", "container-c")
+
+    assert cache.get("a") == first
+    assert cache.get("b") is None
+    assert ["docker", "image", "rm", "-f", second] in docker
+    assert cache.size() == 2 * GB
+
+def test_rebuild_ignores_existing_snapshots(tmp_path, docker):
+    """Test that --rebuild-snapshots misses once per key and then uses the rebuilt snapshot"""
+    SnapshotCache(str(tmp_path)).save("a", "container-a")
+
+    cache = SnapshotCache(str(tmp_path), rebuild=True)
+    assert cache.get("a") is None
+    cache.save("a", "container-a2")
+    assert cache.get("a") is not None
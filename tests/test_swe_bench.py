@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+
+import pytest
+
+from unittest.mock import MagicMock
+
+from agent_test_harness.benchmark import Benchmark
+from agent_test_harness.swe_bench import SWEBenchRunner, export_results, in_shard, merge_results, parse_shard
+from agent_test_harness.swe_bench_types import SWEBenchItem
+
+AGENT_TEMPLATE = {"name": "kwaak", "version": "v1"}
+
+def write_run(results_path, run_name, result):
+    runs_path = os.path.join(results_path, "swe_bench", "runs")
+    os.makedirs(runs_path, exist_ok=True)
+    with open(os.path.join(runs_path, f"{run_name}.json"), "w") as f:
+        json.dump(result, f)
+
+def test_parse_shard():
+    """Test parsing of i/N shard specifications"""
+    assert parse_shard("1/4") == (1, 4)
+    assert parse_shard("4/4") == (4, 4)
+    for shard in ("0/4", "5/4", "1/0", "a/b", "1"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_shard(shard)
+
+def test_shards_partition_instances():
+    """Test that every instance lands in exactly one shard"""
+    instance_ids = [f"astropy__astropy-{i}" for i in range(500)]
+
+    shards = [[instance_id for instance_id in instance_ids if in_shard(instance_id, (index, 4))] for index in range(1, 5)]
+
+    assert sorted(sum(shards, [])) == sorted(instance_ids)
+    assert all(len(shard) > 75 for shard in shards)
+    # The assignment only depends on the instance id
+    assert shards[0] == [instance_id for instance_id in instance_ids if in_shard(instance_id, (1, 4))]
+
+def test_merge_and_export(tmp_path):
+    """Test that shard results are merged into one predictions file and results file"""
+    write_run(str(tmp_path / "shard1"), "kwaak-v1-a-0", {"instance_id": "a", "git_diff": "diff a"})
+    write_run(str(tmp_path / "shard2"), "kwaak-v1-b-0", {"instance_id": "b", "git_diff": "diff b"})
+    write_run(str(tmp_path / "shard2"), "kwaak-v1-c-0", {"instance_id": "c", "error": "failed"})
+
+    results = merge_results([str(tmp_path / "shard1"), str(tmp_path / "shard2" / "swe_bench" / "runs")])
+    assert sorted(results) == ["kwaak-v1-a-0", "kwaak-v1-b-0", "kwaak-v1-c-0"]
+
+    export_results(results, AGENT_TEMPLATE, str(tmp_path))
+    with open(tmp_path / "predictions.jsonl") as f:
+        predictions = [json.loads(line) for line in f]
+    assert predictions == [
+        {"instance_id": "a", "model_name_or_path": "kwaak-v1", "model_patch": "diff a", "run_name": "kwaak-v1-a-0"},
+        {"instance_id": "b", "model_name_or_path": "kwaak-v1", "model_patch": "diff b", "run_name": "kwaak-v1-b-0"},
+    ]
+    with open(tmp_path / "swe_bench_results.json") as f:
+        assert json.load(f) == results
+
+def test_failed_instance_stores_error_result(tmp_path):
+    """Test that an instance that can't be prepared gets an error result and is not handed out again"""
+    item = SWEBenchItem(repo="org/repo", instance_id="org__repo-1", base_commit="abc", patch="", test_patch="",
+                        problem_statement="", hints_text="", created_at="", version="1.0", FAIL_TO_PASS=[],
+                        PASS_TO_PASS=[], environment_setup_commit="def")
+    benchmark = Benchmark("swe_bench", {"results_path": str(tmp_path), "runs": 1}, [AGENT_TEMPLATE], [item])
+    runner = SWEBenchRunner(benchmark, MagicMock(), AGENT_TEMPLATE, jobs=2)
+    runner.prepare_run = MagicMock(side_effect=RuntimeError("setup script failed"))
+
+    runner.run()
+
+    runner.prepare_run.assert_called_once()
+    result = benchmark.results["kwaak-v1-org__repo-1-0"]
+    assert result["error"] == "setup script failed"
+    assert result["instance_id"] == "org__repo-1"
+    assert benchmark.next_run() is None
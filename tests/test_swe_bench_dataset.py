@@ -0,0 +1,76 @@
+import json
+import os
+
+import datasets
+import pytest
+
+from agent_test_harness.swe_bench_dataset import SWEBenchDataset
+
+def make_row(instance_id, repo, version):
+    return {
+        "repo": repo,
+        "instance_id": instance_id,
+        "base_commit": "abc",
+        "patch": "",
+        "test_patch": "",
+        "problem_statement": "",
+        "hints_text": "",
+        "created_at": "",
+        "version": version,
+        "FAIL_TO_PASS": json.dumps([f"{instance_id}::test_fail"]),
+        "PASS_TO_PASS": json.dumps([]),
+        "environment_setup_commit": "def",
+        # Columns the harness doesn't use are dropped
+        "difficulty": "<15 min fix",
+    }
+
+ROWS = [
+    make_row("sympy__sympy-2", "sympy/sympy", "1.1"),
+    make_row("django__django-1", "django/django", "3.0"),
+    make_row("sympy__sympy-1", "sympy/sympy", "1.0"),
+    make_row("sympy__sympy-3", "sympy/sympy", "1.1"),
+]
+
+@pytest.fixture
+def downloads(monkeypatch):
+    calls = []
+
+    def load_dataset(name, split):
+        calls.append((name, split))
+        return ROWS
+
+    monkeypatch.setattr(datasets, "load_dataset", load_dataset)
+    return calls
+
+def test_indexes():
+    """Test that items are parsed and indexed by instance id, repository and version"""
+    dataset = SWEBenchDataset.from_rows(ROWS)
+
+    assert [item.instance_id for item in dataset.items] == ["django__django-1", "sympy__sympy-1", "sympy__sympy-2", "sympy__sympy-3"]
+    assert dataset.get("sympy__sympy-2").FAIL_TO_PASS == ["sympy__sympy-2::test_fail"]
+    assert dataset.get("unknown") is None
+    assert dataset.repos() == ["django/django", "sympy/sympy"]
+    assert [item.instance_id for item in dataset.for_repo("sympy/sympy", "1.1")] == ["sympy__sympy-2", "sympy__sympy-3"]
+    assert [item.instance_id for item in dataset.first_per_repo(2)] == ["django__django-1", "sympy__sympy-1", "sympy__sympy-2"]
+
+def test_load_uses_cache(tmp_path, downloads):
+    """Test that the dataset is only downloaded when it isn't cached or a refresh is asked for"""
+    first = SWEBenchDataset.load("org/swe-bench", "test", str(tmp_path))
+    second = SWEBenchDataset.load("org/swe-bench", "test", str(tmp_path))
+
+    assert downloads == [("org/swe-bench", "test")]
+    assert os.path.exists(tmp_path / "org__swe-bench-test.pickle")
+    assert [item.instance_id for item in second.items] == [item.instance_id for item in first.items]
+    assert second.for_repo("django/django")[0].version == "3.0"
+
+    SWEBenchDataset.load("org/swe-bench", "test", str(tmp_path), refresh=True)
+    assert len(downloads) == 2
+
+def test_load_rebuilds_unreadable_cache(tmp_path, downloads):
+    """Test that a corrupt cache file is replaced by a fresh download"""
+    (tmp_path / "org__swe-bench-test.pickle").write_bytes(b"not a pickle")
+
+    dataset = SWEBenchDataset.load("org/swe-bench", "test", str(tmp_path))
+
+    assert len(dataset) == 4
+    assert len(downloads) == 1
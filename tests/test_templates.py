@@ -0,0 +1,72 @@
+import os
+
+import yaml
+
+from agent_test_harness.templates import AGENTS, PLATFORMS, REPOSITORIES, TemplateRegistry
+
+def write_template(root, template_type, name, template):
+    path = root / template_type / f"{name}.yaml"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(yaml.dump(template))
+    return path
+
+def test_load_returns_copies(tmp_path):
+    """Test that a template is parsed once and every lookup gets its own copy"""
+    write_template(tmp_path, AGENTS, "agent", {"name": "agent", "env": {"A": "1"}})
+    registry = TemplateRegistry(str(tmp_path))
+
+    first = registry.load(AGENTS, "agent")
+    first["env"]["A"] = "changed"
+
+    assert registry.load(AGENTS, "agent") == {"name": "agent", "env": {"A": "1"}}
+    assert list(registry.compiled) == [registry.path(AGENTS, "agent")]
+    assert registry.load(AGENTS, "missing") is None
+
+def test_load_reparses_changed_templates(tmp_path):
+    """Test that a template is parsed again when its file changes"""
+    path = write_template(tmp_path, PLATFORMS, "python", {"test_command": "pytest"})
+    registry = TemplateRegistry(str(tmp_path))
+    assert registry.load(PLATFORMS, "python") == {"test_command": "pytest"}
+
+    path.write_text(yaml.dump({"test_command": "pytest -x"}))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert registry.load(PLATFORMS, "python") == {"test_command": "pytest -x"}
+
+def test_resolve_repository(tmp_path):
+    """Test that a repository is merged with its template and platform, with the config entry taking precedence"""
+    write_template(tmp_path, REPOSITORIES, "swe-bench/repo_1.0", {"platform": "python", "url": "https://example.com"})
+    platform = write_template(tmp_path, PLATFORMS, "python", {"test_command": "pytest", "url": "platform"})
+    registry = TemplateRegistry(str(tmp_path))
+    overrides = {"name": "swe-bench/repo_1.0", "test_command": "tox"}
+
+    repository = registry.resolve(REPOSITORIES, overrides)
+    repository["test_command"] = "changed"
+
+    assert registry.resolve(REPOSITORIES, overrides) == {
+        "name": "swe-bench/repo_1.0", "platform": "python", "url": "platform", "test_command": "tox"}
+    assert len(registry.resolved) == 1
+
+    platform.write_text(yaml.dump({"test_command": "pytest", "coverage_command": "coverage"}))
+    assert registry.resolve(REPOSITORIES, overrides)["coverage_command"] == "coverage"
+
+def test_resolve_by_loader(tmp_path):
+    """Test that entries resolved with different loaders are cached separately"""
+    write_template(tmp_path, AGENTS, "agent", {"command": "agent"})
+    registry = TemplateRegistry(str(tmp_path))
+
+    def load_other(template_type, name):
+        return {"command": "other"}
+
+    assert registry.resolve(AGENTS, {"name": "agent"})["command"] == "agent"
+    assert registry.resolve(AGENTS, {"name": "agent"}, load_other)["command"] == "other"
+    assert registry.resolve(AGENTS, {"name": "agent"})["command"] == "agent"
+
+def test_shared_registry():
+    """Test that the bundled templates are loaded through one registry"""
+    registry = TemplateRegistry.shared()
+
+    assert registry is TemplateRegistry.shared()
+    assert registry.load(AGENTS, "kwaak") is not None
+    assert registry.load(REPOSITORIES, "swe-bench/missing_0.0") is None
@@ -0,0 +1,112 @@
+import json
+
+from unittest.mock import MagicMock
+
+from agent_test_harness.agent_test_benchmark import AgentTestBenchmark
+from agent_test_harness.templates import PLATFORMS, TemplateRegistry
+from agent_test_harness.test_impact import TestImpact, impact_test_command, is_test_file, supports_test_impact
+from agent_test_harness.workspace_provider import CommandOutput
+
+CONTEXTS = json.dumps({
+    "files": {
+        "src/a.py": {"contexts": {"1": [""], "2": ["tests/test_a.py::test_x|run", "tests/test_shared.py::TestS::test_y|setup"]}},
+        "src/b.py": {"contexts": {"1": ["tests/test_b.py::test_z|run"]}},
+        "./src/c.py": {"contexts": {"1": [""]}},
+    }
+})
+
+REPOSITORY = {
+    "name": "repo",
+    "url": "https://github.com/example/repo",
+    "test_command": "run_tests.sh",
+    "coverage_report_path": "coverage.xml",
+    "test_contexts_command": "run_tests_with_contexts.sh",
+    "coverage_contexts_path": "coverage-contexts.json",
+    "impact_test_command": "pytest {tests}",
+    "files": [["src/a.py", "tests/test_a.py"], ["src/c.py", "tests/test_c.py"], ["src/b.py", "tests/test_b.py"]],
+}
+
+def test_is_test_file():
+    """Test that test modules are recognized by their names"""
+    assert is_test_file("tests/test_a.py")
+    assert is_test_file("pkg/a_test.py")
+    assert not is_test_file("src/a.py")
+    assert not is_test_file("tests/test_data.json")
+
+def test_tests_for_changes():
+    """Test that the tests covering the changed and target files, and changed test files, are selected"""
+    impact = TestImpact.from_coverage_json(CONTEXTS)
+
+    assert impact.tests_by_file["src/c.py"] == set()
+    assert impact.tests_for([], "src/a.py") == ["tests/test_a.py", "tests/test_shared.py"]
+    assert impact.tests_for(["src/b.py", "tests/test_new.py"], "src/c.py") == ["tests/test_b.py", "tests/test_new.py"]
+    assert impact.tests_for(["README.md"], "src/c.py") == []
+
+def test_impact_test_command():
+    """Test that the selected test files are quoted into the template's command"""
+    assert impact_test_command(REPOSITORY, ["tests/test a.py", "tests/test_b.py"]) == "pytest 'tests/test a.py' tests/test_b.py"
+    assert supports_test_impact(REPOSITORY)
+    assert not supports_test_impact({"test_command": "run_tests.sh"})
+
+def make_benchmark(changed_files):
+    commands = []
+
+    def run_command(workspace_id, command, env):
+        command = command.split(" && ", 1)[1]
+        commands.append(command)
+        if "rev-parse" in command:
+            return CommandOutput(exit_code=0, output="abc\n")
+        if command == "cat coverage-contexts.json":
+            return CommandOutput(exit_code=0, output=CONTEXTS)
+        if command.startswith("cat "):
+            return CommandOutput(exit_code=0, output="<coverage/>")
+        if command.startswith("git diff --name-only"):
+            return CommandOutput(exit_code=0, output=changed_files.pop(0))
+        return CommandOutput(exit_code=0, output="")
+
+    workspace_provider = MagicMock()
+    workspace_provider.run_command_with_output.side_effect = run_command
+    llm_proxy = MagicMock()
+    llm_proxy.get_metrics.return_value = []
+    benchmark = AgentTestBenchmark("run", llm_proxy, workspace_provider, {"command": "agent"}, REPOSITORY,
+                                   test_impact=True)
+    benchmark.project = {"token": "token"}
+    benchmark.workspace = {"id": "workspace"}
+    return benchmark, commands
+
+def test_platform_contexts_command_fails_with_tests():
+    """Test that the python platform's contexts command fails, leaving no contexts file, when pytest fails"""
+    platform = TemplateRegistry.shared().load(PLATFORMS, "python3-venv")
+    command = platform["test_contexts_command"]
+
+    assert ";" not in command
+    assert command.startswith("rm -f $PROJECT_ROOT/coverage-contexts.json && ")
+    assert "--cov-context=test && coverage json" in command
+
+def test_run_with_test_impact():
+    """Test that only impacted tests run after each file, and the full suite once at the end"""
+    benchmark, commands = make_benchmark(["tests/test_a.py\n", "", "src/a.py\n"])
+
+    results = benchmark.run()
+
+    test_commands = [command for command in commands if command.startswith(("run_tests", "pytest"))]
+    assert test_commands == [
+        "run_tests_with_contexts.sh",
+        "pytest tests/test_a.py tests/test_shared.py",
+        # Nothing covers src/c.py and nothing changed
+        "pytest tests/test_a.py tests/test_b.py tests/test_shared.py",
+        "run_tests.sh",
+    ]
+    assert results["initial_coverage_tool_output"] == "<coverage/>"
+    assert results["final_coverage_tool_output"] == "<coverage/>"
+    assert results["test_impact"] == {"iterations": 3, "selected_tests": 5, "skipped_runs": 1}
+
+def test_run_without_test_impact():
+    """Test that the full suite runs after every file when test impact is off"""
+    benchmark, commands = make_benchmark([])
+    benchmark.test_impact = False
+
+    results = benchmark.run()
+
+    assert [command for command in commands if command.startswith(("run_tests", "pytest"))] == ["run_tests.sh"] * 4
+    assert "test_impact" not in results
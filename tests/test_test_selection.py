@@ -0,0 +1,126 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from agent_test_harness.agent_test_benchmark import AgentTestBenchmark
+from agent_test_harness.swe_bench import get_repository_template
+from agent_test_harness.swe_bench_types import SWEBenchItem
+from agent_test_harness.test_selection import (FULL, TARGETED, estimate_time_saved, patch_files, selection_arguments,
+                                               targeted_test_command)
+from agent_test_harness.workspace_provider import CommandOutput
+
+TEST_PATCH = """diff --git a/tests/queries/test_q.py b/tests/queries/test_q.py
+--- a/tests/queries/test_q.py
++++ b/tests/queries/test_q.py
+@@ -1 +1 @@
+-a
++b
+diff --git a/sympy/core/tests/test_basic.py b/sympy/core/tests/test_basic.py
+"""
+
+def make_item(fail_to_pass, pass_to_pass, repo="psf/requests", version="2.0"):
+    return SWEBenchItem(repo=repo, instance_id="psf__requests-1", base_commit="abc", patch="", test_patch=TEST_PATCH,
+                        problem_statement="", hints_text="", created_at="", version=version,
+                        FAIL_TO_PASS=fail_to_pass, PASS_TO_PASS=pass_to_pass, environment_setup_commit="")
+
+def test_patch_files():
+    """Test that the files of a patch are listed once, in order"""
+    assert patch_files(TEST_PATCH + TEST_PATCH) == ["tests/queries/test_q.py", "sympy/core/tests/test_basic.py"]
+
+def test_pytest_selection():
+    """Test that pytest gets the exact node ids, or their files when the ids can't be passed back"""
+    item = make_item(["test_a.py::test_x"], ["test_a.py::test_y", "test_b.py::TestB::test_z[1]", "test_a.py::test_x"])
+    assert selection_arguments("pytest", item) == ["test_a.py::test_x", "test_a.py::test_y", "test_b.py::TestB::test_z[1]"]
+
+    item = make_item(["test_a.py::test_x[a b]"], ["test_b.py::test_y"])
+    assert selection_arguments("pytest", item) == ["test_a.py", "test_b.py"]
+
+def test_django_selection():
+    """Test that Django test ids become runtests.py labels, or the test patch modules for described tests"""
+    item = make_item(["test_q (queries.test_q.QTests)"], ["test_r (queries.tests.RTests)"])
+    assert selection_arguments("django", item) == ["queries.test_q.QTests.test_q", "queries.tests.RTests.test_r"]
+
+    item = make_item(["test_q (queries.test_q.QTests.test_q)"], ["test_r (queries.tests.RTests)"])
+    assert selection_arguments("django", item) == ["queries.test_q.QTests.test_q", "queries.tests.RTests.test_r"]
+
+    item = make_item(["Described by its docstring."], ["test_r (queries.tests.RTests)"])
+    assert selection_arguments("django", item) == ["queries.test_q", "sympy.core.tests.test_basic"]
+
+def test_targeted_test_command():
+    """Test that the selected tests are quoted into the template's command"""
+    repository = {"targeted_test_command": "pytest -rA {tests}"}
+    item = make_item(["test_a.py::test_x"], ["test_a.py::test_$y"])
+
+    assert targeted_test_command(repository, item) == "pytest -rA test_a.py::test_x 'test_a.py::test_$y'"
+    assert targeted_test_command({}, item) is None
+    assert targeted_test_command(repository, make_item([], [])) is None
+    with pytest.raises(ValueError):
+        targeted_test_command({**repository, "test_selection": "nose"}, item)
+
+def test_templates_declare_test_selection():
+    """Test that the SWE-bench templates for big suites can select tests"""
+    for repo, version, test_selection in (("sympy/sympy", "1.11", "sympy"), ("django/django", "3.2", "django"),
+                                          ("psf/requests", "2.11", "pytest")):
+        template = get_repository_template(repo, version)
+        assert template["test_selection"] == test_selection
+        assert template["targeted_test_command"].endswith(" {tests}")
+
+def make_benchmark(outputs, targeted_tests=True):
+    workspace_provider = MagicMock()
+    workspace_provider.run_command_with_output.side_effect = [CommandOutput(exit_code=1, output=output) for output in outputs]
+    repository = {"name": "requests", "url": "https://github.com/psf/requests", "test_command": "run_tests.sh",
+                  "targeted_test_command": "pytest -rA {tests}"}
+    benchmark = AgentTestBenchmark("run", MagicMock(), workspace_provider, {"command": "agent"}, repository,
+                                   swebench_item=make_item(["test_a.py::test_x"], ["test_a.py::test_y"]),
+                                   targeted_tests=targeted_tests)
+    benchmark.project = {"token": "token"}
+    benchmark.workspace = {"id": "workspace"}
+    return benchmark, workspace_provider
+
+def test_targeted_run():
+    """Test that only the instance's tests run when the template can select them"""
+    benchmark, workspace_provider = make_benchmark(["FAILED test_a.py::test_x - assert\nPASSED test_a.py::test_y\n"])
+
+    _, test_results = benchmark.run_swebench_tests()
+
+    assert test_results.failed == {"test_a.py::test_x"}
+    command = workspace_provider.run_command_with_output.call_args[0][1]
+    assert command.endswith("pytest -rA test_a.py::test_x test_a.py::test_y")
+    assert benchmark.results["test_selection"]["mode"] == TARGETED
+    assert benchmark.results["test_selection"]["invocations"] == 1
+
+def test_targeted_run_falls_back_to_full_suite():
+    """Test that the full test command runs when the targeted run reports no results"""
+    benchmark, workspace_provider = make_benchmark(["ERROR: not found: test_a.py::test_x", "PASSED test_a.py::test_y\n"])
+
+    _, test_results = benchmark.run_swebench_tests()
+
+    assert test_results.passed == {"test_a.py::test_y"}
+    assert workspace_provider.run_command_with_output.call_args[0][1].endswith("run_tests.sh")
+    assert benchmark.results["test_selection"]["mode"] == FULL
+
+def test_full_run_without_targeted_tests():
+    """Test that the full test command runs when targeted tests are not enabled"""
+    benchmark, workspace_provider = make_benchmark(["PASSED test_a.py::test_y\n"], targeted_tests=False)
+
+    benchmark.run_swebench_tests()
+
+    assert workspace_provider.run_command_with_output.call_count == 1
+    assert benchmark.results["test_selection"]["mode"] == FULL
+
+def test_estimate_time_saved():
+    """Test that targeted runs are compared to the average full run of their template"""
+    def result(template, mode, test_time, invocations=2):
+        return {"test_selection": {"template": template, "mode": mode, "test_time": test_time, "invocations": invocations}}
+
+    results = [result("sympy@1.11", TARGETED, 20.0), result("sympy@1.11", TARGETED, 40.0),
+               result("django@3.2", TARGETED, 10.0), {"error": "failed"}]
+    history = [result("sympy@1.11", FULL, 600.0), result("sympy@1.11", FULL, 400.0, invocations=1),
+               result("sympy@1.11", TARGETED, 1.0)]
+
+    saved = estimate_time_saved(results, history)
+
+    assert saved["targeted_runs"] == 3
+    assert saved["estimated_runs"] == 2
+    # A full sympy invocation takes (600 + 400) / 3 seconds, each targeted run had two
+    assert saved["saved_time"] == pytest.approx(2 * (2 * 1000 / 3) - 60.0)
@@ -3,7 +3,7 @@
 import pytest
 import json
 from datasets import load_dataset
-from agent_test_harness.test_validation import parse_test_results, validate_test_results, TestResults
+from agent_test_harness.test_validation import missing_tests, parse_test_results, validate_test_results, TestResults
 from agent_test_harness.swe_bench_types import SWEBenchItem
 
 
@@ -55,6 +55,100 @@ def test_validate_test_results():
     )
 
 
+def test_parse_pytest_summary_and_verbose_output():
+    """Test that the pytest -rA summary and -v result lines are both recognized."""
+    output = (
+        "tests/test_a.py::test_one PASSED                                  [ 33%]\n"
+        "tests/test_a.py::test_two[x - y] FAILED                           [ 66%]\n"
+        "=========================== short test summary info ============================\n"
+        "PASSED tests/test_a.py::test_one\n"
+        "FAILED tests/test_a.py::test_two[x - y] - AssertionError: 1 != 2\n"
+        "ERROR tests/test_b.py::test_setup - RuntimeError\n"
+        "XFAIL tests/test_b.py::test_known - reason\n"
+    )
+
+    results = parse_test_results(output)
+
+    assert results.passed == {"tests/test_a.py::test_one", "tests/test_b.py::test_known"}
+    assert results.failed == {"tests/test_a.py::test_two[x - y]", "tests/test_b.py::test_setup"}
+    assert results.format == "pytest"
+    assert results.output == output
+
+
+def test_parse_pytest_summary_requires_test_ids():
+    """Test that lines starting with a status are only read as results when they name a test."""
+    output = (
+        "ERROR connecting to the database, retrying\n"
+        "PASSED checks: 3\n"
+        "ERROR connecting to db.py - timeout\n"
+        "PASSED tests/test_a.py::test_one\n"
+        "FAILED tests/test_a.py::test_two[a b] - AssertionError\n"
+        "ERROR tests/test_b.py - ImportError\n"
+    )
+
+    results = parse_test_results(output)
+
+    assert results.passed == {"tests/test_a.py::test_one"}
+    assert results.failed == {"tests/test_a.py::test_two[a b]", "tests/test_b.py"}
+
+
+def test_parse_unittest_and_sympy_output():
+    """Test that Django/unittest verbose output and sympy's test runner output are recognized."""
+    unittest_results = parse_test_results(
+        "test_add (utils.tests.MathTests) ... ok\n"
+        "test_sub (utils.tests.MathTests)\nDocstring line ... FAIL\n"
+        "test_div (utils.tests.MathTests) ... ERROR\n"
+        "test_skip (utils.tests.MathTests) ... skipped 'no db'\n"
+    )
+    assert unittest_results.passed == {"test_add (utils.tests.MathTests)"}
+    assert unittest_results.failed == {"test_sub (utils.tests.MathTests)", "test_div (utils.tests.MathTests)"}
+    assert unittest_results.format == "unittest"
+
+    sympy_results = parse_test_results("test_sqrt ok\ntest_log F\ntest_exp E\n")
+    assert sympy_results.passed == {"test_sqrt"}
+    assert sympy_results.failed == {"test_log", "test_exp"}
+
+
+def test_parse_junit_xml():
+    """Test that JUnit XML reports are detected and parsed into pytest node ids."""
+    report = """<?xml version="1.0" encoding="utf-8"?>
+<testsuites><testsuite name="pytest" tests="4">
+<testcase classname="tests.test_a.TestA" name="test_one" file="tests/test_a.py" line="3"/>
+<testcase classname="tests.test_a" name="test_two" file="tests/test_a.py" line="9"><failure message="boom">trace</failure></testcase>
+<testcase classname="tests.test_b" name="test_three"><error message="setup"/></testcase>
+<testcase classname="tests.test_b" name="test_four"><skipped message="later"/></testcase>
+</testsuite></testsuites>
+"""
+
+    results = parse_test_results(report)
+
+    assert results.format == "junit"
+    assert results.passed == {"tests/test_a.py::TestA::test_one"}
+    assert results.failed == {"tests/test_a.py::test_two", "tests.test_b::test_three"}
+
+
+def test_parse_test_results_from_lines(tmp_path):
+    """Test that results can be parsed from an open log file without reading it into memory first."""
+    log_path = tmp_path / "tests.log"
+    log_path.write_text("collected 2 items\nPASSED test_x.py::test_a\nFAILED test_x.py::test_b - oops\n")
+
+    with open(log_path) as f:
+        results = parse_test_results(f)
+
+    assert results.passed == {"test_x.py::test_a"}
+    assert results.failed == {"test_x.py::test_b"}
+
+
+def test_validate_many_tests_is_set_based():
+    """Test that validation of thousands of expected tests reports the missing ones in order."""
+    passed = [f"test_{i}" for i in range(20000)]
+    results = TestResults(passed=passed, failed=["test_broken"])
+
+    assert isinstance(results.passed, set)
+    assert validate_test_results(results, fail_to_pass=["test_broken"], pass_to_pass=passed)
+    assert missing_tests(["test_missing_b", "test_1", "test_missing_a"], results.passed) == ["test_missing_b", "test_missing_a"]
+
+
 def test_validate_swebench_item():
     """Test validation using actual SWE-bench dataset item."""
     # Load the dataset and find the requests item
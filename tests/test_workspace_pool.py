@@ -0,0 +1,69 @@
+import threading
+import time
+
+from unittest.mock import MagicMock
+
+from agent_test_harness.workspace_pool import WorkspacePool, provisioning_stats
+
+def run_source(count):
+    runs = iter([{"run_name": f"run-{i}"} for i in range(count)])
+    lock = threading.Lock()
+
+    def next_run():
+        with lock:
+            return next(runs, None)
+    return next_run
+
+def test_provisioning_stats():
+    """Test that only provisioning that did not delay the run counts as saved"""
+    assert provisioning_stats(10.0, 2.0)["saved_time"] == 8.0
+    assert provisioning_stats(10.0, 10.0)["saved_time"] == 0.0
+
+def test_pool_reads_ahead():
+    """Test that the pool provisions upcoming runs while the current one executes"""
+    prepared_runs = []
+
+    def prepare(next_run):
+        prepared_runs.append(next_run["run_name"])
+        return MagicMock()
+
+    pool = WorkspacePool(run_source(5), prepare, size=2, lookahead=3)
+    first = pool.next_run()
+    # Give the background provisioning a moment to catch up
+    time.sleep(0.1)
+
+    assert first["run_name"] == "run-0"
+    assert "prepared" in first
+    assert sorted(prepared_runs) == ["run-0", "run-1", "run-2", "run-3"]
+    pool.close()
+
+def test_pool_hands_out_every_run_in_order():
+    """Test that every run is handed out once with its provisioning stats"""
+    def prepare(next_run):
+        time.sleep(0.01)
+        return MagicMock()
+
+    pool = WorkspacePool(run_source(4), prepare, size=2, lookahead=2)
+    runs = []
+    while next_run := pool.next_run():
+        runs.append(next_run)
+    pool.close()
+
+    assert [run["run_name"] for run in runs] == ["run-0", "run-1", "run-2", "run-3"]
+    assert all(run["provisioning"]["provisioning_time"] > 0 for run in runs)
+
+def test_pool_reports_prepare_errors_and_stops_unused():
+    """Test that preparation errors are handed to the run and unused workspaces are stopped on close"""
+    prepared = MagicMock()
+
+    def prepare(next_run):
+        if next_run["run_name"] == "run-0":
+            raise Exception("setup failed")
+        return prepared
+
+    pool = WorkspacePool(run_source(3), prepare, size=1, lookahead=2)
+    first = pool.next_run()
+    assert str(first["prepare_error"]) == "setup failed"
+
+    pool.close()
+    assert prepared.stop.call_count == 2
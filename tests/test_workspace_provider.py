@@ -0,0 +1,99 @@
+import base64
+import subprocess
+
+from unittest.mock import MagicMock
+
+from agent_test_harness.workspace_provider import SharedWorkspaceProvider, log_excerpt, workspace_config
+
+def test_workspace_config():
+    """Test that the workspace config mounts the repository at its name"""
+    config = workspace_config("run", {"name": "todolist", "url": "https://example.com/todolist.git"}, "echo setup")
+
+    assert config == {
+        "name": "run",
+        "repositories": [{"url": "https://example.com/todolist.git", "path": "/todolist"}],
+        "setup_script": "echo setup"
+    }
+
+def json_response(body, status_code=200):
+    response = MagicMock(status_code=status_code)
+    response.json.return_value = body
+    return response
+
+def test_shared_workspace_provider():
+    """Test that a shared provider creates workspaces with the run's config and deletes them on stop"""
+    daemon = MagicMock(running=True, port=1234, base_url="http://localhost:1234")
+    http = daemon.http.view.return_value
+    http.request.side_effect = [json_response({"id": "ws-1"}), json_response({"id": "ws-2"}),
+                                json_response({"exit_code": 0, "output": "file"}),
+                                json_response({}), json_response({})]
+    repository = {"name": "todolist", "url": "https://example.com/todolist.git"}
+
+    provider = SharedWorkspaceProvider(daemon, "run", repository, "echo setup")
+    provider.run()
+    provider.create_workspace(env={"A": "1"})
+    provider.create_workspace(env={"A": "2"})
+    output = provider.run_command_with_output("ws-1", "ls")
+    assert output.output == "file"
+
+    create_call = http.request.call_args_list[1]
+    assert create_call.args == ("POST", "workspaces")
+    assert create_call.kwargs["json"] == {"env": {"A": "2"}, "workspace_config": provider.workspace_config}
+
+    provider.stop()
+    delete_calls = http.request.call_args_list[3:]
+    assert sorted(call.args[1] for call in delete_calls) == ["workspaces/ws-1", "workspaces/ws-2"]
+    daemon.stop.assert_not_called()
+
+def test_run_command_streaming(tmp_path):
+    """Test that streamed output is appended to the log file chunk by chunk until the command exits"""
+    daemon = MagicMock(running=True, port=1234, base_url="http://localhost:1234")
+    http = daemon.http.view.return_value
+    # (exit code file, chunk) per poll, a full chunk is read again without waiting for the exit code
+    polls = [("", b"hel"), ("", b"lo "), ("", b"w"), ("3", b"orl"), ("3", b"d\n")]
+    http.request.side_effect = [json_response({"exit_code": 0, "output": ""})] + [
+        json_response({"exit_code": 0, "output": f"{status}\n{base64.b64encode(chunk).decode()}"})
+        for status, chunk in polls
+    ] + [json_response({"exit_code": 0, "output": ""})]
+    provider = SharedWorkspaceProvider(daemon, "run", {"name": "todolist", "url": "u"}, "echo setup")
+    log_path = str(tmp_path / "logs" / "run.log")
+
+    output = provider.run_command_streaming("ws-1", "kwaak", {"A": "1"}, log_path, chunk_size=3, poll_interval=0)
+
+    assert output.exit_code == 3
+    assert output.output == "hello world\n"
+    assert output.log_path == log_path
+    with open(log_path) as f:
+        assert f.read() == "hello world\n"
+    start_command = http.request.call_args_list[0].kwargs["json"]
+    assert start_command["cmd"].startswith("nohup bash -c '(kwaak); echo $? > ")
+    assert start_command["env"] == {"A": "1"}
+
+def test_run_command_streaming_runs_bash(tmp_path):
+    """Test that streamed commands can use bash syntax, as the agent templates do"""
+    daemon = MagicMock(running=True, port=1234, base_url="http://localhost:1234")
+    http = daemon.http.view.return_value
+
+    def run_locally(method, path, endpoint=None, json=None):
+        # The workspace runs commands with sh, like a POSIX shell in the container
+        result = subprocess.run(["sh", "-c", json["cmd"]], capture_output=True, text=True, env=json["env"], cwd=tmp_path)
+        return json_response({"exit_code": result.returncode, "output": result.stdout})
+
+    http.request.side_effect = run_locally
+    (tmp_path / "env").write_text("export GREETING=hello\n")
+    provider = SharedWorkspaceProvider(daemon, "run", {"name": "todolist", "url": "u"}, "echo setup")
+    log_path = str(tmp_path / "run.log")
+
+    output = provider.run_command_streaming("ws-1", f"source {tmp_path}/env && [[ -n $GREETING ]] && echo $GREETING",
+                                            {"PATH": "/usr/bin:/bin"}, log_path, poll_interval=0.01)
+
+    assert output.exit_code == 0
+    assert output.output == "hello\n"
+
+def test_log_excerpt(tmp_path):
+    """Test that long logs are cut down to their start and end"""
+    path = tmp_path / "run.log"
+    path.write_text("a" * 100 + "b" * 1000 + "c" * 100)
+
+    assert log_excerpt(str(path), size=1000) == "a" * 100 + "b" * 1000 + "c" * 100
+    assert log_excerpt(str(path), size=100) == "a" * 100 + "\n[... 1000 bytes omitted, see log file ...]\n" + "c" * 100